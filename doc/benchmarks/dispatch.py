@@ -0,0 +1,115 @@
+# Copyright (c) 2011 Arjan Scherpenisse
+# See LICENSE for details.
+
+"""
+Micro-benchmark for L{sparked.events.EventDispatcher.dispatch}.
+
+Registers N different queries (spread over a few priorities) on a
+dispatcher and measures the time it takes to dispatch one event which
+has a single observer. The 'before' column uses the linear scan over
+all queries which the dispatcher used to do; the 'after' column uses
+the current, indexed dispatcher.
+
+The second table dispatches an event on the innermost dispatcher of a
+chain of nested dispatchers (see C{setEventParent}) in which every
+dispatcher has 100 queries, and only the outermost dispatcher observes
+the event.
+
+Run it like this::
+
+  python doc/benchmarks/dispatch.py
+"""
+
+import timeit
+
+from twisted.words.xish import utility
+
+from sparked import events
+
+
+class LinearEventDispatcher(utility.EventDispatcher):
+    """
+    The old implementation of the dispatcher: sorts the priorities and
+    scans all queries on every dispatch.
+    """
+
+    def __init__(self):
+        utility.EventDispatcher.__init__(self, "")
+
+
+    parent = None
+
+    def setEventParent(self, p):
+        self.parent = p
+
+
+    def dispatch(self, event, *arg, **kwarg):
+        foundTarget = False
+        self._dispatchDepth += 1
+        observers = self._eventObservers
+        priorities = list(observers.keys())
+        priorities.sort()
+        priorities.reverse()
+        emptyLists = []
+        for priority in priorities:
+            for query, callbacklist in observers[priority].items():
+                if query == event:
+                    callbacklist.callback(*arg, **kwarg)
+                    foundTarget = True
+                    if callbacklist.isEmpty():
+                        emptyLists.append((priority, query))
+        for priority, query in emptyLists:
+            del observers[priority][query]
+        self._dispatchDepth -= 1
+        if self._dispatchDepth == 0:
+            for f in self._updateQueue:
+                f()
+            self._updateQueue = []
+        if self.parent:
+            self.parent.dispatch(event, *arg, **kwarg)
+        return foundTarget
+
+
+
+def observer(*a, **kw):
+    pass
+
+
+def setup(cls, n):
+    d = cls()
+    for i in range(n):
+        d.addObserver("event-%d" % i, observer, i % 4)
+    return d
+
+
+def measure(cls, n, number):
+    d = setup(cls, n)
+    t = timeit.Timer(lambda: d.dispatch("event-0", "tag", serial="DEADBEEF"))
+    return min(t.repeat(3, number)) / number * 1e6
+
+
+def measureChain(cls, depth, number):
+    chain = [setup(cls, 100) for i in range(depth)]
+    for child, parent in zip(chain, chain[1:]):
+        child.setEventParent(parent)
+    chain[-1].addObserver("tag-present", observer)
+    t = timeit.Timer(lambda: chain[0].dispatch("tag-present", "tag", serial="DEADBEEF"))
+    return min(t.repeat(3, number)) / number * 1e6
+
+
+def main(number=10000):
+    print("%8s %14s %14s %8s" % ("queries", "before (us)", "after (us)", "speedup"))
+    for n in (10, 100, 1000):
+        before = measure(LinearEventDispatcher, n, number)
+        after = measure(events.EventDispatcher, n, number)
+        print("%8d %14.2f %14.2f %7.1fx" % (n, before, after, before / after))
+    print("")
+    print("%8s %14s %14s %8s" % ("depth", "before (us)", "after (us)", "speedup"))
+    for depth in (1, 3, 5):
+        before = measureChain(LinearEventDispatcher, depth, number)
+        after = measureChain(events.EventDispatcher, depth, number)
+        print("%8d %14.2f %14.2f %7.1fx" % (depth, before, after, before / after))
+
+
+if __name__ == "__main__":
+    main()
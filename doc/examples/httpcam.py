@@ -14,7 +14,6 @@ import tempfile
 
 from twisted.internet import reactor
 from twisted.web.server import Site
-from twisted.application import strports
 from twisted.web import resource, static
 from twisted.python import log
 
@@ -35,12 +34,12 @@ class Application(application.Application):
     def started(self):
         # Create webserver
         self.webserver = WebServer(self)
-        httpService = strports.service("tcp:"+self.appOpts["port"], Site(self.webserver))
-        httpService.setServiceParent(self)
+        self.listenTCP(int(self.appOpts["port"]), Site(self.webserver))
 
-        # Create webcam monitor
-        m = VideoMonitor(self)
-        m.setServiceParent(self)
+        # Create webcam monitor; only one worker opens the cameras
+        if self.ownsHardware:
+            m = VideoMonitor(self)
+            m.setServiceParent(self)
 
 
 
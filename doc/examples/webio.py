@@ -7,7 +7,6 @@ Demonstrating sparked.web.io
 import os
 
 from twisted.web import static, resource, server
-from twisted.internet import reactor
 
 from sparked import application
 from sparked.web.io import listen
@@ -22,7 +21,7 @@ class Application(application.Application):
         root.putChild("", static.File(os.path.join(os.path.dirname(__file__), "webio.html")))
         site = server.Site(root)
         io = listen(site)
-        reactor.listenTCP(8880, site)
+        self.listenTCP(8880, site)
 
         io.events.addObserver("connection", self.newClient)
 
@@ -9,7 +9,9 @@ The base application class.
 import os
 import signal
 import time
+import heapq
 import inspect
+from collections import deque
 
 try:
     import json
@@ -17,9 +19,25 @@ except ImportError:
     import simplejson as json
 
 from twisted.application import service
-from twisted.python import log, usage, filepath
+from twisted.internet import task, interfaces, defer, threads
+from twisted.python import log, usage, filepath, reflect
+
+try:
+    from twisted.internet import inotify
+except ImportError:
+    inotify = None
+
+from sparked import monitors, events, timing, startup, __version__
+from sparked.stats import Timing
+from sparked.store import Store, atomicWrite
+
+
+class HeadlessError(Exception):
+    """
+    Raised when a part of the application which needs a display is
+    created while the application runs with C{--headless}.
+    """
 
-from sparked import monitors, events, __version__
 
 
 class Application(service.MultiService):
@@ -35,6 +53,21 @@ class Application(service.MultiService):
 
     @ivar title:  The human-readable title of the application.
 
+    @ivar watchOptionsFile: When true, options.json is watched with
+    inotify and reloaded C{optionsDebounce} seconds after it has last
+    been changed.
+
+    @ivar optionsSaveDelay: The number of seconds during which calls to
+    C{saveOptions} are coalesced into a single write.
+
+    @ivar checkpointState: When true, the main state machine writes a
+    checkpoint of its state to C{state.journal} in the db path on every
+    transition. After a crash, the respawned application resumes in the
+    checkpointed state (calling its enter_ methods) instead of
+    entering the 'start' state. The journal is removed when the
+    application quits normally.
+
+    @ivar store:         the L{sparked.store.Store} of the application, in the db path. Opened on first use. Every worker (see C{--workers}) has its own store.
     @ivar monitors:      the L{monitors.MonitorContainer} instance with system monitors.
     @ivar statusWindow:  the status window with information about the applictaion.
     @ivar stage:         the stage for the display of graphics
@@ -47,6 +80,22 @@ class Application(service.MultiService):
 
     title = "Untitled"
 
+    watchOptionsFile = True
+    optionsDebounce = 0.5
+
+    checkpointState = False
+
+    _optionsNotifier = None
+    _optionsReload = None
+    _optionsContent = None
+
+    _store = None
+
+    optionsSaveDelay = 0.5
+    _optionsSave = None
+    _optionsSaving = None
+    _optionsWaiting = None
+
     monitors = None
     statusWindow = None
     stage = None
@@ -62,6 +111,7 @@ class Application(service.MultiService):
         self.baseOpts = baseOpts
         self.appOpts = appOpts
         self.appId = baseOpts.get('id', appName)
+        self._optionsWaiting = []
 
         if reactor is None:
             from twisted.internet import reactor
@@ -70,7 +120,9 @@ class Application(service.MultiService):
         self.state = StateMachine(self, reactor=reactor, verbose=True)
         self.events = events.EventDispatcher()
 
+        startup.begin("create-monitors")
         self.createMonitors()
+        startup.end("create-monitors")
 
         def doReload(prev):
             if callable(prev):
@@ -81,17 +133,62 @@ class Application(service.MultiService):
         signal.signal(signal.SIGUSR2, lambda sig, frame: doReload(prevHandler))
 
         def trap(f):
+            startup.begin(f.__name__)
             try:
                 f()
             except:
                 log.err()
                 self.reactor.stop()
+            startup.end(f.__name__)
         self.reactor.callLater(0, trap, self.starting)
         self.reactor.callLater(0, self.loadOptions, firstTime=True)
-        self.reactor.callLater(0, self.state.set, "start")
+        if self.watchOptionsFile:
+            self.reactor.callLater(0, self.startWatchingOptions)
+        self.reactor.callLater(0, self.enterFirstState)
         self.reactor.callLater(0, trap, self.started)
 
 
+    @property
+    def headless(self):
+        """
+        Whether the application runs without a display (C{--headless}).
+        """
+        return bool(self.baseOpts.get('headless'))
+
+
+    @property
+    def worker(self):
+        """
+        The number of this worker process, when the application runs in
+        several workers (C{--workers}); 0 otherwise.
+        """
+        return self.baseOpts.get('worker') or 0
+
+
+    @property
+    def ownsHardware(self):
+        """
+        Whether this process owns the hardware: only the first worker
+        does.
+        """
+        return self.worker == 0
+
+
+    def listenTCP(self, port, factory, backlog=50, interface=''):
+        """
+        Listen on a TCP port, like C{reactor.listenTCP}. When the
+        application runs in several workers, the port is shared by all
+        workers (with C{SO_REUSEPORT}), and the kernel spreads the
+        connections over them. Connections of the same client can end
+        up in different workers, so state which is kept in memory per
+        client (like the clients of L{sparked.web.io}) is not shared.
+        """
+        if (self.baseOpts.get('workers') or 1) > 1:
+            from sparked.internet.reuseport import listenReusePort
+            return listenReusePort(port, factory, backlog, interface, reactor=self.reactor)
+        return self.reactor.listenTCP(port, factory, backlog, interface)
+
+
     def path(self, kind):
         """
         Return the path (a L{filepath.FilePath}) for this application
@@ -102,6 +199,14 @@ class Application(service.MultiService):
         return getPath(kind, self.appName, dict(self.baseOpts))
 
 
+    @property
+    def store(self):
+        if self._store is None:
+            fp = workerPath(self.path("db").child("store.log"), self.worker)
+            self._store = Store(fp, reactor=self.reactor)
+        return self._store
+
+
     def starting(self):
         """
         The application is starting. Add your event observers etc,
@@ -131,14 +236,42 @@ class Application(service.MultiService):
         return m
 
 
+    def enterFirstState(self):
+        """
+        Enter the 'start' state, or resume the checkpointed state when
+        C{checkpointState} is set.
+        """
+        if self.checkpointState:
+            self.state.enableCheckpoints(workerPath(self.path("db").child("state.journal"), self.worker))
+            if self.state.resume():
+                log.msg("Resumed in state %s" % self.state.get)
+                return
+        self.state.set("start")
+
+
     def stopService(self):
         self.quitFlag.set()
+        self.stopWatchingOptions()
+        d = self.flushOptions()
+        if self._store is not None:
+            self._store.close()
+        if self.state.journal is not None:
+            self.state.journal.clear()
+        return d
 
 
     def loadOptions(self, firstTime=False):
         """
         Load options from options.json. Automatically called on
-        application load and on on USR2 signal.
+        application load, on USR2 signal and when the file changes
+        (see C{watchOptionsFile}).
+
+        Except for the first time, an 'option-changed' event is
+        dispatched for every option that changed, with the key, the
+        old and the new value as arguments, so observers can subscribe
+        to a single option with C{addObserver("option-changed", fn,
+        key="api")}. Then 'options-loaded' is dispatched with all
+        options.
         """
         cfgfile = self.path("db").child("options.json")
         if not cfgfile.exists():
@@ -153,16 +286,187 @@ class Application(service.MultiService):
             log.err(e)
             return
 
+        old = dict(self.appOpts)
         self.appOpts.update(newOpts)
+        if not firstTime:
+            for k in sorted(newOpts.keys()):
+                if k not in old or old[k] != newOpts[k]:
+                    self.events.dispatch("option-changed", k, old.get(k), newOpts[k])
         self.events.dispatch("options-loaded", self.appOpts)
 
 
+    def startWatchingOptions(self):
+        """
+        Watch options.json with inotify, and reload the options when
+        it changes. Returns C{False} when inotify is not available.
+        """
+        self.stopWatchingOptions()
+        dbPath = self.path("db")
+        if inotify is None or not dbPath.isdir() or \
+                not interfaces.IReactorFDSet.providedBy(self.reactor):
+            return False
+        try:
+            notifier = inotify.INotify(self.reactor)
+        except Exception:
+            log.err(None, "Cannot watch options.json")
+            return False
+        notifier.startReading()
+        # Watch the directory, so replacing the file by a rename is
+        # noticed as well.
+        notifier.watch(dbPath, inotify.IN_CLOSE_WRITE | inotify.IN_MOVED_TO | inotify.IN_CREATE,
+                       callbacks=[self._optionsNotified])
+        self._optionsNotifier = notifier
+        return True
+
+
+    def stopWatchingOptions(self):
+        """
+        Stop watching options.json.
+        """
+        if self._optionsNotifier is not None:
+            self._optionsNotifier.loseConnection()
+            self._optionsNotifier = None
+        if self._optionsReload is not None and self._optionsReload.active():
+            self._optionsReload.cancel()
+
+
+    def _optionsNotified(self, ignored, fp, mask):
+        if fp.basename() != "options.json":
+            return
+        if self._optionsReload is not None and self._optionsReload.active():
+            self._optionsReload.reset(self.optionsDebounce)
+        else:
+            self._optionsReload = self.reactor.callLater(self.optionsDebounce, self._optionsChanged)
+
+
+    def _optionsChanged(self):
+        fp = self.path("db").child("options.json")
+        if fp.exists() and fp.getContent() == self._optionsContent:
+            # Written by saveOptions
+            return
+        self.loadOptions()
+
+
     def saveOptions(self):
         """
-        Save options from settings.json. Never called automatically.
+        Save the options to options.json. Never called automatically.
+
+        The options are written C{optionsSaveDelay} seconds later, in
+        a thread, with L{sparked.store.atomicWrite}; calls in the meantime are
+        coalesced into the same write. Returns a Deferred which fires
+        with the options when they are safely on disk. Then
+        'options-saved' is dispatched.
         """
-        self.appOpts.save(self.path("db").child("options.json").path)
+        d = defer.Deferred()
+        self._optionsWaiting.append(d)
+        if self._optionsSave is None and self._optionsSaving is None:
+            self._optionsSave = self.reactor.callLater(self.optionsSaveDelay, self._writeOptions)
+        return d
+
+
+    def _writeOptions(self):
+        self._optionsSave = None
+        waiting, self._optionsWaiting = self._optionsWaiting, []
+        data = json.dumps(dict(self.appOpts))
+        self._optionsContent = data
+        d = self._optionsSaving = self._inThread(atomicWrite, self.path("db").child("options.json").path, data)
+
+        def saved(_):
+            self._optionsSaving = None
+            self.events.dispatch("options-saved", self.appOpts)
+            for w in waiting:
+                w.callback(self.appOpts)
+        def failed(f):
+            self._optionsSaving = None
+            log.err(f, "Cannot save options")
+            for w in waiting:
+                w.errback(f)
+        d.addCallbacks(saved, failed)
+        def again(_):
+            # Saves which were requested while writing
+            if self._optionsWaiting and self._optionsSave is None:
+                self._optionsSave = self.reactor.callLater(self.optionsSaveDelay, self._writeOptions)
+        d.addCallback(again)
+
+
+    def _inThread(self, f, *args):
+        return threads.deferToThreadPool(self.reactor, self.reactor.getThreadPool(), f, *args)
+
+
+    def flushOptions(self):
+        """
+        Write the options right away, in the reactor thread, when a
+        save is pending. When the options are being written in a
+        thread, the pending save is written after that write. Returns
+        a Deferred which fires when the options are written.
+        """
+        if self._optionsSaving is not None:
+            d = defer.Deferred()
+            def flush(result):
+                self.flushOptions().chainDeferred(d)
+                return result
+            self._optionsSaving.addBoth(flush)
+            return d
+        if self._optionsSave is not None:
+            self._optionsSave.cancel()
+            self._optionsSave = None
+        if not self._optionsWaiting:
+            return defer.succeed(None)
+        waiting, self._optionsWaiting = self._optionsWaiting, []
+        data = json.dumps(dict(self.appOpts))
+        self._optionsContent = data
+        atomicWrite(self.path("db").child("options.json").path, data)
         self.events.dispatch("options-saved", self.appOpts)
+        for w in waiting:
+            w.callback(self.appOpts)
+        return defer.succeed(None)
+
+
+    def dumpEventStatistics(self):
+        """
+        Write the event dispatch statistics (see
+        L{events.enableStatistics}) as JSON to
+        C{event-statistics.json} in the temp path. Returns the
+        L{filepath.FilePath} written to, or C{None} when no statistics
+        are being collected.
+        """
+        if events.statistics is None:
+            return None
+        fp = self.path("temp").child("event-statistics.json")
+        events.statistics.dump(fp)
+        return fp
+
+
+    def dumpStateStatistics(self):
+        """
+        Write the statistics of the state machine (see
+        L{StateMachine.enableStatistics}) as JSON to
+        C{state-statistics.json} in the temp path. Returns the
+        L{filepath.FilePath} written to, or C{None} when no statistics
+        are being collected.
+        """
+        if self.state.statistics is None:
+            return None
+        fp = self.path("temp").child("state-statistics.json")
+        self.state.statistics.dump(fp, self.reactor.seconds())
+        return fp
+
+
+    def startStatisticsDump(self, interval=60):
+        """
+        Start collecting the statistics of the state machine, and write
+        them every C{interval} seconds with L{dumpStateStatistics}
+        (and the event statistics with L{dumpEventStatistics}, when
+        these are enabled). Returns the L{task.LoopingCall}.
+        """
+        self.state.enableStatistics()
+        def dump():
+            self.dumpStateStatistics()
+            self.dumpEventStatistics()
+        call = task.LoopingCall(dump)
+        call.clock = self.reactor
+        call.start(interval, now=False)
+        return call
 
 
 class Options (usage.Options):
@@ -204,9 +508,10 @@ class Options (usage.Options):
 
 
     def save(self, fn):
-        fp = open(fn, "w")
-        fp.write(json.dumps(dict(self)))
-        fp.close()
+        """
+        Save the options as JSON to the given file, with L{sparked.store.atomicWrite}.
+        """
+        atomicWrite(fn, json.dumps(dict(self)))
 
 
     def load(cls, fn):
@@ -214,24 +519,100 @@ class Options (usage.Options):
         values = json.loads(open(fn, "r").read())
         inst.opts = values
         inst.update(values)
-        for k,v in values.iteritems():
-            if hasattr(inst, 'optParameters') and k in [l[0] for l in inst.optParameters if len(l)==5]:
-                # check arg type
-                tpe = [l for l in inst.optParameters if len(l)==5][0][4]
-                if type(v) != tpe:
-                    raise ValueError("Expected type '%s' for parameter '%s'" % (tpe, k))
-            elif hasattr(inst, 'opt_%s' % k):
-                f = getattr(inst, 'opt_%s' % k)
-                if len(inspect.getargspec(f)[0]) == 1:
-                    if v: f()
-                else:
-                    f(v)
-
+        cls.schema().apply(inst, values)
         inst.postOptions()
         return inst
     load = classmethod(load)
 
 
+    def schema(cls):
+        """
+        Return the L{OptionsSchema} of this class. It is compiled on
+        first use.
+        """
+        schema = cls.__dict__.get("_schema")
+        if schema is None:
+            schema = OptionsSchema(cls)
+            cls._schema = schema
+        return schema
+    schema = classmethod(schema)
+
+
+
+class OptionsSchema (object):
+    """
+    The compiled description of the options of an L{Options} class,
+    used to validate the values which are loaded from a file.
+
+    @ivar checkers: Dict mapping the names of the parameters which
+    have a type or coercer (the fifth item of their C{optParameters}
+    entry) to a function which checks a value and returns it, coerced
+    when needed. It raises C{ValueError} for invalid values.
+
+    @ivar handlers: Dict mapping names to a C{(function, takesArgument)}
+    pair for every C{opt_} method of the class.
+    """
+
+    def __init__(self, cls):
+        self.checkers = {}
+        parameters = []
+        reflect.accumulateClassList(cls, "optParameters", parameters)
+        for p in parameters:
+            if len(p) == 5 and p[4] is not None:
+                self.checkers[p[0]] = self._checker(p[0], p[2], p[4])
+        self.handlers = {}
+        for attr in dir(cls):
+            if not attr.startswith("opt_"):
+                continue
+            fn = getattr(getattr(cls, attr), "im_func", None)
+            if fn is None:
+                continue
+            self.handlers[attr[4:]] = (fn, len(inspect.getargspec(fn)[0]) != 1)
+
+
+    def _checker(self, name, default, coerce):
+        if isinstance(coerce, type):
+            if coerce is str:
+                types = basestring
+            elif coerce is float:
+                types = (int, long, float)
+            elif coerce in (int, long):
+                types = (int, long)
+            else:
+                types = coerce
+            def check(v):
+                if v is None and default is None:
+                    return v
+                if not isinstance(v, types) or (isinstance(v, bool) and coerce is not bool):
+                    raise ValueError("Expected type '%s' for parameter '%s'" % (coerce, name))
+                if coerce is float:
+                    return float(v)
+                return v
+        else:
+            def check(v):
+                if v is None and default is None:
+                    return v
+                return coerce(v)
+        return check
+
+
+    def apply(self, inst, values):
+        """
+        Check the given values, and call the C{opt_} methods on the
+        given L{Options} instance for the values without type.
+        """
+        checkers, handlers = self.checkers, self.handlers
+        for k, v in values.iteritems():
+            if k in checkers:
+                inst[k] = checkers[k](v)
+            elif k in handlers:
+                fn, takesArgument = handlers[k]
+                if takesArgument:
+                    fn(inst, v)
+                elif v:
+                    fn(inst)
+
+
 
 def getPath(kind, appName, options):
     """
@@ -246,10 +627,12 @@ def getPath(kind, appName, options):
 
     if kind == "logfile":
         if options.get("logfile"):
-            return filepath.FilePath(os.path.expanduser(options.get("logfile")))
-        if options.get("system-paths"):
-            return filepath.FilePath("/var/log").child(base+".log")
-        return getPath("temp", appName, options).child("sparkd.log")
+            fp = filepath.FilePath(os.path.expanduser(options.get("logfile")))
+        elif options.get("system-paths"):
+            fp = filepath.FilePath("/var/log").child(base+".log")
+        else:
+            fp = getPath("temp", appName, options).child("sparkd.log")
+        return workerPath(fp, options.get("worker"))
 
     if kind == "pidfile":
         if options.get("pidfile"):
@@ -276,7 +659,74 @@ def getPath(kind, appName, options):
 
 
 
-class StateMachine (object):
+def workerPath(fp, worker):
+    """
+    Return the path (a L{filepath.FilePath}) of the file of a worker
+    (see C{--workers}) which corresponds to the given file: for the
+    first worker, the file itself; for worker 2, 'sparkd.log' becomes
+    'sparkd-2.log'.
+    """
+    if not worker:
+        return fp
+    base, ext = os.path.splitext(fp.basename())
+    return fp.sibling("%s-%d%s" % (base, worker, ext))
+
+
+
+class _Listeners (object):
+    """
+    The listeners of a state machine, with a cache of their enter_ and
+    exit_ methods.
+    """
+
+    _listeners = None
+    _handlers = None
+
+    statistics = None
+
+    def __init__(self):
+        self._listeners = []
+        self._handlers = {}
+
+
+    def _call(self, cb, reverse, *a, **kw):
+        handlers = self._handlers.get(cb)
+        if handlers is None:
+            handlers = self._resolve(cb)
+        stats = self.statistics
+        for (fn, args) in handlers[reverse]:
+            if stats is None:
+                fn(*(args+a), **kw)
+                continue
+            start = time.time()
+            try:
+                fn(*(args+a), **kw)
+            finally:
+                stats.addHandler(fn, time.time() - start)
+
+
+    def _resolve(self, cb):
+        """
+        Look up the given handler on all listeners. Returns a tuple of
+        the C{(handler, args)} pairs in listener order and in reversed
+        order.
+        """
+        handlers = []
+        for (l, args) in self._listeners:
+            fn = getattr(l, cb, None)
+            if fn is not None:
+                handlers.append((fn, args))
+        self._handlers[cb] = handlers, handlers[::-1]
+        return self._handlers[cb]
+
+
+    def addListener(self, l, *args):
+        self._listeners.append((l, args))
+        self._handlers = {}
+
+
+
+class StateMachine (_Listeners):
     """
     A simple state machine.
 
@@ -291,23 +741,39 @@ class StateMachine (object):
 
     @ivar events: L{sparked.events.EventDispatcher} object which fires
     on state transitions.
+
+    The enter_ and exit_ methods of the listeners are looked up the
+    first time a state is entered or left, and cached until another
+    listener is added.
+
+    Timed state changes are scheduled on the shared
+    L{sparked.timing.TimingWheel} of the reactor, so they happen up to
+    its resolution late.
+
+    @ivar statistics: The L{StateStatistics} of this machine, or
+    C{None} when these are not collected. See C{enableStatistics}.
+
+    @ivar journal: The L{StateJournal} to which checkpoints are
+    written, or C{None}. See C{enableCheckpoints}.
     """
 
     _state = None
+    _stateArgs = ((), {})
     _statechanger = None
-    _listeners = None
+    journal = None
 
     nextStateAfter = None
     verbose = None
     events = None
 
     def __init__(self, parent=None, reactor=None, verbose=False):
-        self._listeners = []
+        _Listeners.__init__(self)
         if parent:
             self.addListener(parent)
         if reactor is None:
             from twisted.internet import reactor
         self.reactor = reactor
+        self.wheel = timing.getTimingWheel(reactor)
         self.verbose = verbose
         self.events = events.EventDispatcher()
 
@@ -325,6 +791,10 @@ class StateMachine (object):
         self._statechanger = None
         self.nextStateAfter = None
 
+        stats = self.statistics
+        if stats is not None:
+            start = time.time()
+
         if self._state:
             self._call("exit_%s" % self._state, True)  # call reversed
 
@@ -332,8 +802,13 @@ class StateMachine (object):
             log.msg("%s --> %s" % (self._state, newstate))
         oldstate = self._state
         self._state = newstate
+        self._stateArgs = (arg, kw)
+        if self.journal is not None:
+            self._checkpoint()
 
         self._call("enter_%s" % self._state, False, *arg, **kw)
+        if stats is not None:
+            stats.transition(oldstate, newstate, self.reactor.seconds(), time.time() - start)
         self.events.dispatch("state-change", oldstate, newstate)
 
 
@@ -344,7 +819,9 @@ class StateMachine (object):
         self._afterStart = time.time()
         self._afterStop = self._afterStart + after
         self.nextStateAfter = after
-        self._statechanger = self.reactor.callLater(after, self.set, newstate, *arg, **kw)
+        self._statechanger = self.wheel.callLater(after, self.set, newstate, *arg, **kw)
+        if self.journal is not None:
+            self._checkpoint()
         self.events.dispatch("state-change-after", newstate, after)
 
 
@@ -358,6 +835,8 @@ class StateMachine (object):
             after = self.nextStateAfter
         self.nextStateAfter = after
         self._statechanger.reset(after)
+        if self.journal is not None:
+            self._checkpoint()
         self.events.dispatch("bump-after", after)
 
 
@@ -369,16 +848,470 @@ class StateMachine (object):
         return self._state
 
 
-    def _call(self, cb, reverse, *a, **kw):
-        listeners = self._listeners
-        if reverse:
-            listeners = listeners[::-1]
-        for (l, args) in listeners:
+    def enableStatistics(self):
+        """
+        Start collecting the residency, transition and handler
+        statistics of this machine. Returns the L{StateStatistics}.
+        """
+        if self.statistics is None:
+            self.statistics = StateStatistics(self._state, self.reactor.seconds())
+        return self.statistics
+
+
+    def disableStatistics(self):
+        """
+        Stop collecting statistics.
+        """
+        self.statistics = None
+
+
+    def enableCheckpoints(self, fp):
+        """
+        Write a checkpoint to a L{StateJournal} in the given file on
+        every transition and on every change of the timed transition.
+        The arguments of the states must be JSON-serializable to be
+        checkpointed. Returns the journal.
+        """
+        self.journal = StateJournal(fp)
+        return self.journal
+
+
+    def _checkpoint(self):
+        arg, kw = self._stateArgs
+        record = {'state': self._state, 'args': arg, 'kw': kw}
+        if self._statechanger is not None and self._statechanger.active():
+            c = self._statechanger
+            record['after'] = {'state': c.args[0], 'at': c.getTime(),
+                               'args': c.args[1:], 'kw': c.kw}
+        try:
+            self.journal.write(record)
+        except (TypeError, ValueError):
+            log.msg("Cannot checkpoint the arguments of state %s" % self._state)
+            record['args'], record['kw'] = (), {}
+            if 'after' in record:
+                record['after']['args'], record['after']['kw'] = (), {}
+            self.journal.write(record)
+
+
+    def resume(self):
+        """
+        Enter the state of the last checkpoint in the journal, and
+        schedule its pending timed transition; a transition which is
+        overdue happens right away. Returns C{False} when there is no
+        checkpoint.
+        """
+        record = self.journal is not None and self.journal.read()
+        if not record:
+            return False
+        self.set(_str(record['state']), *record['args'], **_kwargs(record['kw']))
+        after = record.get('after')
+        if after:
+            delay = max(0, after['at'] - self.reactor.seconds())
+            self.setAfter(_str(after['state']), delay, *after['args'], **_kwargs(after['kw']))
+        return True
+
+
+
+def _str(s):
+    """
+    JSON decodes all strings as unicode; use plain strings for the
+    states where possible.
+    """
+    if isinstance(s, unicode):
+        try:
+            return s.encode("ascii")
+        except UnicodeError:
+            pass
+    return s
+
+
+def _kwargs(kw):
+    return dict([(str(k), v) for k, v in kw.iteritems()])
+
+
+
+class StateJournal (object):
+    """
+    Append-only journal of the checkpoints of a L{StateMachine}.
+
+    Every checkpoint is a single line of JSON, which is appended with
+    a single write to a file opened in append mode. A crashing process
+    cannot leave a half-written checkpoint behind, as the written data
+    is in the operating system already; an incomplete last line (after
+    a power failure) is ignored when reading. Set C{sync} to also
+    fsync every checkpoint. After C{maxRecords} checkpoints, the
+    journal is replaced by one which contains only the last one.
+    """
+
+    maxRecords = 1000
+    sync = False
+
+    def __init__(self, fp):
+        if not isinstance(fp, filepath.FilePath):
+            fp = filepath.FilePath(fp)
+        self.filePath = fp
+        self._fd = None
+        self._records = 0
+
+
+    def read(self):
+        """
+        Return the last complete checkpoint, or C{None}.
+        """
+        if not self.filePath.exists():
+            return None
+        lines = self.filePath.getContent().split("\n")
+        # The part after the last newline is empty or incomplete
+        for line in reversed(lines[:-1]):
             try:
-                getattr(l, cb)(*(args+a), **kw)
-            except AttributeError:
-                pass
+                return json.loads(line)
+            except ValueError:
+                continue
+        return None
 
 
-    def addListener(self, l, *args):
-        self._listeners.append((l, args))
+    def write(self, record):
+        """
+        Append a checkpoint. Raises C{TypeError} or C{ValueError} when
+        it cannot be serialized.
+        """
+        line = json.dumps(record) + "\n"
+        if self._records >= self.maxRecords:
+            return self._compact(line)
+        if self._fd is None:
+            self._fd = os.open(self.filePath.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        os.write(self._fd, line)
+        if self.sync:
+            os.fsync(self._fd)
+        self._records += 1
+
+
+    def _compact(self, line):
+        """
+        Atomically replace the journal by one with only the given line.
+        """
+        self.close()
+        atomicWrite(self.filePath.path, line)
+        self._records = 1
+
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+    def clear(self):
+        """
+        Remove the journal.
+        """
+        self.close()
+        if self.filePath.exists():
+            self.filePath.remove()
+        self._records = 0
+
+
+
+class StateStatistics (object):
+    """
+    Statistics of a L{StateMachine}.
+
+    @ivar residency: Dict mapping states to a L{Timing} of the time
+    spent in them, in seconds. The current visit of the current state
+    is not included; see C{asDict}.
+
+    @ivar transitions: Dict mapping C{(from, to)} pairs to the number
+    of transitions between the two states.
+
+    @ivar handlers: Dict mapping the names of the enter_ and exit_
+    methods of the listeners to a L{Timing} of their calls.
+
+    @ivar trace: The last C{traceLength} transitions, as C{(time,
+    from, to, duration)} tuples; the duration is the time taken by
+    the exit_ and enter_ methods of the transition.
+    """
+
+    residencyBuckets = (0.1, 1.0, 10.0, 60.0, 300.0, 1800.0, 3600.0)
+    traceLength = 100
+
+    state = None
+    since = None
+
+    def __init__(self, state=None, now=None):
+        self.residency = {}
+        self.transitions = {}
+        self.handlers = {}
+        self.trace = deque(maxlen=self.traceLength)
+        self.state = state
+        self.since = now
+
+
+    def transition(self, oldstate, newstate, now, duration):
+        """
+        Register a transition which happened at time C{now}, and of
+        which the handlers took C{duration} seconds.
+        """
+        if oldstate is not None and self.since is not None:
+            try:
+                t = self.residency[oldstate]
+            except KeyError:
+                t = self.residency[oldstate] = Timing(self.residencyBuckets)
+            t.add(now - self.since)
+        k = (oldstate, newstate)
+        self.transitions[k] = self.transitions.get(k, 0) + 1
+        self.trace.append((now, oldstate, newstate, duration))
+        self.state = newstate
+        self.since = now
+
+
+    def addHandler(self, fn, duration):
+        name = events.observerName(fn)
+        try:
+            t = self.handlers[name]
+        except KeyError:
+            t = self.handlers[name] = Timing()
+        t.add(duration)
+
+
+    def asDict(self, now=None):
+        """
+        Return the statistics as a JSON-serializable dict. When
+        C{now} is given, it includes how long the current state has
+        been active.
+        """
+        current = {'state': self.state}
+        if now is not None and self.since is not None:
+            current['duration'] = now - self.since
+        return {'current': current,
+                'residency': dict([(str(k), v.asDict()) for k, v in self.residency.iteritems()]),
+                'transitions': [{'from': k[0], 'to': k[1], 'count': v}
+                                for k, v in sorted(self.transitions.iteritems())],
+                'handlers': dict([(k, v.asDict()) for k, v in self.handlers.iteritems()]),
+                'trace': [{'time': t, 'from': f, 'to': to, 'duration': d}
+                          for t, f, to, d in self.trace]}
+
+
+    def dump(self, fp, now=None):
+        """
+        Write the statistics as JSON to the given L{filepath.FilePath}.
+        """
+        fp.setContent(json.dumps(self.asDict(now), indent=2))
+
+
+
+class StateMachinePool (_Listeners):
+    """
+    A pool of light-weight state machines, e.g. one per visitor or
+    per RFID tag.
+
+    The machines of a pool share their listeners (and the cache of
+    their enter_ and exit_ methods), their event dispatcher and their
+    timer: all timed transitions are kept in one heap, and only the
+    first one is scheduled in the reactor. A machine itself only
+    stores its key, its state and its pending timed transition.
+
+    The enter_<state> and exit_<state> methods of the listeners are
+    called with the L{PooledStateMachine} as their first argument
+    (after the arguments given to C{addListener}). The events are the
+    same as those of L{StateMachine}, with the machine as their first
+    argument, so observers can subscribe to a single machine with
+    C{pool.events.addObserver("state-change", fn, key=machine)}.
+
+    @ivar machines: Mapping of the machines which were created with a
+    key, by key.
+
+    @ivar verbose: Control whether this pool logs the transitions of
+    its machines.
+
+    @ivar events: L{sparked.events.EventDispatcher} object which fires
+    on state transitions of all machines.
+    """
+
+    verbose = None
+    events = None
+    machines = None
+
+    def __init__(self, parent=None, reactor=None, verbose=False):
+        _Listeners.__init__(self)
+        if parent:
+            self.addListener(parent)
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.verbose = verbose
+        self.events = events.EventDispatcher()
+        self.machines = {}
+        self._timers = []
+        self._timerCount = 0
+        self._cancelled = 0
+        self._delayedCall = None
+
+
+    def create(self, key=None):
+        """
+        Create a new machine. When a key is given, the machine is kept
+        in C{machines} until it is removed with C{remove}.
+        """
+        m = PooledStateMachine(self, key)
+        if key is not None:
+            self.machines[key] = m
+        return m
+
+
+    def remove(self, machine):
+        """
+        Cancel the pending transition of a machine and forget it.
+        """
+        machine.cancelAfter()
+        if machine.key is not None and self.machines.get(machine.key) is machine:
+            del self.machines[machine.key]
+
+
+    def __len__(self):
+        return len(self.machines)
+
+
+    def _schedule(self, machine, after, newstate, arg, kw):
+        """
+        Add a timed transition to the heap. Returns the heap entry.
+        """
+        self._timerCount += 1
+        entry = [self.reactor.seconds() + after, self._timerCount, machine, newstate, arg, kw]
+        heapq.heappush(self._timers, entry)
+        if self._timers[0] is entry:
+            self._reschedule()
+        return entry
+
+
+    def _cancel(self, entry):
+        """
+        Cancel a timed transition. Cancelled entries stay in the heap
+        until they are due, unless they make up most of it.
+        """
+        entry[2] = None
+        self._cancelled += 1
+        if self._cancelled > 64 and self._cancelled * 2 > len(self._timers):
+            self._timers = [e for e in self._timers if e[2] is not None]
+            heapq.heapify(self._timers)
+            self._cancelled = 0
+
+
+    def _reschedule(self):
+        timers = self._timers
+        while timers and timers[0][2] is None:
+            heapq.heappop(timers)
+            self._cancelled -= 1
+        if self._delayedCall is not None and self._delayedCall.active():
+            self._delayedCall.cancel()
+        self._delayedCall = None
+        if timers:
+            delay = max(0, timers[0][0] - self.reactor.seconds())
+            self._delayedCall = self.reactor.callLater(delay, self._expire)
+
+
+    def _expire(self):
+        """
+        Perform all timed transitions which are due. Transitions which
+        are scheduled while doing so wait for the next call.
+        """
+        self._delayedCall = None
+        timers = self._timers
+        now = self.reactor.seconds()
+        last = self._timerCount
+        while timers and timers[0][0] <= now and timers[0][1] <= last:
+            due, count, machine, newstate, arg, kw = heapq.heappop(timers)
+            if machine is None:
+                self._cancelled -= 1
+                continue
+            machine._timer = None
+            machine.set(newstate, *arg, **kw)
+        self._reschedule()
+
+
+
+class PooledStateMachine (object):
+    """
+    A state machine in a L{StateMachinePool}. It has the same interface
+    as L{StateMachine}, but shares its listeners, events and timer with
+    the other machines in the pool.
+
+    @ivar pool: The L{StateMachinePool}.
+    @ivar key: The key given to C{StateMachinePool.create}.
+    @ivar nextStateAfter: nr of seconds after which the next state
+    change is triggered. If None, the timer is not active.
+    """
+
+    __slots__ = ("pool", "key", "nextStateAfter", "_state", "_timer")
+
+    def __init__(self, pool, key=None):
+        self.pool = pool
+        self.key = key
+        self.nextStateAfter = None
+        self._state = None
+        self._timer = None
+
+
+    def __repr__(self):
+        return "<%s %r: %s>" % (self.__class__.__name__, self.key, self._state)
+
+
+    def set(self, newstate, *arg, **kw):
+        """
+        Sets a new state. See L{StateMachine.set}.
+        """
+        pool = self.pool
+        self.cancelAfter()
+
+        if self._state:
+            pool._call("exit_%s" % self._state, True, self)  # call reversed
+
+        if pool.verbose:
+            log.msg("%r: %s --> %s" % (self.key, self._state, newstate))
+        oldstate = self._state
+        self._state = newstate
+
+        pool._call("enter_%s" % self._state, False, self, *arg, **kw)
+        pool.events.dispatch("state-change", self, oldstate, newstate)
+
+
+    def setAfter(self, newstate, after, *arg, **kw):
+        """
+        Make a state transition after a specified amount of time.
+        """
+        self.cancelAfter()
+        self.nextStateAfter = after
+        self._timer = self.pool._schedule(self, after, newstate, arg, kw)
+        self.pool.events.dispatch("state-change-after", self, newstate, after)
+
+
+    def bumpAfter(self, after=None):
+        """
+        Change the state-changer timer to the specified nr of
+        seconds. If none given, resets the timer to the initial delay,
+        'bumping' it.
+        """
+        if not after:
+            after = self.nextStateAfter
+        self.nextStateAfter = after
+        entry = self._timer
+        self.pool._cancel(entry)
+        self._timer = self.pool._schedule(self, after, entry[3], entry[4], entry[5])
+        self.pool.events.dispatch("bump-after", self, after)
+
+
+    def cancelAfter(self):
+        """
+        Cancel the pending timed transition, if any.
+        """
+        if self._timer is not None:
+            self.pool._cancel(self._timer)
+            self._timer = None
+        self.nextStateAfter = None
+
+
+    @property
+    def get(self):
+        """
+        Get the current state.
+        """
+        return self._state
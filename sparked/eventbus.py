@@ -0,0 +1,245 @@
+# Copyright (c) 2011 Arjan Scherpenisse
+# See LICENSE for details.
+# -*- test-case-name: sparked.test.test_eventbus -*-
+
+"""
+Bridge between event dispatchers in different processes.
+
+Two processes connect over a Unix domain socket; each side has an
+L{sparked.events.EventDispatcher}. A side subscribes to the topics
+(event names) it wants to receive; the other side then forwards every
+dispatch of such an event over the connection, where it is dispatched
+again. Events which are not subscribed to never cross the process
+boundary.
+
+Each frame is a 32-bit length prefix, followed by a single byte which
+gives the type of the frame, followed by the payload: a topic name
+for (un)subscriptions, or the event and its arguments as JSON. So
+only JSON-serializable arguments cross the bus; tuples arrive as lists
+and strings as unicode.
+
+The bus is a trust boundary: every process which can connect to the
+socket can dispatch events in the listening process. The socket is
+therefore created with mode 0600, so that only its owner can connect,
+and frames are never unpickled, so a peer cannot run code through
+them.
+
+The hardware process listens::
+
+  listenEventBus(app.path("temp").child("bus").path, rfid.rfidEvents, topics=["render-done"])
+
+and a render process connects to it::
+
+  connectEventBus(path, events, topics=["tag-added", "tag-removed"])
+
+The listening side relays events between the processes connected to
+it, except back to the process which dispatched them.
+"""
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from twisted.internet import protocol
+from twisted.protocols import basic
+from twisted.python import log
+
+
+FRAME_SUBSCRIBE = "S"
+FRAME_UNSUBSCRIBE = "U"
+FRAME_EVENT = "E"
+
+
+def encodeEvent(event, arg, kwarg):
+    """
+    Encode an event and its arguments into the payload of an event
+    frame. Raises C{TypeError} or C{ValueError} when the arguments
+    cannot be encoded.
+    """
+    return json.dumps([event, arg, kwarg])
+
+
+def decodeEvent(payload):
+    """
+    Decode the payload of an event frame into an C{(event, args,
+    kwargs)} tuple. Raises C{ValueError} when the payload is invalid.
+    """
+    event, arg, kwarg = json.loads(payload)
+    if not isinstance(event, basestring) or not isinstance(arg, list) \
+            or not isinstance(kwarg, dict):
+        raise ValueError("Invalid event payload")
+    return str(event), tuple(arg), dict((str(k), v) for k, v in kwarg.iteritems())
+
+
+class EventBusProtocol(basic.Int32StringReceiver):
+    """
+    One end of an event bus connection.
+
+    @ivar forwarding: Mapping of the topics the peer subscribed to, to
+    the observers which forward them.
+    """
+
+    MAX_LENGTH = 2 ** 24
+
+    def connectionMade(self):
+        self.forwarding = {}
+        self.factory.protocols.append(self)
+        for topic in self.factory.topics:
+            self.sendString(FRAME_SUBSCRIBE + topic)
+
+
+    def connectionLost(self, reason):
+        if self in self.factory.protocols:
+            self.factory.protocols.remove(self)
+        for topic in self.forwarding.keys():
+            self._unsubscribe(topic)
+
+
+    def stringReceived(self, frame):
+        kind, payload = frame[:1], frame[1:]
+        if kind == FRAME_EVENT:
+            try:
+                event, arg, kwarg = decodeEvent(payload)
+            except:
+                log.err(None, "%s: invalid event frame" % self.__class__.__name__)
+                return
+            self.factory.dispatchFrom(self, event, arg, kwarg)
+        elif kind == FRAME_SUBSCRIBE:
+            self._subscribe(payload)
+        elif kind == FRAME_UNSUBSCRIBE:
+            self._unsubscribe(payload)
+        else:
+            log.msg("%s: unknown frame type %r, disconnecting" % (self.__class__.__name__, kind))
+            self.transport.loseConnection()
+
+
+    def lengthLimitExceeded(self, length):
+        log.msg("%s: frame of %d bytes is too long, disconnecting" % (self.__class__.__name__, length))
+        self.transport.loseConnection()
+
+
+    def _subscribe(self, topic):
+        if topic in self.forwarding:
+            return
+        def forward(*arg, **kwarg):
+            if self.factory.incoming is self:
+                # Do not echo the event back to where it came from
+                return
+            self.sendEvent(topic, arg, kwarg)
+        self.forwarding[topic] = forward
+        self.factory.dispatcher.addObserver(topic, forward)
+
+
+    def _unsubscribe(self, topic):
+        forward = self.forwarding.pop(topic, None)
+        if forward is not None:
+            self.factory.dispatcher.removeObserver(topic, forward)
+
+
+    def sendEvent(self, event, arg, kwarg):
+        """
+        Send an event to the peer.
+        """
+        try:
+            payload = encodeEvent(event, arg, kwarg)
+        except:
+            log.err(None, "%s: cannot send event '%s'" % (self.__class__.__name__, event))
+            return
+        self.sendString(FRAME_EVENT + payload)
+
+
+
+class EventBusFactory(protocol.Factory):
+    """
+    Factory for event bus connections to or from a dispatcher.
+
+    @ivar dispatcher: The local L{sparked.events.EventDispatcher}.
+    @ivar topics: The names of the events that are received from the
+    other processes.
+    @ivar protocols: The connected L{EventBusProtocol}s.
+    @ivar incoming: The protocol of which an event is being
+    dispatched, if any.
+    """
+
+    protocol = EventBusProtocol
+
+    incoming = None
+
+    def __init__(self, dispatcher, topics=()):
+        self.dispatcher = dispatcher
+        self.topics = list(topics)
+        self.protocols = []
+
+
+    def subscribe(self, topic):
+        """
+        Start receiving the given event from the other processes.
+        """
+        if topic in self.topics:
+            return
+        self.topics.append(topic)
+        for p in self.protocols:
+            p.sendString(FRAME_SUBSCRIBE + topic)
+
+
+    def unsubscribe(self, topic):
+        """
+        Stop receiving the given event from the other processes.
+        """
+        if topic not in self.topics:
+            return
+        self.topics.remove(topic)
+        for p in self.protocols:
+            p.sendString(FRAME_UNSUBSCRIBE + topic)
+
+
+    def dispatchFrom(self, proto, event, arg, kwarg):
+        """
+        Dispatch an event which was received from the given protocol.
+        """
+        previous, self.incoming = self.incoming, proto
+        try:
+            self.dispatcher.dispatch(event, *arg, **kwarg)
+        finally:
+            self.incoming = previous
+
+
+
+class EventBusClientFactory(EventBusFactory, protocol.ReconnectingClientFactory):
+    """
+    Event bus factory for the connecting side. Reconnects when the
+    connection is lost; the subscriptions are restored.
+    """
+
+    maxDelay = 10
+
+    def buildProtocol(self, addr):
+        self.resetDelay()
+        return EventBusFactory.buildProtocol(self, addr)
+
+
+
+def listenEventBus(path, dispatcher, topics=(), reactor=None):
+    """
+    Listen for event bus connections on a Unix domain socket, which
+    only the current user can connect to. Returns the
+    C{IListeningPort}; its C{factory} attribute is the
+    L{EventBusFactory}.
+    """
+    if reactor is None:
+        from twisted.internet import reactor
+    return reactor.listenUNIX(path, EventBusFactory(dispatcher, topics), mode=0600)
+
+
+def connectEventBus(path, dispatcher, topics=(), reactor=None):
+    """
+    Connect to an event bus on a Unix domain socket. Returns the
+    L{EventBusClientFactory}; call its C{stopTrying} method and
+    disconnect its protocols to disconnect.
+    """
+    if reactor is None:
+        from twisted.internet import reactor
+    factory = EventBusClientFactory(dispatcher, topics)
+    reactor.connectUNIX(path, factory)
+    return factory
@@ -0,0 +1,244 @@
+# Copyright (c) 2011 Arjan Scherpenisse
+# See LICENSE for details.
+# -*- test-case-name: sparked.test.test_eventlog -*-
+
+"""
+Recording of events into a binary log, and replaying them.
+
+The log is an append-only file which starts with a short header,
+followed by the records. Every record consists of the timestamp (a
+double) and the length of the payload (an unsigned int), both in
+network byte order, followed by the payload: the event and its
+arguments as JSON, encoded like the frames of L{sparked.eventbus}.
+Only events with JSON-serializable arguments are recorded; tuples are
+replayed as lists and strings as unicode. Logs are copied between
+machines, so they are never unpickled: replaying a log cannot run
+code.
+
+Every record is flushed as soon as it is written, so that a crash
+does not lose the events which led up to it.
+
+Record the RFID events of an installation::
+
+  recorder = EventRecorder(rfid.rfidEvents, app.path("db").child("rfid.log"))
+  recorder.start()
+
+And replay them later, at double speed::
+
+  replayer = EventReplayer(rfid.rfidEvents, "rfid.log", speed=2)
+  d = replayer.start()
+"""
+
+import struct
+
+from twisted.internet import defer
+from twisted.python import log, filepath
+
+from sparked.eventbus import encodeEvent, decodeEvent
+
+
+MAGIC = "SPARKED-EVENTLOG-2\n"
+
+RECORD_HEADER = "!dI"
+RECORD_HEADER_SIZE = struct.calcsize(RECORD_HEADER)
+
+
+def _asFilePath(fp):
+    if isinstance(fp, filepath.FilePath):
+        return fp
+    return filepath.FilePath(fp)
+
+
+def readEventLog(fp):
+    """
+    Iterate over the records of an event log. Yields C{(timestamp,
+    event, args, kwargs)} tuples. An incomplete record at the end of the
+    log (e.g. after a crash while writing) is ignored. Raises
+    C{ValueError} when the file is not an event log, or when a record
+    is invalid.
+    """
+    f = _asFilePath(fp).open("r")
+    try:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not an event log: %s" % _asFilePath(fp).path)
+        while True:
+            header = f.read(RECORD_HEADER_SIZE)
+            if len(header) < RECORD_HEADER_SIZE:
+                return
+            timestamp, length = struct.unpack(RECORD_HEADER, header)
+            payload = f.read(length)
+            if len(payload) < length:
+                return
+            event, arg, kwarg = decodeEvent(payload)
+            yield timestamp, event, arg, kwarg
+    finally:
+        f.close()
+
+
+
+class EventRecorder(object):
+    """
+    Records all events which pass an L{sparked.events.EventDispatcher}
+    (including the events of its children) into an event log.
+
+    @ivar recorded: The number of recorded events.
+    @ivar skipped: The number of events which could not be recorded
+    because their arguments could not be encoded as JSON.
+    """
+
+    recorded = 0
+    skipped = 0
+
+    def __init__(self, dispatcher, fp, reactor=None):
+        self.dispatcher = dispatcher
+        self.filePath = _asFilePath(fp)
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self.file = None
+
+
+    def start(self):
+        """
+        Start recording. Appends to the log if it already exists.
+        """
+        exists = self.filePath.exists() and self.filePath.getsize() > 0
+        self.file = open(self.filePath.path, "ab")
+        if not exists:
+            self.file.write(MAGIC)
+        self.dispatcher.addTap(self.record)
+
+
+    def stop(self):
+        """
+        Stop recording and close the log.
+        """
+        self.dispatcher.removeTap(self.record)
+        self.file.close()
+        self.file = None
+
+
+    def record(self, event, arg, kwarg):
+        try:
+            payload = encodeEvent(event, arg, kwarg)
+        except (TypeError, ValueError):
+            if not self.skipped:
+                log.msg("%s: cannot record event '%s'" % (self.__class__.__name__, event))
+            self.skipped += 1
+            return
+        self.file.write(struct.pack(RECORD_HEADER, self.reactor.seconds(), len(payload)) + payload)
+        self.file.flush()
+        self.recorded += 1
+
+
+
+class EventReplayer(object):
+    """
+    Replays an event log on an L{sparked.events.EventDispatcher}.
+
+    @ivar speed: The replay speed relative to the recording: 1 replays
+    in real time, 10 ten times as fast. When C{None}, the events are
+    replayed as fast as possible, in batches of C{batchSize} events
+    per reactor iteration.
+
+    @ivar replayed: The number of replayed events.
+    """
+
+    speed = 1.0
+    batchSize = 1000
+    replayed = 0
+
+    def __init__(self, dispatcher, fp, speed=1.0, reactor=None):
+        self.dispatcher = dispatcher
+        self.filePath = _asFilePath(fp)
+        self.speed = speed
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self._call = None
+        self.deferred = None
+
+
+    def start(self):
+        """
+        Start replaying. Returns a Deferred which fires with the
+        number of replayed events when the whole log has been
+        replayed.
+        """
+        self.replayed = 0
+        self._records = readEventLog(self.filePath)
+        self._next = None
+        self._first = None
+        self._start = self.reactor.seconds()
+        self.deferred = defer.Deferred()
+        self._schedule()
+        return self.deferred
+
+
+    def stop(self):
+        """
+        Stop replaying. The Deferred returned by C{start} fires with
+        the number of events replayed so far.
+        """
+        if self._call is not None and self._call.active():
+            self._call.cancel()
+        self._finish()
+
+
+    def _finish(self):
+        self._call = None
+        self._records = None
+        d, self.deferred = self.deferred, None
+        if d is not None:
+            d.callback(self.replayed)
+
+
+    def _fetch(self):
+        if self._next is None:
+            try:
+                self._next = next(self._records)
+            except StopIteration:
+                return None
+            if self._first is None:
+                self._first = self._next[0]
+        return self._next
+
+
+    def _due(self, record):
+        """
+        Return the time at which the given record is to be replayed.
+        """
+        if self.speed is None:
+            return self._start
+        return self._start + (record[0] - self._first) / float(self.speed)
+
+
+    def _schedule(self):
+        record = self._fetch()
+        if record is None:
+            return self._finish()
+        delay = max(0, self._due(record) - self.reactor.seconds())
+        self._call = self.reactor.callLater(delay, self._replay)
+
+
+    def _replay(self):
+        """
+        Dispatch all records which are due; or, when replaying as
+        fast as possible, the next batch of records.
+        """
+        count = 0
+        while True:
+            record = self._fetch()
+            if record is None:
+                break
+            if self.speed is None:
+                if count >= self.batchSize:
+                    break
+            elif self._due(record) > self.reactor.seconds():
+                break
+            self._next = None
+            timestamp, event, arg, kwarg = record
+            self.dispatcher.dispatch(event, *arg, **kwarg)
+            self.replayed += 1
+            count += 1
+        self._schedule()
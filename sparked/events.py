@@ -5,9 +5,264 @@
 """
 Classes which define a generic event system.
 """
-from twisted.python import log
+import threading
+import time
+import weakref
+from collections import deque
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from twisted.internet import defer
+from twisted.python import failure, log, threadable
 from twisted.words.xish import utility
 
+from sparked.stats import Timing
+
+
+OVERFLOW_BLOCK = "block"
+""" Overflow policy: block the producing thread until there is room in the queue. """
+
+OVERFLOW_DROP_OLDEST = "drop-oldest"
+""" Overflow policy: drop the oldest queued event to make room for the new one. """
+
+OVERFLOW_DROP_NEWEST = "drop-newest"
+""" Overflow policy: drop the event which is being queued. """
+
+
+_unkeyed = object()
+""" Marker for observers which are not registered with a key. """
+
+
+def _keyFunction(spec):
+    """
+    Return a function C{f(arg, kwarg)} which returns the key of an
+    event according to the given spec. See
+    L{EventDispatcher.setEventKey}.
+    """
+    if isinstance(spec, tuple):
+        fns = [_keyFunction(s) for s in spec]
+        return lambda arg, kwarg: tuple([f(arg, kwarg) for f in fns])
+    if callable(spec):
+        return lambda arg, kwarg: spec(*arg, **kwarg)
+    if isinstance(spec, int):
+        return lambda arg, kwarg: arg[spec]
+    return lambda arg, kwarg: kwarg[spec]
+
+
+statistics = None
+"""
+The L{DispatchStatistics} which is collecting dispatch timings, or
+C{None} when instrumentation is off. See L{enableStatistics}.
+"""
+
+
+def enableStatistics():
+    """
+    Start collecting dispatch statistics for all event dispatchers.
+    Returns the L{DispatchStatistics} object.
+    """
+    global statistics
+    if statistics is None:
+        statistics = DispatchStatistics()
+    return statistics
+
+
+def disableStatistics():
+    """
+    Stop collecting dispatch statistics.
+    """
+    global statistics
+    statistics = None
+
+
+
+def observerName(fn):
+    """
+    Return a readable, dotted name for an observer callable.
+    """
+    if isinstance(fn, _WeakObserver):
+        fn = fn.observer()
+    cls = getattr(fn, "im_class", None)
+    name = getattr(fn, "__name__", None)
+    if name is None:
+        return repr(fn)
+    if cls is not None:
+        return "%s.%s.%s" % (cls.__module__, cls.__name__, name)
+    return "%s.%s" % (getattr(fn, "__module__", None), name)
+
+
+
+class DispatchStatistics(object):
+    """
+    Timing statistics of event dispatching.
+
+    @ivar events: Dict mapping event names to a L{Timing} of the
+    complete dispatch of the event, including the propagation to
+    parent dispatchers.
+
+    @ivar observers: Dict mapping observer names (see
+    L{observerName}) to a L{Timing} of the calls to that observer.
+    """
+
+    def __init__(self):
+        self.reset()
+
+
+    def reset(self):
+        self.events = {}
+        self.observers = {}
+
+
+    def addEvent(self, event, duration):
+        try:
+            timing = self.events[event]
+        except KeyError:
+            timing = self.events[event] = Timing()
+        timing.add(duration)
+
+
+    def addObserver(self, observerfn, duration):
+        name = observerName(observerfn)
+        try:
+            timing = self.observers[name]
+        except KeyError:
+            timing = self.observers[name] = Timing()
+        timing.add(duration)
+
+
+    def asDict(self):
+        return {'events': dict([(str(k), v.asDict()) for k, v in self.events.iteritems()]),
+                'observers': dict([(k, v.asDict()) for k, v in self.observers.iteritems()])}
+
+
+    def dump(self, fp):
+        """
+        Write the statistics as JSON to the given L{filepath.FilePath}.
+        """
+        fp.setContent(json.dumps(self.asDict(), indent=2))
+
+
+
+_deadObservers = []
+"""
+List of C{(dispatcher weakref, event, observer)} tuples of weak
+observers whose referent has been garbage collected. They are removed
+from their dispatcher on the next dispatch.
+"""
+
+
+def _pruneDeadObservers():
+    dead = _deadObservers[:]
+    del _deadObservers[:len(dead)]
+    for ref, event, observer in dead:
+        dispatcher = ref()
+        if dispatcher is not None:
+            dispatcher.removeObserver(event, observer)
+
+
+
+class _WeakObserver(object):
+    """
+    Wraps an observer callable (usually a bound method) without
+    keeping it, or the object it is bound to, alive. Hashes and
+    compares equal to the callable it wraps, so it can be removed
+    with C{removeObserver} using the original callable.
+    """
+
+    def __init__(self, fn, dispatcher, event):
+        def dead(ref, dispatcher=weakref.ref(dispatcher)):
+            _deadObservers.append((dispatcher, event, self))
+        self.func = getattr(fn, "im_func", None)
+        if self.func is not None:
+            self.ref = weakref.ref(fn.im_self, dead)
+        else:
+            self.ref = weakref.ref(fn, dead)
+        self.hash = hash(fn)
+
+
+    def observer(self):
+        """
+        Return the wrapped callable, or C{None} when it is gone.
+        """
+        obj = self.ref()
+        if obj is None or self.func is None:
+            return obj
+        return self.func.__get__(obj, obj.__class__)
+
+
+    def __call__(self, *args, **kwargs):
+        fn = self.observer()
+        if fn is not None:
+            return fn(*args, **kwargs)
+
+
+    def __hash__(self):
+        return self.hash
+
+
+    def __eq__(self, other):
+        if other is self:
+            return True
+        if isinstance(other, _WeakObserver):
+            obj = self.ref()
+            return obj is not None and obj is other.ref() and self.func is other.func
+        obj = self.ref()
+        if obj is None:
+            return False
+        if self.func is None:
+            return obj is other
+        return getattr(other, "im_self", None) is obj and getattr(other, "im_func", None) is self.func
+
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+
+class CallbackList(utility.CallbackList):
+    """
+    Container for the callbacks of an event on one priority level.
+    """
+
+    def timedCallback(self, stats, *args, **kwargs):
+        """
+        Like C{callback}, but add the duration of each call to the
+        given L{DispatchStatistics}.
+        """
+        for key, (methodwrapper, onetime) in self.callbacks.items():
+            start = time.time()
+            try:
+                methodwrapper(*args, **kwargs)
+            except:
+                log.err()
+            stats.addObserver(methodwrapper.method, time.time() - start)
+
+            if onetime:
+                del self.callbacks[key]
+
+
+    def collectingCallback(self, results, stats, *args, **kwargs):
+        """
+        Like C{callback}, but append the result of each call, as a
+        Deferred, to the C{results} list. When C{stats} is not
+        C{None}, the durations are added to it.
+        """
+        for key, (methodwrapper, onetime) in self.callbacks.items():
+            nkwargs = methodwrapper.kwargs.copy()
+            nkwargs.update(kwargs)
+            start = time.time()
+            results.append(defer.maybeDeferred(methodwrapper.method,
+                                               *(methodwrapper.args + args), **nkwargs))
+            if stats is not None:
+                stats.addObserver(methodwrapper.method, time.time() - start)
+
+            if onetime:
+                del self.callbacks[key]
+
+
 class EventDispatcher(utility.EventDispatcher):
     """
     The sparked event dispatcher is simpler than the twisted version:
@@ -21,60 +276,609 @@ class EventDispatcher(utility.EventDispatcher):
     It adds an extra feature: the possibility to give a parent
     dispatcher using C{setEventParent} to which events will be
     dispatched as well.
+
+    Observers are indexed by event name, so the cost of a dispatch
+    depends on the number of observers for that event and not on the
+    total number of registered observers. The observers of the
+    dispatcher and of all its ancestors are combined in one list, so
+    a dispatch on a nested dispatcher is not more expensive than one
+    on a flat dispatcher.
+
+    High-frequency events can be dispatched with C{dispatchCoalesced},
+    which collapses repeated events within one reactor iteration.
+
+    Threads other than the reactor thread can dispatch events with
+    C{dispatchFromThread}.
+
+    Observers can subscribe to a specific key of an event, e.g. the
+    serial number of an RFID tag, by passing C{key} to
+    C{addObserver}. See C{setEventKey}.
+
+    Events which represent a state can be made sticky with
+    C{setSticky}, so that late observers get the current state.
+
+    Observers which are registered with C{addWeakObserver} do not keep
+    their object alive; they disappear when it is garbage collected.
+
+    Taps (see C{addTap}) see all events which pass the dispatcher,
+    e.g. for recording them with L{sparked.eventlog.EventRecorder}.
+
+    Observers which start slow work can return a Deferred; events
+    dispatched with C{dispatchAsync} wait for these. The number of
+    such dispatches in progress, and their duration, can be limited
+    per event with C{setEventConcurrency}.
+
+    Timings of dispatches and observers are collected after calling
+    L{enableStatistics}.
+
+    @ivar threadQueueSize: The maximum number of events which are
+    queued by C{dispatchFromThread}.
+
+    @ivar threadQueuePolicy: What to do when the thread queue is full;
+    one of L{OVERFLOW_BLOCK}, L{OVERFLOW_DROP_OLDEST} or
+    L{OVERFLOW_DROP_NEWEST}.
+
+    @ivar threadBatchSize: The maximum number of queued events which
+    are dispatched in one reactor iteration.
+
+    @ivar threadDropped: The number of events dropped because the
+    thread queue was full.
     """
 
     parent = None
 
     verbose = False
 
-    def __init__(self, eventprefix=""):
+    reactor = None
+
+    threadQueueSize = 1000
+    threadQueuePolicy = OVERFLOW_BLOCK
+    threadBatchSize = 100
+    threadDropped = 0
+
+    def __init__(self, eventprefix="", reactor=None):
         utility.EventDispatcher.__init__(self, eventprefix)
+        self._keyedObservers = {}
+        self._eventKeys = {}
+        self._sticky = {}
+        self._taps = []
+        self._concurrency = {}
+        self._index = {}
+        self._generation = 0
+        self._priorities = None
+        self._coalesced = None
+        self._coalescedOrder = None
+        self._threadQueue = deque()
+        self._threadCondition = threading.Condition()
+        self._threadWakeup = False
+        if reactor is not None:
+            self.reactor = reactor
+
+
+    def _getReactor(self):
+        if self.reactor is None:
+            from twisted.internet import reactor
+            self.reactor = reactor
+        return self.reactor
+
+
+    def addObserver(self, event, observerfn, priority=0, *args, **kwargs):
+        """
+        Register an observer for an event.
+
+        When the C{key} keyword argument is given, the observer is
+        only called for events of which the key (see C{setEventKey})
+        is equal to it. Keyed observers are looked up in a hash table,
+        so they cost nothing for events with a different key.
+        """
+        self._addObserver(False, event, observerfn, priority, *args, **kwargs)
+
+
+    def addWeakObserver(self, event, observerfn, priority=0, *args, **kwargs):
+        """
+        Register an observer like C{addObserver}, but only keep a weak
+        reference to it; for a bound method, to the object it is
+        bound to. When the object is garbage collected, the observer
+        is removed on the next dispatch. This way, registering an
+        observer on a long-living dispatcher does not keep the
+        observing object alive.
+        """
+        observer = _WeakObserver(observerfn, self, event)
+        self._addObserver(False, event, observer, priority, *args, **kwargs)
+
+
+    def addOnetimeObserver(self, event, observerfn, priority=0, *args, **kwargs):
+        """
+        Register a one-time observer for an event. Like
+        C{addObserver}, but the observer is only triggered once.
+        """
+        self._addObserver(True, event, observerfn, priority, *args, **kwargs)
+
+
+    def _addObserver(self, onetime, event, observerfn, priority, *args, **kwargs):
+        # If this is happening in the middle of the dispatch, queue
+        # it up for processing after the dispatch completes
+        if self._dispatchDepth > 0:
+            self._updateQueue.append(lambda: self._addObserver(onetime, event, observerfn, priority, *args, **kwargs))
+            return
+
+        if 'key' in kwargs:
+            key = kwargs.pop('key')
+            observers = self._keyedObservers
+        else:
+            key = _unkeyed
+            observers = self._eventObservers
+
+        if self._sticky.get(event) is not None:
+            self._replaySticky(event, key, observerfn, args, kwargs)
+            if onetime:
+                return
+
+        if priority not in self._eventObservers and priority not in self._keyedObservers:
+            self._priorities = None
+        if priority not in observers:
+            observers[priority] = {}
+
+        if observers is self._keyedObservers:
+            if event not in observers[priority]:
+                observers[priority][event] = {}
+                self._invalidate()
+            table = observers[priority][event]
+            if key not in table:
+                table[key] = CallbackList()
+            callbacklist = table[key]
+        else:
+            if event not in observers[priority]:
+                observers[priority][event] = CallbackList()
+                self._invalidate()
+            callbacklist = observers[priority][event]
+
+        callbacklist.addCallback(onetime, observerfn, *args, **kwargs)
+
+
+    def removeObserver(self, event, observerfn):
+        """
+        Remove callable as observer for an event, on all priority
+        levels and for all keys.
+        """
+        if self._dispatchDepth > 0:
+            self._updateQueue.append(lambda: self.removeObserver(event, observerfn))
+            return
+
+        for priority, priorityObservers in self._eventObservers.items():
+            callbacklist = priorityObservers.get(event)
+            if callbacklist is None:
+                continue
+            callbacklist.removeCallback(observerfn)
+            if callbacklist.isEmpty():
+                self._removeCallbackList(priority, event, callbacklist)
+
+        for priority, priorityObservers in self._keyedObservers.items():
+            for key, callbacklist in priorityObservers.get(event, {}).items():
+                callbacklist.removeCallback(observerfn)
+                if callbacklist.isEmpty():
+                    self._removeCallbackList(priority, event, callbacklist, key)
+
+
+    def _removeCallbackList(self, priority, event, callbacklist, key=_unkeyed):
+        """
+        Remove an (empty) callback list from the observers and
+        invalidate the cached observer lists.
+        """
+        if key is _unkeyed:
+            observers = self._eventObservers
+            container = observers.get(priority, {})
+            k = event
+        else:
+            observers = self._keyedObservers
+            container = observers.get(priority, {}).get(event, {})
+            k = key
+        if container.get(k) is not callbacklist:
+            # already removed by a nested dispatch
+            return
+        del container[k]
+        if key is not _unkeyed and not container:
+            del observers[priority][event]
+            self._invalidate()
+        if not observers[priority]:
+            del observers[priority]
+            self._priorities = None
+        if key is _unkeyed:
+            self._invalidate()
+
+
+    def setSticky(self, event, sticky=True):
+        """
+        Make the given event sticky (or not sticky). The arguments of
+        the last dispatch of a sticky event are remembered, and
+        observers which are added later are called with them
+        immediately. This way, observers of state events (e.g. the
+        power or network state) do not need to query the current
+        state themselves.
+        """
+        if sticky:
+            self._sticky.setdefault(event, None)
+        else:
+            self._sticky.pop(event, None)
+        self._invalidate()
+
+
+    def _replaySticky(self, event, key, observerfn, args, kwargs):
+        """
+        Call an observer with the remembered arguments of a sticky
+        event, if its key matches.
+        """
+        arg, kwarg = self._sticky[event]
+        if key is not _unkeyed:
+            try:
+                if _keyFunction(self._eventKeys.get(event, 0))(arg, kwarg) != key:
+                    return
+            except (IndexError, KeyError, TypeError):
+                return
+            except:
+                log.err()
+                return
+        nkwargs = kwargs.copy()
+        nkwargs.update(kwarg)
+        try:
+            observerfn(*(args + arg), **nkwargs)
+        except:
+            log.err()
+
+
+    def addTap(self, tap):
+        """
+        Add a tap: a callable which is called as C{tap(event, arg,
+        kwarg)} for every event which is dispatched on this dispatcher
+        or on one of its children, before the observers are called.
+        """
+        self._taps.append(tap)
+        self._invalidate()
+
+
+    def removeTap(self, tap):
+        """
+        Remove a tap which was added with C{addTap}.
+        """
+        self._taps.remove(tap)
+        self._invalidate()
+
+
+    def setEventKey(self, event, spec):
+        """
+        Set how the key of the given event is determined, for
+        observers which are added with a C{key}. The spec is either
+        the index of a positional argument of the event, the name of a
+        keyword argument, a callable which is called with the event
+        arguments and returns the key, or a tuple of these, in which
+        case the key is a tuple as well. The default spec is C{0}, the
+        first positional argument.
+        """
+        self._eventKeys[event] = spec
+        self._invalidate()
+
+
+    def _localCallbackLists(self, event):
+        """
+        Return the list of C{(self, priority, callbacklist, keyfn)}
+        tuples for the given event on this dispatcher, in order of
+        descending priority. For keyed observers, callbacklist is a
+        dict which maps keys to callback lists and keyfn is the
+        function which determines the key from the event arguments;
+        otherwise keyfn is C{None}.
+        """
+        if self._priorities is None:
+            self._priorities = sorted(set(self._eventObservers.keys() + self._keyedObservers.keys()), reverse=True)
+        callbacklists = []
+        for priority in self._priorities:
+            callbacklist = self._eventObservers.get(priority, {}).get(event)
+            if callbacklist is not None:
+                callbacklists.append((self, priority, callbacklist, None))
+            table = self._keyedObservers.get(priority, {}).get(event)
+            if table is not None:
+                keyfn = _keyFunction(self._eventKeys.get(event, 0))
+                callbacklists.append((self, priority, table, keyfn))
+        return callbacklists
+
+
+    def _ancestors(self):
+        """
+        Return the list of this dispatcher and all of its parents.
+        """
+        chain = [self]
+        p = self.parent
+        while p is not None and p not in chain:
+            chain.append(p)
+            p = p.parent
+        return chain
+
+
+    def _lookup(self, event):
+        """
+        Return a tuple C{(chain, callbacklists, sticky, taps)} for the
+        given event: the dispatchers in the parent chain, the combined
+        list of C{(dispatcher, priority, callbacklist, keyfn)} tuples
+        of the chain, the dispatchers in the chain for which the event
+        is sticky and the taps of the chain. The result is cached
+        until observers, parents, sticky events or taps change on one
+        of the dispatchers in the chain.
+        """
+        cached = self._index.get(event)
+        if cached is not None:
+            generations, result = cached
+            for d, generation in generations:
+                if d._generation != generation:
+                    break
+            else:
+                return result
+        chain = self._ancestors()
+        callbacklists = []
+        for d in chain:
+            callbacklists.extend(d._localCallbackLists(event))
+        sticky = [d for d in chain if event in d._sticky]
+        taps = []
+        for d in chain:
+            taps.extend(d._taps)
+        result = (chain, callbacklists, sticky, taps)
+        self._index[event] = ([(d, d._generation) for d in chain], result)
+        return result
+
+
+    def _invalidate(self):
+        """
+        Invalidate the cached observer lists of this dispatcher and of
+        the dispatchers below it: the observers, the parent, the sticky
+        events or the taps of this dispatcher have changed.
+        """
+        self._generation += 1
 
 
     def dispatch(self, event, *arg, **kwarg):
         """
         Dispatch the named event to all the callbacks.
         """
-        foundTarget = False
+        stats = statistics
+        if stats is None:
+            return self._dispatch(event, arg, kwarg, None)
+        start = time.time()
+        try:
+            return self._dispatch(event, arg, kwarg, stats)
+        finally:
+            stats.addEvent(event, time.time() - start)
+
 
-        if self.verbose:
-            log.msg("%s --> %s: %s %s" % (repr(self), event, arg, kwarg))
+    def _dispatch(self, event, arg, kwarg, stats, results=None):
+        if _deadObservers:
+            _pruneDeadObservers()
 
-        self._dispatchDepth += 1
+        chain, callbacklists, sticky, taps = self._lookup(event)
+        found = False
 
-        observers = self._eventObservers
+        for d in sticky:
+            d._sticky[event] = (arg, kwarg)
 
-        priorities = observers.keys()
-        priorities.sort()
-        priorities.reverse()
+        for tap in taps:
+            try:
+                tap(event, arg, kwarg)
+            except:
+                log.err()
+
+        for d in chain:
+            if d.verbose:
+                log.msg("%s --> %s: %s %s" % (repr(d), event, arg, kwarg))
+            d._dispatchDepth += 1
 
         emptyLists = []
-        for priority in priorities:
-            for query, callbacklist in observers[priority].iteritems():
-                if query == event:
-                    callbacklist.callback(*arg, **kwarg)
-                    foundTarget = True
-                    if callbacklist.isEmpty():
-                        emptyLists.append((priority, query))
+        for d, priority, callbacklist, keyfn in callbacklists:
+            key = _unkeyed
+            if keyfn is not None:
+                try:
+                    key = keyfn(arg, kwarg)
+                    callbacklist = callbacklist[key]
+                except (IndexError, KeyError, TypeError):
+                    continue
+                except:
+                    log.err()
+                    continue
+            if d is self:
+                found = True
+            if results is not None:
+                callbacklist.collectingCallback(results, stats, *arg, **kwarg)
+            elif stats is None:
+                callbacklist.callback(*arg, **kwarg)
+            else:
+                callbacklist.timedCallback(stats, *arg, **kwarg)
+            if callbacklist.isEmpty():
+                emptyLists.append((d, priority, callbacklist, key))
+
+        for d, priority, callbacklist, key in emptyLists:
+            d._removeCallbackList(priority, event, callbacklist, key)
+
+        for d in chain:
+            d._dispatchDepth -= 1
+
+            # If this is a dispatch within a dispatch, don't
+            # do anything with the updateQueue -- it needs to
+            # wait until we've back all the way out of the stack
+            if d._dispatchDepth == 0 and d._updateQueue:
+                # Deal with pending update operations
+                updates, d._updateQueue = d._updateQueue, []
+                for f in updates:
+                    f()
+
+        return found
+
+
+    def setEventConcurrency(self, event, limit, timeout=None):
+        """
+        Limit the asynchronous dispatches of the given event on this
+        dispatcher (see C{dispatchAsync}). At most C{limit} dispatches
+        are in progress at the same time; further dispatches are
+        queued until one of them finishes. When C{timeout} is given,
+        the observers which have not finished C{timeout} seconds after
+        the dispatch started are cancelled. Pass C{None} as C{limit}
+        to remove the limits.
+        """
+        if limit is None:
+            self._concurrency.pop(event, None)
+            return
+        self._concurrency[event] = (defer.DeferredSemaphore(limit), timeout)
 
-        for priority, query in emptyLists:
-            del observers[priority][query]
 
-        self._dispatchDepth -= 1
+    def dispatchAsync(self, event, *arg, **kwarg):
+        """
+        Dispatch the named event, and wait for the Deferreds returned
+        by its observers.
+
+        Returns a Deferred which fires, when all observers have
+        finished, with a list of C{(success, result)} tuples like a
+        L{defer.DeferredList}. Errors of the observers are logged as
+        well. Observers which time out fail with
+        L{defer.TimeoutError}.
+
+        When a concurrency limit is set with C{setEventConcurrency}
+        and reached, the dispatch is postponed until a previous one
+        has finished.
+        """
+        if event not in self._concurrency:
+            return self._dispatchAsync(event, arg, kwarg, None)
+        semaphore, timeout = self._concurrency[event]
+        return semaphore.run(self._dispatchAsync, event, arg, kwarg, timeout)
+
+
+    def _dispatchAsync(self, event, arg, kwarg, timeout):
+        results = []
+        stats = statistics
+        start = time.time()
+        self._dispatch(event, arg, kwarg, stats, results)
+        if stats is not None:
+            stats.addEvent(event, time.time() - start)
+
+        timedOut = []
+        def failed(f):
+            if timedOut and f.check(defer.CancelledError):
+                f = failure.Failure(defer.TimeoutError(
+                        "Observer of '%s' timed out after %s seconds" % (event, timeout)))
+            log.err(f)
+            return f
+        for d in results:
+            d.addErrback(failed)
+        dl = defer.DeferredList(results, consumeErrors=True)
+
+        if timeout is not None and not dl.called:
+            def expire():
+                timedOut.append(True)
+                for d in results:
+                    if not d.called:
+                        d.cancel()
+            call = self._getReactor().callLater(timeout, expire)
+            def done(result):
+                if call.active():
+                    call.cancel()
+                return result
+            dl.addBoth(done)
+        return dl
+
+
+    def dispatchCoalesced(self, event, key, *arg, **kwarg):
+        """
+        Dispatch the named event in the next reactor iteration. When
+        the same event is queued multiple times with an equal C{key}
+        before that, it is dispatched only once, in the position of
+        its first occurrence, with the arguments of the last one.
+        """
+        if self._coalesced is None:
+            self._coalesced = {}
+            self._coalescedOrder = []
+            self._getReactor().callLater(0, self._flushCoalesced)
+        k = (event, key)
+        if k not in self._coalesced:
+            self._coalescedOrder.append(k)
+        self._coalesced[k] = (arg, kwarg)
+
 
-        # If this is a dispatch within a dispatch, don't
-        # do anything with the updateQueue -- it needs to
-        # wait until we've back all the way out of the stack
-        if self._dispatchDepth == 0:
-            # Deal with pending update operations
-            for f in self._updateQueue:
-                f()
-            self._updateQueue = []
+    def _flushCoalesced(self):
+        """
+        Dispatch all the events queued by C{dispatchCoalesced}.
+        """
+        pending, order = self._coalesced, self._coalescedOrder
+        self._coalesced = self._coalescedOrder = None
+        for k in order:
+            arg, kwarg = pending[k]
+            self.dispatch(k[0], *arg, **kwarg)
+
+
+    def dispatchFromThread(self, event, *arg, **kwarg):
+        """
+        Dispatch the named event from a thread which is not the
+        reactor thread. The event is put in a bounded queue which is
+        dispatched in batches in the reactor thread; the reactor is
+        woken up only once for all events that are queued before the
+        queue is drained.
+
+        When the queue is full, C{threadQueuePolicy} decides what
+        happens. Returns False if the event was dropped, True
+        otherwise.
+        """
+        if threadable.isInIOThread():
+            # Blocking the reactor thread would deadlock; keep the
+            # order by dispatching the queued events first.
+            self._drainThreadQueue(drainAll=True)
+            self.dispatch(event, *arg, **kwarg)
+            return True
+
+        queue = self._threadQueue
+        cond = self._threadCondition
+        cond.acquire()
+        try:
+            if len(queue) >= self.threadQueueSize:
+                if self.threadQueuePolicy == OVERFLOW_DROP_NEWEST:
+                    self.threadDropped += 1
+                    return False
+                if self.threadQueuePolicy == OVERFLOW_DROP_OLDEST:
+                    queue.popleft()
+                    self.threadDropped += 1
+                else:
+                    while len(queue) >= self.threadQueueSize:
+                        cond.wait()
+            queue.append((event, arg, kwarg))
+            wakeup = not self._threadWakeup
+            self._threadWakeup = True
+        finally:
+            cond.release()
+
+        if wakeup:
+            self._getReactor().callFromThread(self._drainThreadQueue)
+        return True
+
+
+    def _drainThreadQueue(self, drainAll=False):
+        """
+        Dispatch a batch of events from the thread queue. If events
+        remain, schedule the next batch for the next reactor
+        iteration.
+        """
+        queue = self._threadQueue
+        cond = self._threadCondition
+        cond.acquire()
+        try:
+            if drainAll:
+                batchSize = len(queue)
+            else:
+                batchSize = min(self.threadBatchSize, len(queue))
+            batch = [queue.popleft() for i in range(batchSize)]
+            remaining = len(queue) > 0
+            if not remaining:
+                self._threadWakeup = False
+            cond.notifyAll()
+        finally:
+            cond.release()
 
-        if self.parent:
-            self.parent.dispatch(event, *arg, **kwarg)
+        for event, arg, kwarg in batch:
+            self.dispatch(event, *arg, **kwarg)
 
-        return foundTarget
+        if remaining:
+            self._getReactor().callLater(0, self._drainThreadQueue)
 
 
     def setEventParent(self, p):
@@ -82,6 +886,7 @@ class EventDispatcher(utility.EventDispatcher):
         Set a parent to which events will be dispatched as well.
         """
         self.parent = p
+        self._invalidate()
 
 
     def disownEventParent(self):
@@ -89,3 +894,4 @@ class EventDispatcher(utility.EventDispatcher):
         Unparent this event dispatcher.
         """
         self.parent = None
+        self._invalidate()
@@ -8,13 +8,12 @@ displays.
 
 F11 toggles fullscreen.
 """
-import gtk
 import clutter
-import dbus
 
 from twisted.internet import reactor
 
 from sparked import events
+from sparked.application import HeadlessError
 
 
 class Stage (clutter.Stage):
@@ -25,11 +24,13 @@ class Stage (clutter.Stage):
     @ivar debug: Whether debugging is enabled. This is retrieved from the --debug flag from the sparkd runner.
     """
     
-    keys = {'fullscreen': gtk.keysyms.F11,
-            'quit': (clutter.CONTROL_MASK, gtk.keysyms.q)}
+    keys = {'fullscreen': clutter.keysyms.F11,
+            'quit': (clutter.CONTROL_MASK, clutter.keysyms.q)}
     debug = False
     
     def __init__(self, app):
+        if app.headless:
+            raise HeadlessError("The stage needs a display; it cannot be used with --headless")
         clutter.Stage.__init__(self)
         self.app = app
         self.app.state.addListener(self)
@@ -132,6 +133,7 @@ class Stage (clutter.Stage):
         """
         Prevent the screen saver from starting.
         """
+        import dbus
         bus = dbus.SessionBus()
         iface = dbus.Interface(bus.get_object('org.gnome.ScreenSaver', "/org/gnome/ScreenSaver"), 'org.gnome.ScreenSaver')
         self.screensaverInhibited = iface.Inhibit(self.app.name, reason)
@@ -143,6 +145,7 @@ class Stage (clutter.Stage):
         """
         if not self.screensaverInhibited:
             return
+        import dbus
         bus = dbus.SessionBus()
         iface = dbus.Interface(bus.get_object('org.gnome.ScreenSaver', "/org/gnome/ScreenSaver"), 'org.gnome.ScreenSaver')
         iface.UnInhibit(self.screensaverInhibited)
@@ -11,6 +11,7 @@ import gtk
 from twisted.python import log
 from twisted.internet import reactor
 from sparked import events
+from sparked.application import HeadlessError
 
 
 class StatusWindow (gtk.Window):
@@ -22,6 +23,8 @@ class StatusWindow (gtk.Window):
     maxLogLines = 2000
 
     def __init__(self, app):
+        if app.headless:
+            raise HeadlessError("The status window needs a display; it cannot be used with --headless")
         gtk.Window.__init__(self)
         self.app = app
         self.set_title(app.title + " - Status window")
@@ -1,3 +1,50 @@
 # Copyright (c) 2010 Arjan Scherpenisse
 # See LICENSE for details.
 
+"""
+Classes which deal with hardware in Sparked.
+
+The modules import the libraries they need (dbus, gst, ...) on first
+use, not when they are imported.
+"""
+
+dbusMainLoop = True
+""" Whether dbus uses the glib mainloop; false when running headless. """
+
+owner = True
+""" Whether this process owns the hardware; false in all but the first worker (see C{--workers}). """
+
+_dbusMainLoop = None
+
+def importDBus():
+    """
+    Import the dbus module and return it. The first time, the glib main
+    loop is made the default main loop of dbus (unless C{dbusMainLoop}
+    is false), so that dbus signals arrive in the (glib-based)
+    reactor. Raises C{ImportError} when dbus is not available.
+    """
+    global _dbusMainLoop
+    import dbus
+    if _dbusMainLoop is None and dbusMainLoop:
+        import dbus.mainloop.glib
+        _dbusMainLoop = dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
+    return dbus
+
+
+def addSignalReceiver(bus, handler, **kwargs):
+    """
+    Call C{handler} on a dbus signal, like C{bus.add_signal_receiver}.
+    Without the glib mainloop (when running headless), signals cannot
+    be received: the handler is not registered, and C{False} is
+    returned, so the caller only reads the current state.
+    """
+    if not dbusMainLoop:
+        return False
+    try:
+        bus.add_signal_receiver(handler, **kwargs)
+    except RuntimeError:
+        # dbus has no main loop
+        from twisted.python import log
+        log.msg("Cannot receive dbus signals: no dbus main loop")
+        return False
+    return True
@@ -6,11 +6,14 @@ Hardware monitoring classes based on linux' HAL system.
 """
 
 import os
-import dbus
 import glob
 
 from twisted.application import service
 from twisted.internet import reactor
+from twisted.python import log
+
+from sparked import startup, hardware
+from sparked.hardware import importDBus, addSignalReceiver
 
 
 DBUS_INTERFACE = "org.freedesktop.DBus"
@@ -48,18 +51,25 @@ class HardwareMonitor (service.Service):
 
     def startService(self):
         self.deviceInfo = {}
-        self.bus = dbus.SystemBus()
-        self.bus.add_signal_receiver(self._halDeviceAdded,
-                                dbus_interface=HAL_MANAGER_INTERFACE,
-                                signal_name='DeviceAdded')
-        self.bus.add_signal_receiver(self._halDeviceRemoved,
-                                dbus_interface=HAL_MANAGER_INTERFACE,
-                                signal_name='DeviceRemoved')
-
+        if not hardware.owner:
+            log.msg("%s: another worker owns the hardware, not monitoring %s devices" % (self.__class__.__name__, self.subsystem))
+            return
+        self.bus = importDBus().SystemBus()
+        addSignalReceiver(self.bus, self._halDeviceAdded,
+                          dbus_interface=HAL_MANAGER_INTERFACE,
+                          signal_name='DeviceAdded')
+        addSignalReceiver(self.bus, self._halDeviceRemoved,
+                          dbus_interface=HAL_MANAGER_INTERFACE,
+                          signal_name='DeviceRemoved')
+
+        phase = "hal-enumeration-%s" % self.subsystem
+        startup.begin(phase)
         self.manager = self._getHalInterface(HAL_MANAGER_UDI, HAL_MANAGER_INTERFACE)
 
         for udi in self.manager.FindDeviceByCapability(self.subsystem):
             reactor.callLater(0, self._halDeviceAdded, udi)
+        # The phase ends after the devices have been added
+        reactor.callLater(0, startup.end, phase)
 
 
     def stopService(self):
@@ -70,7 +80,7 @@ class HardwareMonitor (service.Service):
 
     def _getHalInterface(self, udi, interface=HAL_DEVICE_INTERFACE):
         obj = self.bus.get_object(HAL_INTERFACE, udi)
-        return dbus.Interface(obj, interface)
+        return importDBus().Interface(obj, interface)
 
 
     def _halDeviceAdded(self, udi):
@@ -5,29 +5,35 @@
 Network monitoring class: check if the internet is reachable.
 """
 
-import dbus
-
 from twisted.application import service
-from twisted.web import client
-from twisted.internet import reactor, defer
+from twisted.internet import defer
+from twisted.python import log
 
-from sparked import events
+from sparked import events, timing
+from sparked.hardware import importDBus, addSignalReceiver
 
 
 class NetworkConnectionService(service.Service):
     """
-    Check on network connection existence through NetworkManager.
+    Check on network connection existence through NetworkManager. The
+    "connected" event is sticky: observers which are added later are
+    called with the current state right away.
     """
 
     def startService(self):
+        try:
+            dbus = importDBus()
+        except ImportError:
+            log.msg("%s: dbus is not available, not monitoring the network" % self.__class__.__name__)
+            return
         bus = dbus.SystemBus()
         interface = 'org.freedesktop.NetworkManager'
         udi = '/org/freedesktop/NetworkManager'
 
         managerObj = bus.get_object(interface, udi)
-        bus.add_signal_receiver(self.stateChanged,
-                                dbus_interface=interface,
-                                signal_name='PropertiesChanged')
+        addSignalReceiver(bus, self.stateChanged,
+                          dbus_interface=interface,
+                          signal_name='PropertiesChanged')
         self.properties = dbus.Interface(managerObj, 'org.freedesktop.DBus.Properties')
         self.stateChanged()
 
@@ -47,6 +53,7 @@ class NetworkWebConnectionService(service.Service):
 
     url = None
     delay = 30
+    _dc = None
 
     def __init__(self, url):
         self.url = url
@@ -54,12 +61,16 @@ class NetworkWebConnectionService(service.Service):
 
     def startService(self):
         self.connected = False
-        self.loop()
-        # Listen to events from NetworkManager
+        # Listen to events from NetworkManager; this calls self.event
+        # right away when the connection state is already known.
         networkEvents.addObserver("connected", self.event)
+        if self._dc is None:
+            self.loop()
 
 
     def loop(self):
+        # twisted.web.client installs the reactor when it is imported
+        from twisted.web import client
         d = client.getPage(self.url)
         def ok(_):
             if not self.connected:
@@ -75,7 +86,7 @@ class NetworkWebConnectionService(service.Service):
         d.addErrback(error)
 
         d = defer.Deferred()
-        self._dc = reactor.callLater(self.delay, lambda : d.callback(None))
+        self._dc = timing.getTimingWheel().callLater(self.delay, lambda : d.callback(None))
         d.addCallback(lambda _: self.loop())
         return d
 
@@ -96,3 +107,5 @@ class NetworkWebConnectionService(service.Service):
 
 
 networkEvents = events.EventDispatcher()
+networkEvents.setSticky("connected")
+networkEvents.setSticky("web-connected")
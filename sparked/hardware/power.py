@@ -6,10 +6,11 @@ Power monitor: fires events when AC power becomes (un)available; and
 fires an event when the power becomes critically low.
 """
 
-import dbus
-
 from twisted.application import service
+from twisted.python import log
+
 from sparked import events
+from sparked.hardware import importDBus, addSignalReceiver
 
 
 class PowerService(service.Service):
@@ -17,7 +18,8 @@ class PowerService(service.Service):
     A service which monitors the power state of the computer. It fires
     "available" and "low" events when the power state changes. On the
     startup of the service, these signals get fired once to ensure a
-    valid system state.
+    valid system state. Both events are sticky: observers which are
+    added later are called with the current state right away.
     """
 
     def __init__(self):
@@ -25,6 +27,11 @@ class PowerService(service.Service):
 
 
     def startService(self):
+        try:
+            dbus = importDBus()
+        except ImportError:
+            log.msg("%s: dbus is not available, not monitoring the power" % self.__class__.__name__)
+            return
 
         try:
             bus = dbus.Bus()
@@ -32,12 +39,12 @@ class PowerService(service.Service):
             hal_udi = '/org/freedesktop/PowerManagement'
 
             managerObj = bus.get_object(hal_interface, hal_udi)
-            bus.add_signal_receiver(self.powerEvent,
-                                         dbus_interface=hal_interface,
-                                         signal_name='OnBatteryChanged')
-            bus.add_signal_receiver(self.lowpowerEvent,
-                                         dbus_interface=hal_interface,
-                                         signal_name='LowBatteryChanged')
+            addSignalReceiver(bus, self.powerEvent,
+                              dbus_interface=hal_interface,
+                              signal_name='OnBatteryChanged')
+            addSignalReceiver(bus, self.lowpowerEvent,
+                              dbus_interface=hal_interface,
+                              signal_name='LowBatteryChanged')
             manager    = dbus.Interface(managerObj, hal_interface)
 
             self.powerEvent(manager.GetOnBattery())
@@ -51,9 +58,9 @@ class PowerService(service.Service):
                 dk_udi = '/org/freedesktop/DeviceKit/Power'
 
                 managerObj = bus.get_object(dk_interface, dk_udi)
-                bus.add_signal_receiver(self.dkPowerChanged,
-                                             dbus_interface=dk_interface,
-                                             signal_name='Changed')
+                addSignalReceiver(bus, self.dkPowerChanged,
+                                  dbus_interface=dk_interface,
+                                  signal_name='Changed')
                 manager    = dbus.Interface(managerObj, dk_interface)
                 self.dk_properties = dbus.Interface(managerObj, 'org.freedesktop.DBus.Properties')
                 self.dkPowerChanged()
@@ -65,9 +72,9 @@ class PowerService(service.Service):
                 dk_udi = '/org/freedesktop/UPower'
 
                 managerObj = bus.get_object(dk_interface, dk_udi)
-                bus.add_signal_receiver(self.upPowerChanged,
-                                             dbus_interface=dk_interface,
-                                             signal_name='Changed')
+                addSignalReceiver(bus, self.upPowerChanged,
+                                  dbus_interface=dk_interface,
+                                  signal_name='Changed')
                 manager    = dbus.Interface(managerObj, dk_interface)
                 self.up_properties = dbus.Interface(managerObj, 'org.freedesktop.DBus.Properties')
                 self.upPowerChanged()
@@ -111,3 +118,5 @@ class PowerService(service.Service):
 
 
 powerEvents = events.EventDispatcher()
+powerEvents.setSticky("available")
+powerEvents.setSticky("low")
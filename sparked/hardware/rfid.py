@@ -15,9 +15,13 @@ from sparked.hardware.serialcommand import SerialCommandProtocol
 from sparked.hardware.serialport import IProtocolProbe, SerialPortMonitor, SerialProbe
 
 from sparked.events import EventDispatcher
+from sparked import timing
 
 
 rfidEvents = EventDispatcher()
+# Observers can subscribe to a specific tag serial
+rfidEvents.setEventKey("tag-added", lambda info: info['tag'])
+rfidEvents.setEventKey("tag-removed", lambda info: info['tag'])
 
 
 class TagType:
@@ -174,6 +178,16 @@ class HongChangTagProtocol (SerialCommandProtocol):
 
 
 class RFIDReader (object):
+    """
+    Keeps track of the tags which are present on an RFID reader
+    protocol, and dispatches 'tag-added' and 'tag-removed' events.
+
+    The protocol only holds a weak reference to the reader: keep a
+    reference to it for as long as it needs to be active.
+
+    The timeouts of the tags, which are reset on every poll, are kept
+    on the shared L{sparked.timing.TimingWheel} of the reactor.
+    """
 
     identifier = None
     protocol = None
@@ -185,12 +199,15 @@ class RFIDReader (object):
         assert IRFIDReaderProtocol.implementedBy(protocol.__class__)
 
         self.events = EventDispatcher()
+        self.events.setEventKey("tag-added", lambda info: info['tag'])
+        self.events.setEventKey("tag-removed", lambda info: info['tag'])
         self.events.setEventParent(rfidEvents)
 
         self.identifier = identifier
 
         self.protocol = protocol
-        self.protocol.events.addObserver("tag-present", self.gotTag)
+        # A weak observer, so the protocol does not keep us alive
+        self.protocol.events.addWeakObserver("tag-present", self.gotTag)
         self.protocol.events.setEventParent(self.events)
 
         self.protocol.start()
@@ -199,6 +216,7 @@ class RFIDReader (object):
         if reactor is None:
             from twisted.internet import reactor
         self.reactor = reactor
+        self.wheel = timing.getTimingWheel(reactor)
 
 
     def _tagTimeout(self, tpe, tag):
@@ -209,12 +227,21 @@ class RFIDReader (object):
     def gotTag(self, tpe, tag):
         if tag in self.tags:
             return self.tags[tag].reset(self.timeout)
-        self.tags[tag] = self.reactor.callLater(self.timeout, self._tagTimeout, tpe, tag)
+        self.tags[tag] = self.wheel.callLater(self.timeout, self._tagTimeout, tpe, tag)
         self.events.dispatch("tag-added", {'tag': tag, 'type': tpe, 'reader': self.identifier})
 
 
-    def __del__(self):
-        print "del"
+    def stop(self):
+        """
+        Stop the protocol and forget about the present tags, without
+        dispatching 'tag-removed' events.
+        """
+        self.protocol.stop()
+        self.protocol.events.disownEventParent()
+        for timer in self.tags.values():
+            if timer.active():
+                timer.cancel()
+        self.tags = {}
 
 
 
@@ -240,7 +267,7 @@ class RFIDMonitor (SerialPortMonitor):
     def deviceRemoved(self, info):
         p = info['unique_path']
         if p in self.readers:
-            self.readers[p].protocol.stop()
+            self.readers[p].stop()
             del self.readers[p]
 
 
@@ -30,6 +30,9 @@ class SerialPortMonitor (hal.HardwareMonitor):
 
 serialEvents = events.EventDispatcher()
 """ Global event dispatcher for all serial events """
+# Observers can subscribe to a specific device
+serialEvents.setEventKey("serial-added", lambda info: info.get("unique_path"))
+serialEvents.setEventKey("serial-removed", lambda info: info.get("unique_path"))
 
 
 class IProtocolProbe(Interface):
@@ -0,0 +1,84 @@
+# Copyright (c) 2011 Arjan Scherpenisse
+# See LICENSE for details.
+
+"""
+Tests for the dbus handling in sparked.hardware
+
+Maintainer: Arjan Scherpenisse
+"""
+
+from twisted.trial import unittest
+
+from sparked import hardware
+from sparked.hardware import power
+
+
+class FakeBus(object):
+    """
+    A bus without a main loop, like dbus-python's.
+    """
+
+    def add_signal_receiver(self, handler, **kwargs):
+        raise RuntimeError("To receive signals, D-Bus connections must be attached to a main loop")
+
+    def get_object(self, name, path):
+        return path
+
+
+
+class FakeManager(object):
+
+    def GetOnBattery(self):
+        return False
+
+    def GetLowBattery(self):
+        return True
+
+
+
+class FakeDBus(object):
+    Bus = FakeBus
+    SystemBus = FakeBus
+
+    class exceptions(object):
+        class DBusException(Exception):
+            pass
+
+    @staticmethod
+    def Interface(obj, interface):
+        return FakeManager()
+
+
+
+class TestHeadlessDBus(unittest.TestCase):
+
+    def setUp(self):
+        self.patch(power, "importDBus", lambda: FakeDBus)
+        self.events = []
+        self.patch(power, "powerEvents", power.events.EventDispatcher())
+        power.powerEvents.addObserver("available", lambda a: self.events.append(("available", a)))
+        power.powerEvents.addObserver("low", lambda l: self.events.append(("low", l)))
+
+
+    def testAddSignalReceiverWithoutMainLoop(self):
+        self.patch(hardware, "dbusMainLoop", False)
+        self.assertFalse(hardware.addSignalReceiver(FakeBus(), lambda: None, signal_name="Changed"))
+
+
+    def testAddSignalReceiverRaises(self):
+        self.assertFalse(hardware.addSignalReceiver(FakeBus(), lambda: None, signal_name="Changed"))
+
+
+    def testPowerServiceReadsState(self):
+        """
+        The power service starts without a dbus main loop, and reads
+        the current state.
+        """
+        self.patch(hardware, "dbusMainLoop", False)
+        power.PowerService().startService()
+        self.assertEquals([("available", True), ("low", True)], self.events)
+
+
+    def testPowerServiceMainLoopMissing(self):
+        power.PowerService().startService()
+        self.assertEquals([("available", True), ("low", True)], self.events)
@@ -1,8 +1,6 @@
 # Copyright (c) 2010 Arjan Scherpenisse
 # See LICENSE for details.
 
-import gst
-
 from twisted.python import log
 
 from sparked import events
@@ -38,6 +36,7 @@ class V4LDevice (object):
         """
         Find out the resolutions of the device
         """
+        import gst
 
         pipe = gst.parse_launch("%s name=source device=%s ! fakesink" % (self.gstSrc, self.device))
         pipe.set_state(gst.STATE_PAUSED)
@@ -18,6 +18,9 @@ class AnymetaAPIMonitor (monitors.Monitor):
     A L{sparked.monitors.Monitor} subclass which implements an 'api'
     attribute which holds a connection to an anyMeta website through
     the python-anymeta library.
+
+    The connection is set up when the options are first loaded, and
+    only rebuilt when the option which holds the registry key changes.
     """
 
     title = "Anymeta API"
@@ -32,7 +35,12 @@ class AnymetaAPIMonitor (monitors.Monitor):
     def __init__(self, app, attribute='api'):
         self.app = app
         self.attribute = attribute
-        self.app.events.addObserver("options-loaded", self.setAPI)
+        self.app.events.addOnetimeObserver("options-loaded", self.setAPI)
+        self.app.events.addObserver("option-changed", self.optionChanged, key=attribute)
+
+
+    def optionChanged(self, key, old, new):
+        self.setAPI(self.app.appOpts)
 
 
     def setAPI(self, opts):
@@ -0,0 +1,52 @@
+# Copyright (c) 2011 Arjan Scherpenisse
+# See LICENSE for details.
+
+"""
+Listening on a TCP port which is shared between processes.
+
+With C{SO_REUSEPORT} (Linux 3.9 and later), several processes can
+listen on the same port; the kernel spreads the incoming connections
+over them. Sparked uses this for applications which run in several
+workers (C{sparkd --workers N}); see L{sparked.application.Application.listenTCP}.
+"""
+
+import socket
+import sys
+
+from twisted.internet import error
+
+
+SO_REUSEPORT = getattr(socket, "SO_REUSEPORT", None)
+if SO_REUSEPORT is None and sys.platform.startswith("linux"):
+    SO_REUSEPORT = 15
+
+
+def listenReusePort(port, factory, backlog=50, interface='', reactor=None):
+    """
+    Listen on a TCP port with C{SO_REUSEPORT} set, like
+    C{reactor.listenTCP}. The reactor must provide
+    C{IReactorSocket}. Raises C{CannotListenError} when the port cannot
+    be bound, or when the platform does not support C{SO_REUSEPORT}.
+    """
+    if reactor is None:
+        from twisted.internet import reactor
+    if SO_REUSEPORT is None:
+        raise error.CannotListenError(interface, port, "SO_REUSEPORT is not supported")
+    if ":" in interface:
+        family = socket.AF_INET6
+    else:
+        family = socket.AF_INET
+    s = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        try:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            s.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+            s.bind((interface, port))
+            s.listen(backlog)
+        except socket.error, e:
+            raise error.CannotListenError(interface, port, e)
+        s.setblocking(False)
+        # The reactor listens on a duplicate of the socket
+        return reactor.adoptStreamPort(s.fileno(), family, factory)
+    finally:
+        s.close()
@@ -5,11 +5,9 @@
 A mixin object for Service instances that announce the service over Zeroconf.
 """
 
-import avahi
-import dbus
-
 from twisted.python import log
 from sparked import events
+from sparked.hardware import importDBus
 
 
 class _ZeroconfService (object):
@@ -24,6 +22,19 @@ class _ZeroconfService (object):
         self.subscribed = []
 
 
+    def _connect(self):
+        """
+        Import dbus and avahi and connect to the system bus, the first
+        time the service is used. Returns the C{(dbus, avahi)} modules.
+        """
+        # Avahi signals arrive through the dbus mainloop
+        dbus = importDBus()
+        import avahi
+        if not self.bus:
+            self.bus = dbus.SystemBus()
+        return dbus, avahi
+
+
     def publishService(self, name, stype, port, domain="", host=""):
         """
         Publish a named service on the local zeroconf network.
@@ -31,9 +42,7 @@ class _ZeroconfService (object):
         if name in self.published:
             return
 
-        if not self.bus:
-            self.bus = dbus.SystemBus()
-
+        dbus, avahi = self._connect()
         server = dbus.Interface(
                          self.bus.get_object(
                                  avahi.DBUS_NAME,
@@ -77,8 +86,7 @@ class _ZeroconfService (object):
         if serviceType in self.subscribed:
             return
 
-        if not self.bus:
-            self.bus = dbus.SystemBus()
+        dbus, avahi = self._connect()
         if not self.server:
             self.server = dbus.Interface( self.bus.get_object(avahi.DBUS_NAME, '/'), 'org.freedesktop.Avahi.Server')
 
@@ -94,6 +102,7 @@ class _ZeroconfService (object):
     # Avahi handler functions
 
     def _itemNew(self, iface, protocol, name, stype, domain, flags):
+        dbus, avahi = self._connect()
 
         def resolveError(*a):
             log.msg("RESOLVE ERROR:")
@@ -123,6 +132,9 @@ try:
 except NameError:
     zeroconfService = _ZeroconfService()
     zeroconfEvents = events.EventDispatcher()
+    # Observers can subscribe to a (name, type) key
+    zeroconfEvents.setEventKey("service-found", (0, "type"))
+    zeroconfEvents.setEventKey("service-lost", (0, "type"))
 
 
 __all__  = ['zeroconfService', 'zeroconfEvents']
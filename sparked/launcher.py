@@ -7,16 +7,32 @@ The Sparked application launcher.
 
 Sparked applications are launched in a subprocess: so that if the
 application crashes, it is started again.
+
+With C{--standby}, a second subprocess is kept ready next to the
+running one: a warm standby, which has already installed the reactor
+and imported twistd, sparked and the application, and then waits. When
+the application crashes, the standby takes over right away, and a new
+standby is started.
+
+Applications run in the gtk2 reactor, unless C{--headless} is given:
+then they run in the epoll reactor, without a display, and without
+the glib mainloop for dbus. Another reactor can be chosen with
+C{--reactor}; a reactor which is not glib-based implies C{--headless}.
+
+With C{--workers N}, the application runs in N worker processes, which
+share their TCP ports (see L{application.Application.listenTCP}). Only
+the first worker owns the hardware. A worker which crashes is
+restarted on its own; when one of them quits, they all quit.
 """
 
 import os
+import signal
 import subprocess
 import sys
 import time
 
-from twisted.internet import reactor
-from twisted.python import usage, log
-from twisted.application import service, app
+from twisted.python import usage, log, filepath
+from twisted.application import service, app, reactors
 
 from sparked import application, __version__
 
@@ -30,6 +46,10 @@ class Options(usage.Options):
 
     optFlags = [["debug", "d", "Debug mode"],
                 ["no-subprocess", "N", "Do not start a subprocess for crash prevention"],
+                ["headless", None, "Run without a display: in the epoll reactor, without the gtk and dbus mainloops"],
+                ["standby", None, "Keep a warm standby subprocess which takes over when the application crashes"],
+                ["profile-startup", None, "Time the phases of the startup and write a report to <temp-path>/startup-profile.json"],
+                ["profile-imports", None, "With --profile-startup, also time the module imports during the startup"],
                 ["no-logrotate", "l", "Do not do logrotation but rely on external program. USR1 can be used to re-open the logfile."],
                 ["system-paths", "s", """Setup the application paths so that the app is run as a
                 system-wide application. The paths are according to the Filesystem Hierarchy Standard:
@@ -44,18 +64,40 @@ class Options(usage.Options):
             ('pidfile', None, None, 'Process-id file. Defaults to <temp-path>/sparkd.pid'),
             ('data-path', None, None, """Path where static application data is stored, like image files. Defaults to the "data" subdirectory of the current directory."""),
             ('db-path', None, None, """Path where instance-specific data is stored, like database files. Defaults to <temp-path>/db/"""),
+            ('reactor', 'r', None, """The reactor to run in (see twistd --help-reactors). Defaults to gtk2, or to epoll with --headless."""),
+            ('workers', 'w', 1, """Run the application in this number of worker processes, which share their TCP ports. The first worker owns the hardware.""", int),
+            ('worker', None, 0, """The number of this worker process; set by the launcher.""", int),
             ]
 
 
     def getSynopsis(self):
         return "sparkd [options] <application> ..."
 
+    def postOptions(self):
+        if self['workers'] < 1:
+            raise usage.UsageError("The number of workers must be at least 1")
+        if self['workers'] > 1 and (self['standby'] or self['no-subprocess']):
+            raise usage.UsageError("--workers cannot be combined with --standby or --no-subprocess")
+        if self['reactor'] is None:
+            if self['headless']:
+                self['reactor'] = 'epoll'
+            else:
+                self['reactor'] = 'gtk2'
+        elif self['reactor'] not in GLIB_REACTORS:
+            self['headless'] = True
+
+
     def opt_version(self):
         print os.path.basename(sys.argv[0]), __version__
         exit(0)
 
 
 
+GLIB_REACTORS = ('gtk2', 'gtk3', 'glib2', 'gi')
+""" The reactors which run the glib mainloop, needed for a display and for dbus signals. """
+
+
+
 class QuitFlag:
     """
     @ivar file: A C{FilePath} pointing to the quit-flag file.
@@ -107,18 +149,203 @@ def run(appName):
     app.startApplication(application, False)
     log.addObserver(log.FileLogObserver(sys.stdout).emit)
 
+    from twisted.internet import reactor
     reactor.run()
 
 
+def twistdArguments(pidfile, args, reactor=None):
+    """
+    The command line to run the sparked application with the given
+    arguments in twistd, in the given reactor. When C{reactor} is
+    C{None}, the reactor is expected to be installed already.
+    """
+    argv = ["twistd", "--pidfile", pidfile]
+    if reactor is not None:
+        argv += ['-r', reactor]
+    return argv + ['-n', 'sparked'] + args
+
+
+
+class StandbyProcess:
+    """
+    A warm standby: a subprocess which runs L{standby}, and which starts
+    the application when it is activated.
+
+    @ivar command: The command which starts the standby process; the
+    pid file and the sparkd arguments are appended to it.
+    """
+
+    command = [sys.executable, "-c", "from sparked import launcher; launcher.standby()"]
+
+    def __init__(self, pidfile, args, env):
+        self.process = subprocess.Popen(self.command + [pidfile] + args,
+                                        env=env, stdin=subprocess.PIPE)
+
+
+    def activate(self):
+        """
+        Let the standby start the application.
+        """
+        try:
+            self.process.stdin.write(STANDBY_GO)
+            self.process.stdin.close()
+        except IOError:
+            # It has died already; wait() returns right away.
+            pass
+
+
+    def wait(self):
+        return self.process.wait()
+
+
+    def stop(self):
+        """
+        Let the standby exit without starting the application.
+        """
+        try:
+            self.process.stdin.close()
+        except IOError:
+            pass
+        return self.process.wait()
+
+
+
+STANDBY_GO = "go\n"
+
+
+def standby():
+    """
+    Main function of a warm standby process. Its arguments are the pid
+    file and the sparkd arguments. It does all the work it can before
+    the application starts, and then waits for a line on standard input:
+    when it reads L{STANDBY_GO} it runs the application in twistd, and
+    on anything else (e.g. end-of-file because the launcher has gone)
+    it exits.
+    """
+    pidfile, args = sys.argv[1], sys.argv[2:]
+    sparkedOpts, appName, appOpts = splitOptions(args)
+    options = Options()
+    options.parseOptions(sparkedOpts)
+    reactors.installReactor(options['reactor'])
+
+    # Import everything which twistd imports for the application
+    from twisted.scripts import twistd
+    from sparked import tap
+    loadModule(appName)
+
+    if sys.stdin.readline() != STANDBY_GO:
+        sys.exit(0)
+    sys.argv = twistdArguments(pidfile, args)
+    twistd.run()
+
+
+class WorkerProcess:
+    """
+    One of the worker processes of an application which runs in
+    several workers.
+
+    @ivar number: The number of the worker. Worker 0 owns the hardware.
+    @ivar started: The time at which the worker was last started.
+    @ivar respawned: Whether the worker has been restarted after a crash.
+    """
+
+    respawned = False
+
+    def __init__(self, number, options, env):
+        self.number = number
+        self.env = env
+        pidfile = application.workerPath(filepath.FilePath(options['pidfile']), number)
+        self.argv = twistdArguments(pidfile.path, ["--worker=%d" % number] + sys.argv[1:], options['reactor'])
+        self.process = None
+
+
+    def start(self):
+        self.started = time.time()
+        self.process = subprocess.Popen(self.argv, env=self.env)
+
+
+    def stop(self):
+        """
+        Let the worker quit, like twistd does on SIGTERM.
+        """
+        if self.process.poll() is None:
+            try:
+                self.process.terminate()
+            except OSError:
+                pass
+
+
+
+def runWorkers(app, options, env, tempPath, interval=0.5):
+    """
+    Run the application in C{options['workers']} worker processes,
+    checking them every C{interval} seconds. A worker which crashes is
+    restarted. When a worker quits normally (and sets the quit flag),
+    when a worker exits within 5 seconds after it was started, or when
+    the launcher gets SIGTERM, all workers are stopped.
+    """
+    quitFlag = QuitFlag(tempPath.child("quitflag"))
+    quitFlag.reset()
+    workers = []
+    for number in range(options['workers']):
+        worker = WorkerProcess(number, options, env)
+        worker.start()
+        workers.append(worker)
+
+    def terminate(sig, frame):
+        quitFlag.set()
+        for worker in workers:
+            worker.stop()
+    previousHandler = signal.signal(signal.SIGTERM, terminate)
+
+    stopping = False
+    try:
+        while workers:
+            time.sleep(interval)
+            for worker in workers[:]:
+                if worker.process.poll() is None:
+                    continue
+                if stopping:
+                    workers.remove(worker)
+                    continue
+                if quitFlag.isSet():
+                    stopping = True
+                elif time.time() - worker.started < 5:
+                    if worker.respawned:
+                        sys.stderr.write("*** %s: worker %d respawning too fast ***\n" % (app, worker.number))
+                    stopping = True
+                else:
+                    worker.respawned = True
+                    worker.start()
+                    continue
+                workers.remove(worker)
+                for other in workers:
+                    other.stop()
+    finally:
+        signal.signal(signal.SIGTERM, previousHandler)
+    quitFlag.reset()
+
+
 def runInSubprocess(app, options, env, tempPath):
+    if options['workers'] > 1:
+        return runWorkers(app, options, env, tempPath)
     quitFlag = QuitFlag(tempPath.child("quitflag"))
     quitFlag.reset()
     respawned = False
+    standby = None
+    if options['standby']:
+        standby = StandbyProcess(options['pidfile'], sys.argv[1:], env)
     while True:
         start = time.time()
 
-        argv = ["twistd", "--pidfile", options['pidfile'], '-r', 'gtk2', '-n', 'sparked'] + sys.argv[1:]
-        subprocess.call(argv, env=env)
+        if standby is not None:
+            process = standby
+            process.activate()
+            standby = StandbyProcess(options['pidfile'], sys.argv[1:], env)
+            process.wait()
+        else:
+            argv = twistdArguments(options['pidfile'], sys.argv[1:], options['reactor'])
+            subprocess.call(argv, env=env)
 
         if time.time() - start < 5:
             if respawned:
@@ -128,6 +355,8 @@ def runInSubprocess(app, options, env, tempPath):
             break
         respawned = True
 
+    if standby is not None:
+        standby.stop()
     quitFlag.reset()
 
 
@@ -172,6 +401,10 @@ def launchApplication(argv):
     if not appName:
         raise usage.UsageError("Missing application name")
 
+    if options['no-subprocess']:
+        # Install the reactor before the application can import it
+        reactors.installReactor(options['reactor'])
+
     appModule, appName = loadModule(appName)
 
     if hasattr(appModule, 'Options'):
@@ -7,7 +7,6 @@ Classes for monitoring the system's state.
 """
 
 from twisted.application import service
-from twisted.internet import reactor
 from twisted.python import log
 
 from sparked.hardware import power, network
@@ -20,7 +19,7 @@ class MonitorContainer (service.MultiService):
     A container for monitoring services.
 
     @ivar monitors: A list of L{Monitor} objects.
-    @ivar events: An L{events.EventDispatcher} which triggers an "updated" event when one of the monitors state changes.
+    @ivar events: An L{events.EventDispatcher} which triggers an "updated" event when one of the monitors state changes. The event is sticky.
     """
 
     monitors = None
@@ -32,11 +31,13 @@ class MonitorContainer (service.MultiService):
     def __init__(self):
         service.MultiService.__init__(self)
         self.events = events.EventDispatcher()
+        self.events.setSticky("updated")
         self.monitors = []
 
 
     def startService(self):
         service.MultiService.startService(self)
+        from twisted.internet import reactor
         reactor.callLater(0, self.update)
 
 
@@ -206,18 +207,23 @@ class NamedZeroconfMonitor(Monitor):
     def added(self):
         from sparked.internet import zeroconf
         zeroconf.zeroconfService.subscribeTo(self.type)
-        zeroconf.zeroconfEvents.addObserver("service-found", self._found)
-        zeroconf.zeroconfEvents.addObserver("service-lost", self._lost)
+        key = (self.name, self.type)
+        zeroconf.zeroconfEvents.addObserver("service-found", self._found, key=key)
+        zeroconf.zeroconfEvents.addObserver("service-lost", self._lost, key=key)
+
+
+    def removed(self):
+        from sparked.internet import zeroconf
+        zeroconf.zeroconfEvents.removeObserver("service-found", self._found)
+        zeroconf.zeroconfEvents.removeObserver("service-lost", self._lost)
 
 
     def _found(self, name, **kw):
-        if kw['type'] == self.type and name == self.name:
-            self.ok = True
-            self.container.update()
+        self.ok = True
+        self.container.update()
 
 
     def _lost(self, name, **kw):
-        if kw['type'] == self.type and name == self.name:
-            self.ok = False
-            self.container.update()
+        self.ok = False
+        self.container.update()
 
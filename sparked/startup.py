@@ -0,0 +1,198 @@
+# Copyright (c) 2011 Arjan Scherpenisse
+# See LICENSE for details.
+# -*- test-case-name: sparked.test.test_startup -*-
+
+"""
+Profiling of the startup of an application.
+
+When sparkd is started with C{--profile-startup}, the phases of the
+startup (loading the application module, creating the service, the
+C{starting} and C{started} hooks, the first HAL enumeration, ...) are
+timed, and a report is written to C{startup-profile.json} in the temp
+path of the application. With C{--profile-imports}, the time taken by
+every module import is recorded as well, until the C{started} phase
+has ended.
+
+The phases are marked with L{begin} and L{end}, which do nothing when
+profiling is not enabled::
+
+  startup.begin("load-fixtures")
+  self.loadFixtures()
+  startup.end("load-fixtures")
+
+The report is written when the C{started} phase ends, and rewritten
+whenever the last running phase has ended, so phases which end late,
+like the HAL enumeration, are included.
+"""
+
+import os
+import sys
+import time
+import threading
+import __builtin__
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from twisted.python import log
+
+
+def processAge():
+    """
+    Return the number of seconds since the start of the current
+    process, or C{None} when that is not known (it is read from
+    C{/proc}).
+    """
+    try:
+        stat = open("/proc/self/stat").read()
+        uptime = float(open("/proc/uptime").read().split()[0])
+        # The command name may contain spaces; it ends with a ')'
+        started = float(stat[stat.rindex(")") + 2:].split()[19])
+        return uptime - started / os.sysconf("SC_CLK_TCK")
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+
+
+
+class StartupProfiler(object):
+    """
+    Records the durations of the startup phases and, optionally, of the
+    module imports.
+
+    @ivar path: The C{FilePath} of the report; when C{None}, no report
+    is written.
+    @ivar phases: List of C{[name, start, duration]} lists; the start is
+    in seconds since the profiler was created, the duration is C{None}
+    while the phase is running.
+    @ivar imports: Mapping of module names to C{[total, self]} import
+    times; the self time excludes the imports done by the module.
+    @ivar lastPhase: The phase which ends the startup: when it ends,
+    the imports are no longer timed.
+    """
+
+    path = None
+    lastPhase = "started"
+
+    def __init__(self, imports=False):
+        self.start = time.time()
+        self.age = processAge()
+        self.phases = []
+        self._running = {}
+        self.imports = {}
+        self._originalImport = None
+        self._importStack = []
+        self._thread = None
+        if imports:
+            self.startImports()
+
+
+    def begin(self, name):
+        phase = [name, time.time() - self.start, None]
+        self.phases.append(phase)
+        self._running.setdefault(name, []).append(phase)
+
+
+    def end(self, name):
+        running = self._running.get(name)
+        if not running:
+            return
+        phase = running.pop()
+        if not running:
+            del self._running[name]
+        phase[2] = time.time() - self.start - phase[1]
+        if name == self.lastPhase:
+            self.stopImports()
+        if not self._running or name == self.lastPhase:
+            self.write()
+
+
+    def startImports(self):
+        """
+        Start timing the imports of modules which have not been
+        imported yet.
+        """
+        if self._originalImport is not None:
+            return
+        self._thread = threading.currentThread()
+        self._originalImport = __builtin__.__import__
+        __builtin__.__import__ = self._import
+
+
+    def stopImports(self):
+        if self._originalImport is None:
+            return
+        __builtin__.__import__ = self._originalImport
+        self._originalImport = None
+
+
+    def _import(self, name, *args, **kwargs):
+        if name in sys.modules or threading.currentThread() is not self._thread:
+            return self._originalImport(name, *args, **kwargs)
+        self._importStack.append(0.0)
+        start = time.time()
+        try:
+            return self._originalImport(name, *args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            children = self._importStack.pop()
+            if self._importStack:
+                self._importStack[-1] += elapsed
+            times = self.imports.setdefault(name, [0.0, 0.0])
+            times[0] += elapsed
+            times[1] += elapsed - children
+
+
+    def report(self):
+        """
+        Return the report as a dict.
+        """
+        imports = sorted(self.imports.items(), key=lambda (name, times): -times[1])
+        return {"started": self.start,
+                "processAge": self.age,
+                "phases": [{"name": name, "start": start, "duration": duration}
+                           for name, start, duration in self.phases],
+                "imports": [{"module": name, "total": total, "self": own}
+                            for name, (total, own) in imports]}
+
+
+    def write(self):
+        if self.path is None:
+            return
+        try:
+            self.path.setContent(json.dumps(self.report(), indent=2))
+        except (IOError, OSError):
+            log.err(None, "Cannot write the startup profile")
+
+
+
+profiler = None
+
+def enable(imports=False):
+    """
+    Enable startup profiling in this process. Returns the
+    L{StartupProfiler}.
+    """
+    global profiler
+    if profiler is None:
+        profiler = StartupProfiler(imports)
+    elif imports:
+        profiler.startImports()
+    return profiler
+
+
+def begin(name):
+    """
+    Mark the beginning of a startup phase.
+    """
+    if profiler is not None:
+        profiler.begin(name)
+
+
+def end(name):
+    """
+    Mark the end of a startup phase.
+    """
+    if profiler is not None:
+        profiler.end(name)
@@ -0,0 +1,69 @@
+# Copyright (c) 2011 Arjan Scherpenisse
+# See LICENSE for details.
+# -*- test-case-name: sparked.test.test_stats -*-
+
+"""
+Helpers for collecting runtime statistics.
+"""
+
+from bisect import bisect_left
+
+
+class Timing(object):
+    """
+    Accumulated durations of something which is measured repeatedly.
+
+    @ivar count: The number of measurements.
+    @ivar total: The sum of all durations, in seconds.
+    @ivar max: The longest duration, in seconds.
+    @ivar last: The most recent duration, in seconds.
+    @ivar histogram: Number of measurements per bucket. Bucket C{i}
+    counts the durations up to C{buckets[i]}; the last bucket counts
+    the durations which are longer than all buckets.
+    """
+
+    buckets = (0.0001, 0.001, 0.01, 0.1, 1.0, 10.0)
+
+    count = 0
+    total = 0.0
+    max = 0.0
+    last = None
+    histogram = None
+
+    def __init__(self, buckets=None):
+        if buckets is not None:
+            self.buckets = tuple(buckets)
+        self.histogram = [0] * (len(self.buckets) + 1)
+
+
+    def add(self, duration):
+        """
+        Add a measured duration (in seconds).
+        """
+        self.count += 1
+        self.total += duration
+        self.last = duration
+        if duration > self.max:
+            self.max = duration
+        self.histogram[bisect_left(self.buckets, duration)] += 1
+
+
+    @property
+    def mean(self):
+        if not self.count:
+            return 0.0
+        return self.total / self.count
+
+
+    def asDict(self):
+        """
+        Return the statistics as a JSON-serializable dict. The
+        histogram is a list of C{[upper bound, count]} pairs; the upper
+        bound of the last bucket is C{None}.
+        """
+        return {'count': self.count,
+                'total': self.total,
+                'max': self.max,
+                'mean': self.mean,
+                'last': self.last,
+                'histogram': [[b, c] for b, c in zip(list(self.buckets) + [None], self.histogram)]}
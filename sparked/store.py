@@ -0,0 +1,345 @@
+# Copyright (c) 2011 Arjan Scherpenisse
+# See LICENSE for details.
+# -*- test-case-name: sparked.test.test_store -*-
+
+"""
+A persistent key/value store.
+
+The store keeps all its values in memory, in a dict, and writes every
+change as a line of JSON to the end of a log file; it never rewrites
+the file for a change. The log is synced to disk in batches, at most
+C{syncInterval} seconds after a change. When the log has grown to many
+times the number of keys, it is compacted: replaced by a log which
+only holds the current values. Syncing and compacting happen in the
+thread pool of the reactor, so the reactor does not wait for the disk
+(only L{Store.close}, on shutdown, syncs in the reactor thread).
+
+Every application has one in its db path, as C{app.store}::
+
+  self.store["visitors"] = self.store.get("visitors", 0) + 1
+
+Keys and values must be JSON-serializable. Tuple keys are restored as
+tuples; in values, tuples come back as lists. Values are kept in
+memory as they are given: after changing a mutable value, set it again
+to store it.
+"""
+
+import os
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from twisted.internet import defer, interfaces, threads
+from twisted.python import filepath, log
+
+
+def _writeSynced(fn, data):
+    """
+    Write a new file and sync it to disk.
+    """
+    fd = os.open(fn, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+    try:
+        while data:
+            data = data[os.write(fd, data):]
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _syncDirectory(fn):
+    """
+    Sync the directory of a file to disk, so that a rename is durable.
+    """
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(fn)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    os.close(fd)
+
+
+def _syncAndClose(fd, fn=None):
+    """
+    Sync and close a (duplicated) file descriptor; and the directory of
+    the given file, if any.
+    """
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    if fn is not None:
+        _syncDirectory(fn)
+
+
+def atomicWrite(fn, data):
+    """
+    Replace the contents of a file atomically and durably: the data is
+    written to a temporary file which is synced to disk and then
+    renamed onto the file, after which the directory is synced too.
+    Either the old or the new contents survive a crash or a power
+    failure, never a truncated file.
+    """
+    tmp = fn + ".new"
+    _writeSynced(tmp, data)
+    os.rename(tmp, fn)
+    _syncDirectory(fn)
+
+
+def _key(key):
+    """
+    Restore a key read from the log: JSON turns tuples into lists.
+    """
+    if isinstance(key, list):
+        return tuple([_key(k) for k in key])
+    return key
+
+
+
+class Store(object):
+    """
+    A dict-like persistent key/value store, backed by an append-only
+    log.
+
+    @ivar syncInterval: The maximum number of seconds between a change
+    and the sync of the log to disk.
+    @ivar compactFactor: The log is compacted when it has more than
+    C{compactFactor} times as many records as there are keys (and at
+    least C{compactMinimum} records).
+    """
+
+    syncInterval = 1.0
+    compactFactor = 4
+    compactMinimum = 1000
+
+    def __init__(self, fp, reactor=None):
+        if not isinstance(fp, filepath.FilePath):
+            fp = filepath.FilePath(fp)
+        self.filePath = fp
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self._index = {}
+        self._records = 0
+        self._syncCall = None
+        self._waiting = []
+        self._syncing = None
+        self._compacting = None
+        self._renamed = False
+        self._load()
+        self._fd = os.open(self.filePath.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+
+
+    def _load(self):
+        if not self.filePath.exists():
+            return
+        lines = self.filePath.getContent().split("\n")
+        # The part after the last newline is empty or incomplete
+        for line in lines[:-1]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record[0] == "s":
+                self._index[_key(record[1])] = record[2]
+            elif record[0] == "d":
+                self._index.pop(_key(record[1]), None)
+            self._records += 1
+        if lines[-1]:
+            # Cut off the incomplete record, so that new records start
+            # on a line of their own.
+            self._rewrite()
+
+
+    def __getitem__(self, key):
+        return self._index[key]
+
+
+    def get(self, key, default=None):
+        return self._index.get(key, default)
+
+
+    def __contains__(self, key):
+        return key in self._index
+
+
+    def __len__(self):
+        return len(self._index)
+
+
+    def __iter__(self):
+        return iter(self._index)
+
+
+    def keys(self):
+        return self._index.keys()
+
+
+    def items(self):
+        return self._index.items()
+
+
+    def __setitem__(self, key, value):
+        line = json.dumps(["s", key, value])
+        self._index[key] = value
+        self._append(line)
+
+
+    def __delitem__(self, key):
+        del self._index[key]
+        self._append(json.dumps(["d", key]))
+
+
+    def _append(self, line):
+        os.write(self._fd, line + "\n")
+        self._records += 1
+        if self._compacting is not None:
+            self._compacting.append(line + "\n")
+        if self._syncCall is None:
+            self._syncCall = self.reactor.callLater(self.syncInterval, self._backgroundSync)
+
+
+    def whenSynced(self):
+        """
+        Return a Deferred which fires when all changes up to now are
+        synced to disk.
+        """
+        d = defer.Deferred()
+        if self._syncCall is not None:
+            self._waiting.append(d)
+        elif self._syncing is not None:
+            def synced(result):
+                d.callback(None)
+                return result
+            self._syncing.addBoth(synced)
+        else:
+            d.callback(None)
+        return d
+
+
+    def _shouldCompact(self):
+        return self._records > max(self.compactMinimum, self.compactFactor * len(self._index))
+
+
+    def _inThread(self, f, *args):
+        if not interfaces.IReactorThreads.providedBy(self.reactor):
+            return defer.maybeDeferred(f, *args)
+        return threads.deferToThreadPool(self.reactor, self.reactor.getThreadPool(), f, *args)
+
+
+    def _backgroundSync(self):
+        """
+        Sync the changes to disk in a thread, or compact the log there
+        when it has grown too large.
+        """
+        self._syncCall = None
+        waiting, self._waiting = self._waiting, []
+        if self._compacting is None and self._shouldCompact():
+            d = self._compactInThread()
+        else:
+            fn = None
+            if self._renamed:
+                fn, self._renamed = self.filePath.path, False
+            d = self._inThread(_syncAndClose, os.dup(self._fd), fn)
+        d.addErrback(log.err, "Cannot sync %s" % self.filePath.path)
+        self._syncing = d
+        def done(_):
+            if self._syncing is d:
+                self._syncing = None
+            for w in waiting:
+                w.callback(None)
+        d.addCallback(done)
+
+
+    def _compactInThread(self):
+        """
+        Write the compacted log in a thread. The changes made meanwhile
+        are appended to it before it replaces the log, in the reactor
+        thread.
+        """
+        tmp = self.filePath.path + ".new"
+        lines = self._lines()
+        self._compacting = []
+        d = self._inThread(_writeSynced, tmp, "".join(lines))
+        def written(_):
+            pending, self._compacting = self._compacting, None
+            if self._fd is None:
+                # Closed meanwhile; the log has all changes.
+                os.remove(tmp)
+                return
+            fd = os.open(tmp, os.O_WRONLY | os.O_APPEND)
+            try:
+                os.write(fd, "".join(pending))
+            finally:
+                os.close(fd)
+            os.rename(tmp, self.filePath.path)
+            os.close(self._fd)
+            self._fd = os.open(self.filePath.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+            self._records = len(lines) + len(pending)
+            # The rename and the pending changes still need to be synced
+            self._renamed = True
+            if self._syncCall is None:
+                self._syncCall = self.reactor.callLater(self.syncInterval, self._backgroundSync)
+        def failed(f):
+            self._compacting = None
+            return f
+        d.addCallbacks(written, failed)
+        return d
+
+
+    def sync(self):
+        """
+        Sync the log to disk now, in the calling thread, and compact it
+        when it has grown too large.
+        """
+        if self._syncCall is not None:
+            if self._syncCall.active():
+                self._syncCall.cancel()
+            self._syncCall = None
+        if self._compacting is None and self._shouldCompact():
+            self.compact()
+        else:
+            os.fsync(self._fd)
+            if self._renamed:
+                self._renamed = False
+                _syncDirectory(self.filePath.path)
+        waiting, self._waiting = self._waiting, []
+        for d in waiting:
+            d.callback(None)
+
+
+    def compact(self):
+        """
+        Replace the log by one which only holds the current values.
+        Does nothing while the log is being compacted in a thread.
+        """
+        if self._compacting is not None:
+            return
+        os.close(self._fd)
+        self._rewrite()
+        self._fd = os.open(self.filePath.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+
+
+    def _lines(self):
+        return [json.dumps(["s", k, v]) + "\n" for k, v in self._index.iteritems()]
+
+
+    def _rewrite(self):
+        lines = self._lines()
+        atomicWrite(self.filePath.path, "".join(lines))
+        self._records = len(lines)
+
+
+    def close(self):
+        """
+        Sync and close the store.
+        """
+        if self._fd is None:
+            return
+        self.sync()
+        os.close(self._fd)
+        self._fd = None
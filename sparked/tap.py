@@ -5,6 +5,7 @@
 Twisted Application Persistence package for the startup of the twisted sparked plugin.
 """
 
+import sys
 import signal
 import tempfile
 import warnings
@@ -17,7 +18,7 @@ from twisted.python import log
 from twisted.python.filepath import FilePath
 from twisted.python.logfile import LogFile
 
-from sparked import launcher, application
+from sparked import launcher, application, startup, hardware
 
 
 class Options(usage.Options):
@@ -26,10 +27,15 @@ class Options(usage.Options):
         self.opts = launcher.Options()
         self.opts.parseOptions(sparkedOpts)
 
+        if self.opts['profile-startup']:
+            startup.enable(imports=self.opts['profile-imports'])
+
         if not self.appName:
             self.opts.opt_help()
 
+        startup.begin("load-module")
         self.module, self.appName = launcher.loadModule(self.appName)
+        startup.end("load-module")
 
         if hasattr(self.module, 'Options'):
             self.appOpts = self.module.Options()
@@ -62,25 +68,37 @@ class RotatableFileLogObserver(object):
 
 
 def makeService(config):
+    startup.begin("make-service")
 
     # install simple, blocking DNS resolver.
     from twisted.internet import reactor
     from twisted.internet.base import BlockingResolver
     reactor.installResolver(BlockingResolver())
 
-    try:
-        # Create dbus mainloop
-        import dbus.mainloop.glib
-        dbus.mainloop.glib.DBusGMainLoop(set_as_default=True)
-    except ImportError:
-        warnings.warn('Failed to import the dbus module, some functionality might not work.')
+    if config.opts['worker']:
+        hardware.owner = False
+
+    if config.opts['headless']:
+        # No glib mainloop to deliver dbus signals in
+        hardware.dbusMainLoop = False
+    else:
+        # Create the dbus mainloop before the application connects to
+        # a bus, so its signal receivers work
+        startup.begin("dbus-mainloop")
+        try:
+            hardware.importDBus()
+        except ImportError:
+            warnings.warn('Failed to import the dbus module, some functionality might not work.')
+        startup.end("dbus-mainloop")
 
     # Check if it is the right thing
     if not hasattr(config.module, 'Application'):
         raise usage.UsageError("Invalid application module: " + config.appName)
 
     # Instantiate the main application
+    startup.begin("application")
     s = config.module.Application(config.appName, config.opts, config.appOpts)
+    startup.end("application")
 
     # Set quitflag
     s.quitFlag = launcher.QuitFlag(s.path("temp").child("quitflag"))
@@ -107,4 +125,8 @@ def makeService(config):
         observer = log.FileLogObserver(logFile).emit
     log.addObserver(observer)
 
+    if startup.profiler is not None:
+        startup.profiler.path = s.path("temp").child("startup-profile.json")
+    startup.end("make-service")
+
     return s
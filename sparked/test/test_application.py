@@ -9,12 +9,25 @@ Maintainer: Arjan Scherpenisse
 import tempfile
 import os
 
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
 from twisted.trial import unittest
-from twisted.internet import task
+from twisted.internet import task, defer, reactor
+from twisted.python import filepath, usage
 
+from sparked import events, application
 from sparked.events import EventDispatcher
 from sparked.monitors import MonitorContainer
-from sparked.application import getPath, Options, Application, StateMachine
+from sparked.application import getPath, Options, Application, StateMachine, StateMachinePool, StateJournal
+
+
+class FakeQuitFlag(object):
+    def set(self):
+        pass
+
 
 
 class TestGetPath(unittest.TestCase):
@@ -147,6 +160,54 @@ class TestApplicationOptions(unittest.TestCase):
 
 
 
+    def testSaveLoadTypePerKey(self):
+        class TestOptsTyped(Options):
+            optParameters = [["name", "n", "x", "The name", str],
+                             ["count", "c", 1, "The count", int],
+                             ["ratio", "r", 0.5, "The ratio", float],
+                             ["port", "p", None, "The port", usage.portCoerce]]
+        fn = tempfile.mkstemp()[1]
+        open(fn, "w").write(json.dumps({"name": "foo", "count": 3, "ratio": 2, "port": "8080"}))
+        opts = TestOptsTyped.load(fn)
+        self.assertEquals(opts["name"], "foo")
+        self.assertEquals(opts["count"], 3)
+        self.assertEquals(opts["ratio"], 2.0)
+        self.assertEquals(type(opts["ratio"]), float)
+        self.assertEquals(opts["port"], 8080)
+
+        for values in [{"count": "3"}, {"count": True}, {"count": 1.5},
+                       {"name": 1}, {"ratio": "x"}, {"port": "foo"}, {"count": None}]:
+            open(fn, "w").write(json.dumps(values))
+            self.assertRaises(ValueError, TestOptsTyped.load, fn)
+
+        open(fn, "w").write(json.dumps({"port": None}))
+        self.assertEquals(TestOptsTyped.load(fn)["port"], None)
+
+
+    def testSchema(self):
+        class TestOptsFlags(Options):
+            optFlags = [["fast", "f", "Run fast"]]
+            def opt_level(self, level):
+                self['level'] = level * 2
+            def opt_go(self):
+                self['gone'] = True
+        class TestOptsSub(TestOptsFlags):
+            optParameters = [["count", "c", 1, "The count", int]]
+
+        schema = TestOptsFlags.schema()
+        self.assertIdentical(schema, TestOptsFlags.schema())
+        self.assertNotIdentical(schema, TestOptsSub.schema())
+        self.assertEquals(schema.checkers, {})
+        self.assertEquals(sorted(TestOptsSub.schema().checkers.keys()), ["count"])
+        self.assertTrue(schema.handlers["level"][1])
+        self.assertFalse(schema.handlers["go"][1])
+
+        fn = tempfile.mkstemp()[1]
+        open(fn, "w").write(json.dumps({"level": 2, "go": True}))
+        opts = TestOptsSub.load(fn)
+        self.assertEquals(opts["level"], 4)
+        self.assertTrue(opts["gone"])
+
 class TestApplication(unittest.TestCase):
     """
     Test the L{sparked.application.Application} class.
@@ -167,6 +228,223 @@ class TestApplication(unittest.TestCase):
         self.assertIsInstance(app.monitors, MonitorContainer)
 
 
+    def testHeadless(self):
+        self.assertFalse(Application("foo", {}, {}).headless)
+        self.assertTrue(Application("foo", {'headless': True}, {}).headless)
+
+
+    def testWorker(self):
+        app = Application("foo", {}, {})
+        self.assertEquals((0, True), (app.worker, app.ownsHardware))
+        app = Application("foo", {'worker': 2, 'workers': 3}, {})
+        self.assertEquals((2, False), (app.worker, app.ownsHardware))
+
+
+    def testImportIsLight(self):
+        """
+        Importing the application or the zeroconf service does not
+        import the toolkit libraries, nor install a reactor.
+        """
+        import subprocess, sys
+        code = ("import sys, sparked.application, sparked.internet.zeroconf; "
+                "print [m for m in ('dbus', 'avahi', 'gtk', 'clutter', 'gst', 'twisted.internet.reactor') "
+                "if m in sys.modules]")
+        path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(application.__file__))))
+        output = subprocess.Popen([sys.executable, "-c", code], cwd=path,
+                                  stdout=subprocess.PIPE).communicate()[0]
+        self.assertEquals("[]", output.strip())
+
+
+    def testOptionChanged(self):
+        class Opts(Options):
+            optParameters = [["api", None, "foo", "The API"],
+                             ["count", "c", 1, "The count", int]]
+        tempPath = os.path.abspath(self.mktemp())
+        os.makedirs(os.path.join(tempPath, "db"))
+        clock = task.Clock()
+        opts = Opts()
+        opts.parseOptions([])
+        app = Application("foo", {'temp-path': tempPath}, opts, reactor=clock)
+        app.watchOptionsFile = False
+        changed = []
+        app.events.addObserver("option-changed", lambda *a: changed.append(a))
+        counts = []
+        app.events.addObserver("option-changed", lambda k, o, n: counts.append(n), key="count")
+        loaded = []
+        app.events.addObserver("options-loaded", lambda o: loaded.append(o))
+
+        fp = app.path("db").child("options.json")
+        fp.setContent(json.dumps({"api": "foo", "count": 1}))
+        app.loadOptions(firstTime=True)
+        self.assertEquals(changed, [])
+        self.assertEquals(len(loaded), 1)
+
+        fp.setContent(json.dumps({"api": "bar", "count": 2}))
+        app.loadOptions()
+        self.assertEquals(changed, [("api", "foo", "bar"), ("count", 1, 2)])
+        self.assertEquals(counts, [2])
+        self.assertEquals(app.appOpts["api"], "bar")
+
+        fp.setContent(json.dumps({"api": "bar", "count": 2}))
+        app.loadOptions()
+        self.assertEquals(len(changed), 2)
+        self.assertEquals(len(loaded), 3)
+
+
+    def testOptionsDebounce(self):
+        tempPath = os.path.abspath(self.mktemp())
+        os.makedirs(os.path.join(tempPath, "db"))
+        clock = task.Clock()
+        app = Application("foo", {'temp-path': tempPath}, {}, reactor=clock)
+        loads = []
+        app.loadOptions = lambda: loads.append(clock.seconds())
+        fp = app.path("db").child("options.json")
+        for i in range(5):
+            app._optionsNotified(None, fp, 0)
+            clock.advance(0.2)
+        app._optionsNotified(None, app.path("db").child("other.json"), 0)
+        clock.pump([0.1] * 10)
+        self.assertEquals(len(loads), 1)
+        self.assertAlmostEqual(loads[0], 1.3)
+
+
+    def testSaveOptions(self):
+        tempPath = os.path.abspath(self.mktemp())
+        os.makedirs(os.path.join(tempPath, "db"))
+        clock = task.Clock()
+        app = Application("foo", {'temp-path': tempPath}, {"a": 1}, reactor=clock)
+        writes = []
+        app._inThread = lambda f, *a: defer.maybeDeferred(lambda: writes.append(a) or f(*a))
+        saved = []
+        app.events.addObserver("options-saved", lambda o: saved.append(dict(o)))
+
+        fired = []
+        for i in range(5):
+            app.appOpts["a"] = i
+            app.saveOptions().addCallback(fired.append)
+            clock.advance(0.05)
+        self.assertEquals(writes, [])
+        clock.advance(0.5)
+        self.assertEquals(len(writes), 1)
+        self.assertEquals(len(fired), 5)
+        self.assertIdentical(fired[0], app.appOpts)
+        self.assertEquals(saved, [{"a": 4}])
+        fp = app.path("db").child("options.json")
+        self.assertEquals(json.loads(fp.getContent()), {"a": 4})
+        self.assertFalse(fp.siblingExtension(".new").exists())
+
+        # our own write does not trigger a reload
+        loads = []
+        app.loadOptions = lambda: loads.append(True)
+        app._optionsChanged()
+        self.assertEquals(loads, [])
+
+
+    def testSaveOptionsWhileWriting(self):
+        tempPath = os.path.abspath(self.mktemp())
+        os.makedirs(os.path.join(tempPath, "db"))
+        clock = task.Clock()
+        app = Application("foo", {'temp-path': tempPath}, {"a": 1}, reactor=clock)
+        writing = []
+        app._inThread = lambda f, *a: writing.append(defer.Deferred()) or writing[-1]
+        first = app.saveOptions()
+        clock.advance(0.5)
+        self.assertEquals(len(writing), 1)
+        second = app.saveOptions()
+        clock.advance(1)
+        self.assertEquals(len(writing), 1)
+        writing[0].callback(None)
+        self.assertTrue(first.called)
+        self.assertFalse(second.called)
+        clock.advance(0.5)
+        self.assertEquals(len(writing), 2)
+        writing[1].callback(None)
+        self.assertTrue(second.called)
+
+
+    def testFlushOptions(self):
+        tempPath = os.path.abspath(self.mktemp())
+        os.makedirs(os.path.join(tempPath, "db"))
+        app = Application("foo", {'temp-path': tempPath}, Options(), reactor=task.Clock())
+        app.quitFlag = FakeQuitFlag()
+        app.appOpts["a"] = 2
+        d = app.saveOptions()
+        app.stopService()
+        self.assertTrue(d.called)
+        self.assertEquals(json.loads(app.path("db").child("options.json").getContent())["a"], 2)
+
+
+    def testFlushOptionsWhileWriting(self):
+        """
+        A save which is requested while the options are being written
+        is written when the application stops.
+        """
+        tempPath = os.path.abspath(self.mktemp())
+        os.makedirs(os.path.join(tempPath, "db"))
+        clock = task.Clock()
+        app = Application("foo", {'temp-path': tempPath}, {"a": 1}, reactor=clock)
+        app.quitFlag = FakeQuitFlag()
+        writing = []
+        app._inThread = lambda f, *a: writing.append(defer.Deferred()) or writing[-1]
+        first = app.saveOptions()
+        clock.advance(0.5)
+        app.appOpts["a"] = 2
+        second = app.saveOptions()
+        stopped = app.stopService()
+        self.assertFalse(stopped.called)
+        writing[0].callback(None)
+        self.assertTrue(first.called)
+        self.assertTrue(second.called)
+        self.assertTrue(stopped.called)
+        self.assertEquals(clock.getDelayedCalls(), [])
+        self.assertEquals(json.loads(app.path("db").child("options.json").getContent()), {"a": 2})
+
+
+    def testSaveOptionsThread(self):
+        """
+        The options are written in a thread of the reactor.
+        """
+        tempPath = os.path.abspath(self.mktemp())
+        os.makedirs(os.path.join(tempPath, "db"))
+        app = Application("foo", {'temp-path': tempPath}, {"a": 1}, reactor=task.Clock())
+        app.reactor = reactor
+        app.optionsSaveDelay = 0
+        def check(opts):
+            self.assertEquals(json.loads(app.path("db").child("options.json").getContent()), {"a": 1})
+        return app.saveOptions().addCallback(check)
+
+
+    def testStore(self):
+        tempPath = os.path.abspath(self.mktemp())
+        os.makedirs(os.path.join(tempPath, "db"))
+        app = Application("foo", {'temp-path': tempPath}, {}, reactor=task.Clock())
+        app.quitFlag = FakeQuitFlag()
+        app.store["visitors"] = 1
+        self.assertIdentical(app.store, app.store)
+        app.stopService()
+        self.assertTrue(app.path("db").child("store.log").exists())
+
+
+    def testWatchOptions(self):
+        """
+        options.json is reloaded after it has been written.
+        """
+        if application.inotify is None:
+            raise unittest.SkipTest("inotify is not available")
+        tempPath = os.path.abspath(self.mktemp())
+        os.makedirs(os.path.join(tempPath, "db"))
+        app = Application("foo", {'temp-path': tempPath}, {}, reactor=task.Clock())
+        app.reactor = reactor
+        app.optionsDebounce = 0
+        d = defer.Deferred()
+        app.loadOptions = lambda: d.callback(None)
+        if not app.startWatchingOptions():
+            raise unittest.SkipTest("inotify is not available")
+        self.addCleanup(app.stopWatchingOptions)
+        app.path("db").child("options.json").setContent("{}")
+        return d
+
+
     def testConstructorStartupOrder(self):
         seq = []
         class TestApp(Application):
@@ -224,6 +502,62 @@ class TestApplication(unittest.TestCase):
         self.assertTrue(self.stopped, "Reactor need to be stopped on startup error")
 
 
+    def testDumpEventStatistics(self):
+        tempPath = os.path.abspath(self.mktemp())
+        os.mkdir(tempPath)
+        app = Application("foo", {'temp-path': tempPath}, {}, reactor=task.Clock())
+        self.assertEquals(None, app.dumpEventStatistics())
+
+        stats = events.enableStatistics()
+        self.addCleanup(events.disableStatistics)
+        app.events.dispatch("hello")
+        fp = app.dumpEventStatistics()
+        self.assertEquals(os.path.join(tempPath, "event-statistics.json"), fp.path)
+        self.assertEquals(1, json.loads(fp.getContent())['events']['hello']['count'])
+
+
+    def testStatisticsDump(self):
+        tempPath = os.path.abspath(self.mktemp())
+        os.mkdir(tempPath)
+        clock = task.Clock()
+        app = Application("foo", {'temp-path': tempPath}, {}, reactor=clock)
+        self.assertEquals(None, app.dumpStateStatistics())
+
+        call = app.startStatisticsDump(10)
+        self.addCleanup(call.stop)
+        app.state.set("start")
+        clock.advance(3)
+        app.state.set("attract")
+        fp = app.path("temp").child("state-statistics.json")
+        self.assertFalse(fp.exists())
+        clock.advance(7)
+        stats = json.loads(fp.getContent())
+        self.assertEquals(stats['current'], {'state': 'attract', 'duration': 7})
+        self.assertEquals(stats['residency']['start']['total'], 3)
+        self.assertFalse(app.path("temp").child("event-statistics.json").exists())
+
+
+    def testCheckpointState(self):
+        tempPath = os.path.abspath(self.mktemp())
+        os.makedirs(os.path.join(tempPath, "db"))
+        class App(Application):
+            checkpointState = True
+        clock = task.Clock()
+        app = App("foo", {'temp-path': tempPath}, {}, reactor=clock)
+        app.quitFlag = FakeQuitFlag()
+        clock.advance(0)
+        self.assertEquals(app.state.get, "start")
+        app.state.set("playing")
+        app.state.journal.close()
+
+        app = App("foo", {'temp-path': tempPath}, {}, reactor=clock)
+        app.quitFlag = FakeQuitFlag()
+        clock.advance(0)
+        self.assertEquals(app.state.get, "playing")
+        app.stopService()
+        self.assertFalse(app.path("db").child("state.journal").exists())
+
+
 
 class TestStateMachine(unittest.TestCase):
 
@@ -372,6 +706,133 @@ class TestStateMachine(unittest.TestCase):
         self.assertEquals(self.args, ["meh", "foo", "bar", 1234, "meh" ])
 
 
+    def testListenerAddedLater(self):
+        self.called = []
+        class Listener:
+            post=""
+            def enter_a(s): self.called.append("enter_a"+s.post)
+            def exit_a(s): self.called.append("exit_a"+s.post)
+        m = StateMachine(Listener())
+        m.set("a")
+        l2 = Listener()
+        l2.post = "2"
+        m.addListener(l2)
+        m.set("a")
+        self.assertEquals(self.called, ["enter_a", "exit_a2", "exit_a", "enter_a", "enter_a2"])
+
+
+    def testHandlerAttributeError(self):
+        """
+        Missing handlers are skipped, but an AttributeError raised
+        inside a handler is not swallowed.
+        """
+        class Listener:
+            def enter_b(s): return s.missing
+        m = StateMachine(Listener())
+        m.set("a")
+        self.assertRaises(AttributeError, m.set, "b")
+
+
+    def testStatistics(self):
+        clock = task.Clock()
+        class Listener:
+            def enter_a(s): pass
+            def exit_a(s): pass
+        m = StateMachine(Listener(), reactor=clock)
+        self.assertEquals(m.statistics, None)
+        stats = m.enableStatistics()
+        self.assertIdentical(stats, m.enableStatistics())
+
+        m.set("a")
+        clock.advance(2)
+        m.set("b")
+        clock.advance(0.5)
+        m.set("a")
+        clock.advance(10)
+        m.set("b")
+
+        self.assertEquals(stats.residency["a"].count, 2)
+        self.assertEquals(stats.residency["a"].total, 12)
+        self.assertEquals(stats.residency["a"].last, 10)
+        self.assertEquals(stats.residency["b"].total, 0.5)
+        self.assertEquals(stats.residency["a"].histogram, [0, 0, 2, 0, 0, 0, 0, 0])
+        self.assertEquals(stats.transitions, {(None, "a"): 1, ("a", "b"): 2, ("b", "a"): 1})
+        self.assertEquals(sorted(stats.handlers.keys()),
+                          ["sparked.test.test_application.Listener.enter_a",
+                           "sparked.test.test_application.Listener.exit_a"])
+        self.assertEquals(stats.handlers["sparked.test.test_application.Listener.enter_a"].count, 2)
+        self.assertEquals([(t, f, to) for t, f, to, d in stats.trace],
+                          [(0, None, "a"), (2, "a", "b"), (2.5, "b", "a"), (12.5, "a", "b")])
+
+        d = stats.asDict(13)
+        self.assertEquals(d['current'], {'state': 'b', 'duration': 0.5})
+        self.assertEquals(d['transitions'][0], {'from': None, 'to': 'a', 'count': 1})
+        self.assertEquals(d['residency']['a']['count'], 2)
+
+        m.disableStatistics()
+        m.set("a")
+        self.assertEquals(stats.transitions[("b", "a")], 1)
+
+
+    def testCheckpoint(self):
+        clock = task.Clock()
+        fp = filepath.FilePath(self.mktemp())
+        m = StateMachine(None, reactor=clock)
+        m.enableCheckpoints(fp)
+        m.set("a", 1, foo="bar")
+        self.assertEquals(m.journal.read(), {'state': 'a', 'args': [1], 'kw': {'foo': 'bar'}})
+        clock.advance(10)
+        m.setAfter("b", 5, 2)
+        self.assertEquals(m.journal.read()['after'], {'state': 'b', 'at': 15, 'args': [2], 'kw': {}})
+        clock.advance(2)
+        m.bumpAfter()
+        self.assertEquals(m.journal.read()['after']['at'], 17)
+        m.journal.close()
+
+        # crash and restart, 3 seconds later
+        self.called = []
+        class Listener:
+            def enter_a(s, *a, **kw): self.called.append(("a", a, kw))
+            def enter_b(s, *a): self.called.append(("b", a))
+        clock.advance(3)
+        m = StateMachine(Listener(), reactor=clock)
+        m.enableCheckpoints(fp)
+        self.assertTrue(m.resume())
+        self.assertEquals(m.get, "a")
+        self.assertEquals(self.called, [("a", (1,), {'foo': 'bar'})])
+        clock.advance(1.9)
+        self.assertEquals(m.get, "a")
+        clock.advance(0.1)
+        self.assertEquals(m.get, "b")
+        self.assertEquals(self.called[-1], ("b", (2,)))
+
+        m.journal.clear()
+        self.assertFalse(fp.exists())
+        self.assertFalse(m.resume())
+
+
+    def testCheckpointUnserializable(self):
+        m = StateMachine(None, reactor=task.Clock())
+        m.enableCheckpoints(self.mktemp())
+        m.set("a", object())
+        self.assertEquals(m.journal.read(), {'state': 'a', 'args': [], 'kw': {}})
+
+
+    def testJournal(self):
+        fp = filepath.FilePath(self.mktemp())
+        j = StateJournal(fp)
+        self.assertEquals(j.read(), None)
+        j.maxRecords = 3
+        for i in range(5):
+            j.write({'state': i})
+        self.assertEquals(j.read(), {'state': 4})
+        self.assertEquals(len(fp.getContent().splitlines()), 2)
+        j.close()
+
+        fp.setContent(fp.getContent() + '{"state": 5')
+        self.assertEquals(j.read(), {'state': 4})
+
+
     def testEventsStateChange(self):
         m = StateMachine(None)
         received = []
@@ -420,3 +881,125 @@ class TestStateMachine(unittest.TestCase):
         self.assertEquals([1.1, 2], received)
 
 
+
+
+
+class TestStateMachinePool(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.called = []
+        test = self
+        class Listener:
+            def enter_a(s, m, *a): test.called.append(("enter_a", m.key) + a)
+            def exit_a(s, m): test.called.append(("exit_a", m.key))
+            def enter_b(s, m): test.called.append(("enter_b", m.key))
+        self.pool = StateMachinePool(Listener(), reactor=self.clock)
+
+
+    def testCreate(self):
+        m1 = self.pool.create("tag1")
+        m2 = self.pool.create("tag2")
+        anonymous = self.pool.create()
+        self.assertEquals(len(self.pool), 2)
+        self.assertIdentical(self.pool.machines["tag2"], m2)
+        self.assertRaises(AttributeError, setattr, m1, "foo", 1)
+
+        m1.set("a", 42)
+        m2.set("b")
+        anonymous.set("a")
+        m1.set("b")
+        self.assertEquals(m1.get, "b")
+        self.assertEquals(anonymous.get, "a")
+        self.assertEquals(self.called, [("enter_a", "tag1", 42), ("enter_b", "tag2"),
+                                        ("enter_a", None), ("exit_a", "tag1"), ("enter_b", "tag1")])
+
+        self.pool.remove(m1)
+        self.assertEquals(self.pool.machines.keys(), ["tag2"])
+
+
+    def testEvents(self):
+        m1 = self.pool.create("tag1")
+        m2 = self.pool.create("tag2")
+        received = []
+        self.pool.events.addObserver("state-change", lambda *a: received.append(a), key=m2)
+        m1.set("a")
+        m2.set("a")
+        m2.setAfter("b", 2)
+        self.clock.advance(2)
+        self.assertEquals(received, [(m2, None, "a"), (m2, "a", "b")])
+
+
+    def testSetAfter(self):
+        machines = [self.pool.create(i) for i in range(100)]
+        for i, m in enumerate(machines):
+            m.setAfter("a", 1 + (i % 10))
+        self.assertEquals(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(1)
+        self.assertEquals(len(self.called), 10)
+        self.assertEquals(machines[0].get, "a")
+        self.assertEquals(machines[1].get, None)
+        self.clock.advance(9)
+        self.assertEquals(len(self.called), 100)
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+
+    def testSetAfterCancelled(self):
+        m1 = self.pool.create(1)
+        m2 = self.pool.create(2)
+        m1.setAfter("a", 1)
+        m2.setAfter("a", 2)
+        m1.set("b")
+        self.assertEquals(m1.nextStateAfter, None)
+        self.clock.advance(1)
+        self.assertEquals(m1.get, "b")
+        self.clock.advance(1)
+        self.assertEquals(m2.get, "a")
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+        m1.setAfter("a", 5)
+        self.pool.remove(m1)
+        self.clock.advance(5)
+        self.assertEquals(m1.get, "b")
+
+
+    def testBumpAfter(self):
+        m = self.pool.create(1)
+        m.setAfter("a", 2)
+        self.clock.advance(1.5)
+        m.bumpAfter()
+        self.clock.advance(1.5)
+        self.assertEquals(m.get, None)
+        m.bumpAfter(1)
+        self.assertEquals(m.nextStateAfter, 1)
+        self.clock.advance(1)
+        self.assertEquals(m.get, "a")
+
+
+    def testChainedSetAfter(self):
+        """
+        A timed transition which is scheduled by a timed transition
+        is not performed in the same call.
+        """
+        called = []
+        class Listener:
+            def enter_a(s, m):
+                m.setAfter("b", 0)
+                called.append(len(self.clock.getDelayedCalls()))
+        pool = StateMachinePool(Listener(), reactor=self.clock)
+        m = pool.create()
+        m.setAfter("a", 1)
+        self.clock.advance(1)
+        self.assertEquals(called, [1])
+        self.assertEquals(m.get, "b")
+
+
+    def testCompaction(self):
+        machines = [self.pool.create(i) for i in range(200)]
+        for m in machines:
+            m.setAfter("a", 10)
+        for m in machines[:150]:
+            m.cancelAfter()
+        self.assertTrue(len(self.pool._timers) < 200)
+        self.clock.advance(10)
+        self.assertEquals(len(self.called), 50)
@@ -0,0 +1,170 @@
+# Copyright (c) 2011 Arjan Scherpenisse
+# See LICENSE for details.
+
+"""
+Tests for sparked.eventbus.*
+
+Maintainer: Arjan Scherpenisse
+"""
+
+import os
+
+from twisted.trial import unittest
+from twisted.internet import defer, reactor
+from twisted.test import proto_helpers
+
+from sparked import events, eventbus
+
+
+class Connection(object):
+    """
+    Connects two event bus protocols in memory.
+    """
+
+    def __init__(self, serverFactory, clientFactory):
+        self.server = serverFactory.buildProtocol(None)
+        self.client = clientFactory.buildProtocol(None)
+        self.server.makeConnection(proto_helpers.StringTransport())
+        self.client.makeConnection(proto_helpers.StringTransport())
+        self.pump()
+
+
+    def pump(self):
+        while self.server.transport.value() or self.client.transport.value():
+            for a, b in [(self.server, self.client), (self.client, self.server)]:
+                data = a.transport.value()
+                a.transport.clear()
+                b.dataReceived(data)
+
+
+    def disconnect(self):
+        self.server.connectionLost(None)
+        self.client.connectionLost(None)
+
+
+
+class TestEventBus(unittest.TestCase):
+
+    def setUp(self):
+        self.hub = events.EventDispatcher()
+        self.hubFactory = eventbus.EventBusFactory(self.hub, ["done"])
+        self.received = []
+
+
+    def connect(self, topics):
+        d = events.EventDispatcher()
+        factory = eventbus.EventBusClientFactory(d, topics)
+        return d, factory, Connection(self.hubFactory, factory)
+
+
+    def record(self, d, event, name):
+        d.addObserver(event, lambda *a, **kw: self.received.append((name, event, a, kw)))
+
+
+    def testTopics(self):
+        worker, factory, c = self.connect(["tag-added"])
+        self.record(worker, "tag-added", "worker")
+        self.record(worker, "tag-removed", "worker")
+        self.record(self.hub, "done", "hub")
+
+        self.hub.dispatch("tag-added", {'tag': 'AA'}, reader="r1")
+        self.hub.dispatch("tag-removed", {'tag': 'AA'})
+        worker.dispatch("done", 1)
+        worker.dispatch("other", 2)
+        self.assertEquals(self.received, [])
+        self.assertEquals(c.server.transport.value()[4], eventbus.FRAME_EVENT)
+        c.pump()
+        self.assertEquals(self.received,
+                          [("worker", "tag-added", ({'tag': 'AA'},), {'reader': 'r1'}),
+                           ("hub", "done", (1,), {})])
+
+
+    def testSubscribe(self):
+        worker, factory, c = self.connect([])
+        self.record(worker, "tag-added", "worker")
+        factory.subscribe("tag-added")
+        c.pump()
+        self.hub.dispatch("tag-added", 1)
+        c.pump()
+        factory.unsubscribe("tag-added")
+        c.pump()
+        self.hub.dispatch("tag-added", 2)
+        c.pump()
+        self.assertEquals(self.received, [("worker", "tag-added", (1,), {})])
+
+
+    def testRelayWithoutEcho(self):
+        self.hubFactory.subscribe("chat")
+        a, fa, ca = self.connect(["chat"])
+        b, fb, cb = self.connect(["chat"])
+        self.record(a, "chat", "a")
+        self.record(b, "chat", "b")
+        self.record(self.hub, "chat", "hub")
+
+        a.dispatch("chat", "hello")
+        for i in range(2):
+            ca.pump()
+            cb.pump()
+        self.assertEquals(sorted(r[0] for r in self.received), ["a", "b", "hub"])
+
+
+    def testDisconnect(self):
+        worker, factory, c = self.connect(["tag-added"])
+        self.assertEquals(len(self.hubFactory.protocols), 1)
+        c.disconnect()
+        self.assertEquals(self.hubFactory.protocols, [])
+        self.hub.dispatch("tag-added", 1)
+        self.assertEquals(c.server.transport.value(), "")
+
+
+    def testUnencodable(self):
+        worker, factory, c = self.connect(["tag-added"])
+        self.hub.dispatch("tag-added", lambda: None)
+        self.assertEquals(c.server.transport.value(), "")
+        self.flushLoggedErrors()
+
+
+    def testPickledFrame(self):
+        """
+        Event frames are not unpickled.
+        """
+        import pickle
+        worker, factory, c = self.connect([])
+        self.hub.addObserver("evil", lambda *a: self.received.append(a))
+        c.client.sendString(eventbus.FRAME_EVENT + pickle.dumps(("evil", (), {})))
+        c.pump()
+        self.assertEquals(self.received, [])
+        self.assertEquals(1, len(self.flushLoggedErrors(ValueError)))
+
+
+    def testInvalidFrame(self):
+        worker, factory, c = self.connect([])
+        c.client.sendString("X")
+        c.pump()
+        self.assertTrue(c.server.transport.disconnecting)
+
+
+    def testUnixSocket(self):
+        path = os.path.abspath(self.mktemp())
+        port = eventbus.listenEventBus(path, self.hub, ["done"])
+        self.addCleanup(port.stopListening)
+        self.assertEquals(0600, os.stat(path).st_mode & 0777)
+
+        worker = events.EventDispatcher()
+        factory = eventbus.connectEventBus(path, worker, ["tag-added"])
+        d = defer.Deferred()
+        worker.addObserver("tag-added", d.callback)
+        def connected():
+            if len(port.factory.protocols) and len(factory.protocols) and \
+                    port.factory.protocols[0].forwarding:
+                self.hub.dispatch("tag-added", "AA")
+            else:
+                reactor.callLater(0.01, connected)
+        connected()
+        def check(tag):
+            self.assertEquals(tag, "AA")
+            factory.stopTrying()
+            for p in factory.protocols + port.factory.protocols:
+                p.transport.loseConnection()
+        d.addCallback(check)
+        return d
@@ -0,0 +1,166 @@
+# Copyright (c) 2011 Arjan Scherpenisse
+# See LICENSE for details.
+
+"""
+Tests for sparked.eventlog.*
+
+Maintainer: Arjan Scherpenisse
+"""
+
+from twisted.trial import unittest
+from twisted.internet import task
+from twisted.python import filepath
+
+from sparked import events, eventlog
+
+
+class Unencodable(object):
+    pass
+
+
+
+class TestEventLog(unittest.TestCase):
+    """
+    Test the L{sparked.eventlog.EventRecorder} and L{sparked.eventlog.EventReplayer}
+    """
+
+    def setUp(self):
+        self.fp = filepath.FilePath(self.mktemp())
+        self.clock = task.Clock()
+        self.dispatcher = events.EventDispatcher()
+
+
+    def record(self, events):
+        """
+        Record the given C{(time, event, args, kwargs)} tuples.
+        """
+        recorder = eventlog.EventRecorder(self.dispatcher, self.fp, reactor=self.clock)
+        recorder.start()
+        for t, event, arg, kwarg in events:
+            self.clock.advance(t - self.clock.seconds())
+            self.dispatcher.dispatch(event, *arg, **kwarg)
+        recorder.stop()
+        return recorder
+
+
+    def testRecord(self):
+        child = events.EventDispatcher()
+        child.setEventParent(self.dispatcher)
+
+        recorder = eventlog.EventRecorder(self.dispatcher, self.fp, reactor=self.clock)
+        recorder.start()
+        self.dispatcher.dispatch("tag-added", {'tag': 'AA'})
+        self.clock.advance(1.5)
+        child.dispatch("tag-removed", {'tag': 'AA'}, reader="foo")
+        self.dispatcher.dispatch("bogus", Unencodable())
+        recorder.stop()
+        self.dispatcher.dispatch("after")
+
+        self.assertEquals(2, recorder.recorded)
+        self.assertEquals(1, recorder.skipped)
+        self.assertEquals(list(eventlog.readEventLog(self.fp)),
+                          [(0.0, "tag-added", ({'tag': 'AA'},), {}),
+                           (1.5, "tag-removed", ({'tag': 'AA'},), {'reader': 'foo'})])
+
+
+    def testFlush(self):
+        """
+        Records are written to the log right away, not when the
+        recorder stops.
+        """
+        recorder = eventlog.EventRecorder(self.dispatcher, self.fp, reactor=self.clock)
+        recorder.start()
+        self.addCleanup(recorder.stop)
+        self.dispatcher.dispatch("tag-added", "AA")
+        self.assertEquals(list(eventlog.readEventLog(self.fp)),
+                          [(0.0, "tag-added", ("AA",), {})])
+
+
+    def testPickledRecord(self):
+        """
+        Records are not unpickled.
+        """
+        import pickle, struct
+        payload = pickle.dumps(("evil", (), {}))
+        self.fp.setContent(eventlog.MAGIC +
+                           struct.pack(eventlog.RECORD_HEADER, 0, len(payload)) + payload)
+        self.assertRaises(ValueError, list, eventlog.readEventLog(self.fp))
+
+
+    def testAppend(self):
+        self.record([(0, "a", (), {})])
+        self.record([(1, "b", (), {})])
+        self.assertEquals([e[1] for e in eventlog.readEventLog(self.fp)], ["a", "b"])
+
+
+    def testTruncated(self):
+        self.record([(0, "a", (), {}), (1, "b", (), {})])
+        self.fp.setContent(self.fp.getContent()[:-3])
+        self.assertEquals([e[1] for e in eventlog.readEventLog(self.fp)], ["a"])
+
+
+    def testInvalidLog(self):
+        self.fp.setContent("garbage")
+        self.assertRaises(ValueError, list, eventlog.readEventLog(self.fp))
+
+
+    def _replay(self, speed):
+        self.record([(10, "a", (1,), {}),
+                     (12, "b", (2,), {'x': 'y'}),
+                     (12, "c", (), {}),
+                     (16, "d", (), {})])
+        clock = task.Clock()
+        target = events.EventDispatcher()
+        received = []
+        for e in "abcd":
+            target.addObserver(e, lambda *a, **kw: received.append((clock.seconds(), a, kw)))
+        replayer = eventlog.EventReplayer(target, self.fp, speed=speed, reactor=clock)
+        d = replayer.start()
+        result = []
+        d.addCallback(result.append)
+        self.replayer = replayer
+        return clock, received, result
+
+
+    def testReplayRealtime(self):
+        clock, received, result = self._replay(1)
+        clock.pump([0, 1, 1, 1, 1, 1, 1])
+        self.assertEquals(received, [(0, (1,), {}), (2, (2,), {'x': 'y'}), (2, (), {}), (6, (), {})])
+        self.assertEquals(result, [4])
+
+
+    def testReplaySpeed(self):
+        clock, received, result = self._replay(2)
+        clock.pump([0, 1, 1, 1])
+        self.assertEquals(received, [(0, (1,), {}), (1, (2,), {'x': 'y'}), (1, (), {}), (3, (), {})])
+        self.assertEquals(result, [4])
+
+
+    def testReplayAsFastAsPossible(self):
+        clock, received, result = self._replay(None)
+        clock.advance(0)
+        self.assertEquals([r[0] for r in received], [0, 0, 0, 0])
+        self.assertEquals(result, [4])
+
+
+    def testReplayBatches(self):
+        self.record([(i, "a", (), {}) for i in range(5)])
+        clock = task.Clock()
+        replayer = eventlog.EventReplayer(self.dispatcher, self.fp, speed=None, reactor=clock)
+        replayer.batchSize = 2
+        replayer.start()
+        self.assertEquals(replayer.replayed, 0)
+        self.assertEquals(len(clock.getDelayedCalls()), 1)
+        clock.advance(0)
+        self.assertEquals(replayer.replayed, 5)
+
+
+    def testReplayStop(self):
+        clock, received, result = self._replay(1)
+        clock.advance(0)
+        self.assertEquals(len(received), 1)
+        self.replayer.stop()
+        self.assertEquals(result, [1])
+        self.assertEquals(clock.getDelayedCalls(), [])
+        clock.advance(10)
+        self.assertEquals(len(received), 1)
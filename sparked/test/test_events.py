@@ -7,10 +7,39 @@ Tests for sparked.events.*
 Maintainer: Arjan Scherpenisse
 """
 
+import gc
+import threading
+import weakref
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
 from twisted.trial import unittest
+from twisted.internet import defer, task
+from twisted.python import filepath
 
 from sparked import events
 
+
+class ThreadClock(task.Clock):
+    """
+    A clock which records the calls that are made from other threads.
+    """
+    def __init__(self):
+        task.Clock.__init__(self)
+        self.fromThread = []
+
+    def callFromThread(self, f, *a, **kw):
+        self.fromThread.append((f, a, kw))
+
+    def runFromThread(self):
+        calls, self.fromThread = self.fromThread, []
+        for f, a, kw in calls:
+            f(*a, **kw)
+
+
 class TestEventDispatcher(unittest.TestCase):
     """
     Test the L{sparked.events.EventDispatcher}
@@ -113,3 +142,842 @@ class TestEventDispatcher(unittest.TestCase):
         self.assertEquals(self.count, 1)
         d.dispatch("hello")
         self.assertEquals(self.count, 2)
+
+
+    def testPriority(self):
+        """
+        Observers with a higher priority are called first.
+        """
+        d = events.EventDispatcher()
+        self.called = []
+
+        d.addObserver("x", lambda: self.called.append("low"), -1)
+        d.addObserver("x", lambda: self.called.append("high"), 10)
+        d.addObserver("x", lambda: self.called.append("normal"))
+        d.dispatch("x")
+        self.assertEquals(self.called, ["high", "normal", "low"])
+
+        d.addObserver("x", lambda: self.called.append("higher"), 20)
+        self.called = []
+        d.dispatch("x")
+        self.assertEquals(self.called, ["higher", "high", "normal", "low"])
+
+
+    def testOnetimeObserver(self):
+        """
+        One-time observers are removed from the index after the first
+        dispatch.
+        """
+        d = events.EventDispatcher()
+        self.count = 0
+
+        def receive():
+            self.count += 1
+        d.addOnetimeObserver("hello", receive)
+
+        self.assertTrue(d.dispatch("hello"))
+        self.assertEquals(self.count, 1)
+        self.assertFalse(d.dispatch("hello"))
+        self.assertEquals(self.count, 1)
+
+
+    def testRemoveObserver(self):
+        d = events.EventDispatcher()
+        self.count = 0
+
+        def receive():
+            self.count += 1
+        d.addObserver("hello", receive)
+        d.addObserver("hello", receive, 5)
+        d.dispatch("hello")
+        self.assertEquals(self.count, 2)
+
+        d.removeObserver("hello", receive)
+        self.assertFalse(d.dispatch("hello"))
+        self.assertEquals(self.count, 2)
+
+        d.addObserver("hello", receive)
+        d.dispatch("hello")
+        self.assertEquals(self.count, 3)
+
+
+    def testAddObserverDuringDispatch(self):
+        """
+        Observers which are added while dispatching are not called
+        until the next dispatch.
+        """
+        d = events.EventDispatcher()
+        self.called = []
+
+        def second():
+            self.called.append("second")
+        def first():
+            self.called.append("first")
+            d.addObserver("x", second, -1)
+        d.addObserver("x", first)
+
+        d.dispatch("x")
+        self.assertEquals(self.called, ["first"])
+        d.dispatch("x")
+        self.assertEquals(self.called, ["first", "first", "second"])
+
+
+    def testParentChain(self):
+        """
+        Events propagate through all ancestors; the observers of the
+        dispatcher itself are called before those of its parents,
+        regardless of their priority.
+        """
+        d = events.EventDispatcher()
+        p = events.EventDispatcher()
+        g = events.EventDispatcher()
+        d.setEventParent(p)
+        p.setEventParent(g)
+        self.called = []
+
+        g.addObserver("x", lambda: self.called.append("g"), 100)
+        d.addObserver("x", lambda: self.called.append("d"))
+        self.assertTrue(d.dispatch("x"))
+        self.assertEquals(self.called, ["d", "g"])
+
+        p.addObserver("x", lambda: self.called.append("p"))
+        self.called = []
+        d.dispatch("x")
+        self.assertEquals(self.called, ["d", "p", "g"])
+
+        p.disownEventParent()
+        self.called = []
+        d.dispatch("x")
+        self.assertEquals(self.called, ["d", "p"])
+
+        self.called = []
+        self.assertFalse(p.dispatch("y"))
+        self.assertFalse(d.dispatch("y"))
+        self.assertTrue(p.dispatch("x"))
+        self.assertEquals(self.called, ["p"])
+
+
+    def testParentChangeObservers(self):
+        """
+        Removing observers from a parent is picked up by its children.
+        """
+        d = events.EventDispatcher()
+        p = events.EventDispatcher()
+        d.setEventParent(p)
+        self.count = 0
+
+        def receive():
+            self.count += 1
+        p.addObserver("x", receive)
+        d.dispatch("x")
+        p.removeObserver("x", receive)
+        self.assertFalse(d.dispatch("x"))
+        self.assertEquals(self.count, 1)
+
+
+    def testLookupCache(self):
+        """
+        The cached observer lists of a dispatcher survive changes on
+        unrelated dispatchers, but not changes on its parents.
+        """
+        d = events.EventDispatcher()
+        p = events.EventDispatcher()
+        other = events.EventDispatcher()
+        d.setEventParent(p)
+        d.addObserver("x", lambda: None)
+
+        cached = d._lookup("x")
+        other.addObserver("x", lambda: None)
+        other.setSticky("y")
+        self.assertIdentical(d._lookup("x"), cached)
+
+        p.addObserver("x", lambda: None)
+        self.assertNotIdentical(d._lookup("x"), cached)
+        self.assertEquals(len(d._lookup("x")[1]), 2)
+
+
+    def testParentAddObserverDuringDispatch(self):
+        """
+        Observers added to a parent while dispatching from a child are
+        added after the dispatch.
+        """
+        d = events.EventDispatcher()
+        p = events.EventDispatcher()
+        d.setEventParent(p)
+        self.called = []
+
+        def second():
+            self.called.append("second")
+        def first():
+            self.called.append("first")
+            p.addObserver("x", second)
+        d.addObserver("x", first)
+
+        d.dispatch("x")
+        self.assertEquals(self.called, ["first"])
+        d.dispatch("x")
+        self.assertEquals(self.called, ["first", "first", "second"])
+
+
+    def testParentCycle(self):
+        """
+        A cycle in the parent chain does not recurse forever.
+        """
+        d = events.EventDispatcher()
+        p = events.EventDispatcher()
+        d.setEventParent(p)
+        p.setEventParent(d)
+        self.count = 0
+
+        def receive():
+            self.count += 1
+        p.addObserver("x", receive)
+        d.dispatch("x")
+        self.assertEquals(self.count, 1)
+
+
+    def testKeyedObserver(self):
+        """
+        Keyed observers are only called when the key of the event (by
+        default its first argument) matches.
+        """
+        d = events.EventDispatcher()
+        self.called = []
+
+        d.addObserver("tag", lambda tag: self.called.append(("a", tag)), key="AA")
+        d.addObserver("tag", lambda tag: self.called.append(("b", tag)), key="BB")
+        def receiveAll(tag):
+            self.called.append(("all", tag))
+        d.addObserver("tag", receiveAll)
+
+        self.assertTrue(d.dispatch("tag", "AA"))
+        self.assertEquals(sorted(self.called), [("a", "AA"), ("all", "AA")])
+
+        self.called = []
+        self.assertTrue(d.dispatch("tag", "CC"))
+        self.assertEquals(self.called, [("all", "CC")])
+
+        self.called = []
+        d.removeObserver("tag", receiveAll)
+        d.dispatch("tag")
+        self.assertEquals(self.called, [])
+
+
+    def testKeyedObserverFoundTarget(self):
+        d = events.EventDispatcher()
+        d.addObserver("tag", lambda tag: None, key="AA")
+        self.assertTrue(d.dispatch("tag", "AA"))
+        self.assertFalse(d.dispatch("tag", "BB"))
+        self.assertFalse(d.dispatch("tag", ["unhashable"]))
+
+
+    def testEventKeySpecs(self):
+        """
+        The key can be a keyword argument, a tuple of arguments or the
+        result of a callable.
+        """
+        d = events.EventDispatcher()
+        self.called = []
+        def receive(*a, **kw):
+            self.called.append((a, kw))
+
+        d.setEventKey("service-found", (0, "type"))
+        d.addObserver("service-found", receive, key=("music", "_daap._tcp"))
+        d.dispatch("service-found", "music", type="_http._tcp")
+        d.dispatch("service-found", "other", type="_daap._tcp")
+        self.assertEquals(self.called, [])
+        d.dispatch("service-found", "music", type="_daap._tcp", port=80)
+        self.assertEquals(self.called, [(("music",), {'type': "_daap._tcp", 'port': 80})])
+
+        self.called = []
+        d.setEventKey("tag-added", lambda info: info['reader'])
+        d.addObserver("tag-added", receive, key="/dev/ttyUSB0")
+        d.dispatch("tag-added", {'tag': 'AA', 'reader': '/dev/ttyUSB1'})
+        self.assertEquals(self.called, [])
+        d.dispatch("tag-added", {'tag': 'AA', 'reader': '/dev/ttyUSB0'})
+        self.assertEquals(self.called, [(({'tag': 'AA', 'reader': '/dev/ttyUSB0'},), {})])
+
+        self.called = []
+        d.setEventKey("serial-added", "info")
+        d.addObserver("serial-added", receive, key="x")
+        d.dispatch("serial-added")
+        d.dispatch("serial-added", info="y")
+        self.assertEquals(self.called, [])
+        d.dispatch("serial-added", info="x")
+        self.assertEquals(self.called, [((), {'info': 'x'})])
+
+
+    def testKeyedObserverRemove(self):
+        d = events.EventDispatcher()
+        self.count = 0
+        def receive(tag):
+            self.count += 1
+        d.addObserver("tag", receive, key="AA")
+        d.addObserver("tag", receive, key="BB")
+        d.dispatch("tag", "AA")
+        d.dispatch("tag", "BB")
+        self.assertEquals(self.count, 2)
+
+        d.removeObserver("tag", receive)
+        d.dispatch("tag", "AA")
+        d.dispatch("tag", "BB")
+        self.assertEquals(self.count, 2)
+        self.assertEquals(d._keyedObservers, {})
+
+
+    def testKeyedOnetimeObserver(self):
+        d = events.EventDispatcher()
+        self.count = 0
+        def receive(tag):
+            self.count += 1
+        d.addOnetimeObserver("tag", receive, key="AA")
+        d.dispatch("tag", "BB")
+        d.dispatch("tag", "AA")
+        d.dispatch("tag", "AA")
+        self.assertEquals(self.count, 1)
+
+
+    def testKeyedObserverPriority(self):
+        d = events.EventDispatcher()
+        self.called = []
+        d.addObserver("tag", lambda tag: self.called.append("low"), -1, key="AA")
+        d.addObserver("tag", lambda tag: self.called.append("high"), 1, key="AA")
+        d.addObserver("tag", lambda tag: self.called.append("normal"))
+        d.dispatch("tag", "AA")
+        self.assertEquals(self.called, ["high", "normal", "low"])
+
+
+    def testKeyedObserverParent(self):
+        """
+        Each dispatcher in the parent chain uses its own key spec.
+        """
+        d = events.EventDispatcher()
+        p = events.EventDispatcher()
+        d.setEventParent(p)
+        p.setEventKey("tag-added", lambda info: info['reader'])
+        d.setEventKey("tag-added", lambda info: info['tag'])
+        self.called = []
+        d.addObserver("tag-added", lambda info: self.called.append("tag"), key="AA")
+        p.addObserver("tag-added", lambda info: self.called.append("reader"), key="r1")
+
+        d.dispatch("tag-added", {'tag': 'AA', 'reader': 'r2'})
+        self.assertEquals(self.called, ["tag"])
+        d.dispatch("tag-added", {'tag': 'BB', 'reader': 'r1'})
+        self.assertEquals(self.called, ["tag", "reader"])
+
+
+    def testSticky(self):
+        """
+        Observers of a sticky event are called with the last
+        arguments when they are added.
+        """
+        d = events.EventDispatcher()
+        d.setSticky("available")
+        self.received = []
+        def receive(*a, **kw):
+            self.received.append((a, kw))
+
+        d.addObserver("available", receive)
+        self.assertEquals(self.received, [])
+
+        d.dispatch("available", True, source="upower")
+        d.dispatch("available", False, source="upower")
+        self.assertEquals(len(self.received), 2)
+
+        self.received = []
+        d.addObserver("available", receive, 0, "late")
+        self.assertEquals(self.received, [(("late", False), {'source': "upower"})])
+
+        self.received = []
+        d.addObserver("other", receive)
+        self.assertEquals(self.received, [])
+
+
+    def testStickyOnetime(self):
+        d = events.EventDispatcher()
+        d.setSticky("x")
+        d.dispatch("x", 1)
+        self.received = []
+        d.addOnetimeObserver("x", lambda v: self.received.append(v))
+        d.dispatch("x", 2)
+        self.assertEquals(self.received, [1])
+
+
+    def testStickyKeyed(self):
+        d = events.EventDispatcher()
+        d.setSticky("tag")
+        d.dispatch("tag", "AA")
+        self.received = []
+        d.addObserver("tag", lambda t: self.received.append(("b", t)), key="BB")
+        d.addObserver("tag", lambda t: self.received.append(("a", t)), key="AA")
+        self.assertEquals(self.received, [("a", "AA")])
+
+
+    def testStickyParent(self):
+        """
+        Events dispatched on a child are remembered by a parent for
+        which the event is sticky.
+        """
+        d = events.EventDispatcher()
+        p = events.EventDispatcher()
+        d.setEventParent(p)
+        p.setSticky("connected")
+        d.dispatch("connected", True)
+
+        self.received = []
+        p.addObserver("connected", lambda c: self.received.append(c))
+        self.assertEquals(self.received, [True])
+
+
+    def testNotSticky(self):
+        d = events.EventDispatcher()
+        d.setSticky("x")
+        d.dispatch("x", 1)
+        d.setSticky("x", False)
+        self.received = []
+        d.addObserver("x", lambda v: self.received.append(v))
+        self.assertEquals(self.received, [])
+        d.dispatch("x", 2)
+        self.assertEquals(self.received, [2])
+
+
+    def testWeakObserver(self):
+        """
+        Weak observers do not keep their object alive and are pruned
+        after it has been collected.
+        """
+        d = events.EventDispatcher()
+        self.received = []
+
+        class Receiver(object):
+            def receive(s, *a):
+                self.received.append(a)
+        r = Receiver()
+        d.addWeakObserver("x", r.receive, 0, "pre")
+        d.dispatch("x", 1)
+        self.assertEquals(self.received, [("pre", 1)])
+
+        ref = weakref.ref(r)
+        del r
+        gc.collect()
+        self.assertIdentical(None, ref())
+
+        self.assertFalse(d.dispatch("x", 2))
+        self.assertEquals(self.received, [("pre", 1)])
+        self.assertEquals(d._eventObservers, {})
+
+
+    def testWeakObserverRemove(self):
+        """
+        Weak observers can be removed using the original bound method.
+        """
+        d = events.EventDispatcher()
+        self.count = 0
+
+        class Receiver:
+            def receive(s):
+                self.count += 1
+        r = Receiver()
+        d.addWeakObserver("x", r.receive)
+        d.addWeakObserver("x", r.receive)
+        d.dispatch("x")
+        self.assertEquals(self.count, 1)
+
+        d.removeObserver("x", r.receive)
+        d.dispatch("x")
+        self.assertEquals(self.count, 1)
+        self.assertEquals(d._eventObservers, {})
+
+
+    def testWeakObserverKeyed(self):
+        d = events.EventDispatcher()
+        self.received = []
+
+        class Receiver(object):
+            def receive(s, tag):
+                self.received.append(tag)
+        r = Receiver()
+        d.addWeakObserver("tag", r.receive, key="AA")
+        d.dispatch("tag", "BB")
+        d.dispatch("tag", "AA")
+        self.assertEquals(self.received, ["AA"])
+
+        del r
+        gc.collect()
+        d.dispatch("tag", "AA")
+        self.assertEquals(self.received, ["AA"])
+        self.assertEquals(d._keyedObservers, {})
+
+
+    def testWeakObserverDispatcherGone(self):
+        """
+        Weak observers of a dispatcher which is gone are ignored.
+        """
+        d = events.EventDispatcher()
+        class Receiver(object):
+            def receive(s):
+                pass
+        r = Receiver()
+        d.addWeakObserver("x", r.receive)
+        del d
+        del r
+        gc.collect()
+        events.EventDispatcher().dispatch("x")
+        self.assertEquals(events._deadObservers, [])
+
+
+    def testTap(self):
+        """
+        Taps see all events which are dispatched on a dispatcher or
+        on its children.
+        """
+        d = events.EventDispatcher()
+        p = events.EventDispatcher()
+        d.setEventParent(p)
+        self.tapped = []
+        def tap(event, arg, kwarg):
+            self.tapped.append((event, arg, kwarg))
+        p.addTap(tap)
+
+        p.dispatch("x", 1)
+        d.dispatch("y", 2, foo="bar")
+        self.assertEquals(self.tapped, [("x", (1,), {}), ("y", (2,), {'foo': 'bar'})])
+
+        p.removeTap(tap)
+        d.dispatch("z")
+        self.assertEquals(len(self.tapped), 2)
+
+
+    def testDispatchCoalesced(self):
+        """
+        Coalesced events are dispatched in the next reactor iteration,
+        collapsed per key, with the latest arguments.
+        """
+        clock = task.Clock()
+        d = events.EventDispatcher(reactor=clock)
+        self.received = []
+
+        def receive(*a, **kw):
+            self.received.append((a, kw))
+        d.addObserver("tag-present", receive)
+        d.addObserver("axis", receive)
+
+        d.dispatchCoalesced("tag-present", "AA", "mifare", "AA")
+        d.dispatchCoalesced("axis", 0, 0, value=10)
+        d.dispatchCoalesced("tag-present", "BB", "mifare", "BB")
+        d.dispatchCoalesced("axis", 0, 0, value=12)
+        d.dispatchCoalesced("tag-present", "AA", "ultralight", "AA")
+        self.assertEquals(self.received, [])
+
+        clock.advance(0)
+        self.assertEquals(self.received, [
+                (("ultralight", "AA"), {}),
+                ((0,), {'value': 12}),
+                (("mifare", "BB"), {})])
+
+        self.received = []
+        d.dispatchCoalesced("axis", 0, 0, value=13)
+        clock.advance(0)
+        self.assertEquals(self.received, [((0,), {'value': 13})])
+
+
+    def testDispatchCoalescedParent(self):
+        """
+        Coalesced events propagate to the parent dispatcher.
+        """
+        clock = task.Clock()
+        d = events.EventDispatcher(reactor=clock)
+        p = events.EventDispatcher()
+        d.setEventParent(p)
+        self.count = 0
+
+        def receive(*a):
+            self.count += 1
+        p.addObserver("hello", receive)
+
+        for i in range(10):
+            d.dispatchCoalesced("hello", None, i)
+        clock.advance(0)
+        self.assertEquals(self.count, 1)
+
+
+
+    def _produce(self, d, events):
+        """
+        Dispatch the given events from a separate thread and wait for
+        it to finish.
+        """
+        def run():
+            for e in events:
+                d.dispatchFromThread("event", e)
+        t = threading.Thread(target=run)
+        t.start()
+        t.join()
+
+
+    def testDispatchFromThread(self):
+        """
+        Events dispatched from a thread are dispatched in the reactor
+        thread, in batches, after a single wakeup.
+        """
+        clock = ThreadClock()
+        d = events.EventDispatcher(reactor=clock)
+        d.threadBatchSize = 4
+        self.received = []
+        d.addObserver("event", lambda e: self.received.append(e))
+
+        self._produce(d, range(10))
+        self.assertEquals(self.received, [])
+        self.assertEquals(len(clock.fromThread), 1)
+
+        clock.runFromThread()
+        self.assertEquals(self.received, range(4))
+        self.assertEquals(len(clock.getDelayedCalls()), 1)
+        clock.advance(0)
+        self.assertEquals(self.received, range(10))
+        self.assertEquals(len(clock.getDelayedCalls()), 0)
+        self.assertEquals(d.threadDropped, 0)
+
+        self._produce(d, [10])
+        self.assertEquals(len(clock.fromThread), 1)
+        clock.runFromThread()
+        self.assertEquals(self.received, range(11))
+
+
+    def testDispatchFromThreadDropNewest(self):
+        clock = ThreadClock()
+        d = events.EventDispatcher(reactor=clock)
+        d.threadQueueSize = 3
+        d.threadQueuePolicy = events.OVERFLOW_DROP_NEWEST
+        self.received = []
+        d.addObserver("event", lambda e: self.received.append(e))
+
+        self._produce(d, range(5))
+        clock.runFromThread()
+        self.assertEquals(self.received, [0, 1, 2])
+        self.assertEquals(d.threadDropped, 2)
+
+
+    def testDispatchFromThreadDropOldest(self):
+        clock = ThreadClock()
+        d = events.EventDispatcher(reactor=clock)
+        d.threadQueueSize = 3
+        d.threadQueuePolicy = events.OVERFLOW_DROP_OLDEST
+        self.received = []
+        d.addObserver("event", lambda e: self.received.append(e))
+
+        self._produce(d, range(5))
+        clock.runFromThread()
+        self.assertEquals(self.received, [2, 3, 4])
+        self.assertEquals(d.threadDropped, 2)
+
+
+    def testDispatchFromThreadBlock(self):
+        """
+        With the blocking policy, the producer waits until the reactor
+        thread has made room in the queue.
+        """
+        clock = ThreadClock()
+        d = events.EventDispatcher(reactor=clock)
+        d.threadQueueSize = 2
+        self.received = []
+        d.addObserver("event", lambda e: self.received.append(e))
+
+        t = threading.Thread(target=lambda: [d.dispatchFromThread("event", i) for i in range(4)])
+        t.start()
+        while len(d._threadQueue) < 2:
+            t.join(0.01)
+        self.assertTrue(t.isAlive())
+
+        clock.runFromThread()
+        t.join()
+        self.assertEquals(self.received, [0, 1])
+        clock.runFromThread()
+        self.assertEquals(self.received, [0, 1, 2, 3])
+        self.assertEquals(d.threadDropped, 0)
+
+
+    def testDispatchFromThreadInReactorThread(self):
+        """
+        Called from the reactor thread, the queue is flushed and the
+        event is dispatched immediately.
+        """
+        clock = ThreadClock()
+        d = events.EventDispatcher(reactor=clock)
+        self.received = []
+        d.addObserver("event", lambda e: self.received.append(e))
+
+        self._produce(d, [0, 1])
+        self.patch(events.threadable, "isInIOThread", lambda: True)
+        d.dispatchFromThread("event", 2)
+        self.assertEquals(self.received, [0, 1, 2])
+
+
+    def testDispatchAsync(self):
+        d = events.EventDispatcher()
+        parent = events.EventDispatcher()
+        d.setEventParent(parent)
+        pending = defer.Deferred()
+        d.addObserver("fetch", lambda x: pending)
+        parent.addObserver("fetch", lambda x: x * 2)
+        def fail(x):
+            raise ValueError(x)
+        d.addObserver("fetch", fail, priority=-1)
+
+        result = []
+        d.dispatchAsync("fetch", 21).addCallback(result.append)
+        self.assertEquals(result, [])
+        pending.callback("done")
+        self.assertEquals(len(result), 1)
+        self.assertEquals(result[0][0], (True, "done"))
+        self.assertEquals(result[0][2], (True, 42))
+        self.assertFalse(result[0][1][0])
+        result[0][1][1].trap(ValueError)
+        self.assertEquals(len(self.flushLoggedErrors(ValueError)), 1)
+
+
+    def testDispatchAsyncConcurrency(self):
+        d = events.EventDispatcher()
+        d.setEventConcurrency("fetch", 2)
+        started = {}
+        def fetch(x):
+            started[x] = defer.Deferred()
+            return started[x]
+        d.addObserver("fetch", fetch)
+
+        finished = []
+        for i in range(4):
+            d.dispatchAsync("fetch", i).addCallback(lambda r, i=i: finished.append(i))
+        self.assertEquals(sorted(started), [0, 1])
+
+        started[1].callback(None)
+        self.assertEquals(finished, [1])
+        self.assertEquals(sorted(started), [0, 1, 2])
+        started[0].callback(None)
+        started[2].callback(None)
+        self.assertEquals(sorted(started), [0, 1, 2, 3])
+        started[3].callback(None)
+        self.assertEquals(finished, [1, 0, 2, 3])
+
+        # other events are not limited
+        d.addObserver("other", fetch)
+        d.dispatchAsync("other", 10)
+        d.dispatchAsync("other", 11)
+        d.dispatchAsync("other", 12)
+        self.assertEquals(sorted(started), [0, 1, 2, 3, 10, 11, 12])
+
+        d.setEventConcurrency("fetch", None)
+        d.dispatchAsync("fetch", 20)
+        d.dispatchAsync("fetch", 21)
+        d.dispatchAsync("fetch", 22)
+        self.assertIn(22, started)
+
+
+    def testDispatchAsyncTimeout(self):
+        clock = task.Clock()
+        d = events.EventDispatcher(reactor=clock)
+        d.setEventConcurrency("fetch", 1, timeout=5)
+        slow = []
+        d.addObserver("fetch", lambda: slow.append(defer.Deferred()) or slow[-1])
+        d.addObserver("fetch", lambda: "fast", priority=1)
+
+        result = []
+        d.dispatchAsync("fetch").addCallback(result.append)
+        d.dispatchAsync("fetch").addCallback(result.append)
+        self.assertEquals(len(slow), 1)
+        clock.advance(5)
+        self.assertEquals(len(result), 1)
+        self.assertEquals(result[0][0], (True, "fast"))
+        result[0][1][1].trap(defer.TimeoutError)
+        self.assertEquals(len(self.flushLoggedErrors(defer.TimeoutError)), 1)
+
+        # the queued dispatch started; it finishes in time
+        self.assertEquals(len(slow), 2)
+        slow[1].callback("ok")
+        self.assertEquals(result[1], [(True, "fast"), (True, "ok")])
+        self.assertEquals(clock.getDelayedCalls(), [])
+
+
+
+class TestDispatchStatistics(unittest.TestCase):
+    """
+    Test the dispatch instrumentation in L{sparked.events}.
+    """
+
+    def setUp(self):
+        self.stats = events.enableStatistics()
+
+
+    def tearDown(self):
+        events.disableStatistics()
+
+
+    def testDisabled(self):
+        events.disableStatistics()
+        self.assertIdentical(None, events.statistics)
+        d = events.EventDispatcher()
+        d.addObserver("x", lambda: None)
+        d.dispatch("x")
+        self.assertEquals({}, self.stats.events)
+
+
+    def testEventTimings(self):
+        d = events.EventDispatcher()
+        d.addObserver("x", lambda: None)
+        d.dispatch("x")
+        d.dispatch("x")
+        d.dispatch("y")
+        self.assertEquals(2, self.stats.events["x"].count)
+        self.assertEquals(1, self.stats.events["y"].count)
+
+
+    def testObserverTimings(self):
+        """
+        Observers are timed on every level of the parent chain, while
+        the event is counted once.
+        """
+        d = events.EventDispatcher()
+        p = events.EventDispatcher()
+        d.setEventParent(p)
+
+        def child():
+            pass
+        def parent():
+            pass
+        d.addObserver("x", child)
+        p.addObserver("x", parent)
+        d.dispatch("x")
+
+        self.assertEquals(1, self.stats.events["x"].count)
+        self.assertEquals(1, self.stats.observers[__name__ + ".child"].count)
+        self.assertEquals(1, self.stats.observers[__name__ + ".parent"].count)
+
+
+    def testObserverName(self):
+        self.assertEquals(__name__ + ".TestDispatchStatistics.testObserverName",
+                          events.observerName(self.testObserverName))
+        self.assertEquals(__name__ + ".TestDispatchStatistics",
+                          events.observerName(TestDispatchStatistics))
+
+
+    def testOnetimeObserver(self):
+        d = events.EventDispatcher()
+        self.count = 0
+        def receive():
+            self.count += 1
+        d.addOnetimeObserver("x", receive)
+        d.dispatch("x")
+        d.dispatch("x")
+        self.assertEquals(1, self.count)
+
+
+    def testDump(self):
+        d = events.EventDispatcher()
+        d.addObserver("x", lambda: None)
+        d.dispatch("x")
+
+        fp = filepath.FilePath(self.mktemp())
+        self.stats.dump(fp)
+        data = json.loads(fp.getContent())
+        self.assertEquals(1, data['events']['x']['count'])
+        self.assertEquals(1, data['observers'][__name__ + ".<lambda>"]['count'])
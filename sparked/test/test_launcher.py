@@ -6,6 +6,9 @@ Tests for sparked.launcher.*
 
 Maintainer: Arjan Scherpenisse
 """
+import os
+import sys
+
 from twisted.python import usage, filepath
 from twisted.trial import unittest
 
@@ -31,6 +34,31 @@ class TestLauncher(unittest.TestCase):
         self.assertEquals( (["-a", "--b=bleh"], "bla", ["-f"]), launcher.splitOptions(["-a", "--b=bleh", "bla", "-f"]))
 
 
+class TestOptions(unittest.TestCase):
+    """
+    Test the reactor selection of L{sparked.launcher.Options}.
+    """
+
+    def parse(self, args):
+        options = launcher.Options()
+        options.parseOptions(args)
+        return options['reactor'], options['headless']
+
+
+    def testDefault(self):
+        self.assertEquals(('gtk2', False), self.parse([]))
+
+
+    def testHeadless(self):
+        self.assertEquals(('epoll', True), self.parse(["--headless"]))
+
+
+    def testReactor(self):
+        self.assertEquals(('glib2', False), self.parse(["--reactor=glib2"]))
+        self.assertEquals(('poll', True), self.parse(["-r", "poll"]))
+        self.assertEquals(('select', True), self.parse(["--headless", "--reactor=select"]))
+
+
 class TestQuitFlag(unittest.TestCase):
 
     def setUp(self):
@@ -52,3 +80,73 @@ class TestQuitFlag(unittest.TestCase):
         self.assertEquals(True, self.flag.isSet())
         self.flag.reset()
         self.assertEquals(False, self.flag.isSet())
+
+
+
+class TestStandbyProcess(unittest.TestCase):
+    """
+    Test the L{sparked.launcher.StandbyProcess}, with a standby which
+    exits with status 3 when it is activated.
+    """
+
+    def setUp(self):
+        self.patch(launcher.StandbyProcess, "command", [sys.executable, "-c",
+            "import sys; sys.exit(sys.stdin.readline() == 'go\\n' and 3 or 0)"])
+
+
+    def testActivate(self):
+        process = launcher.StandbyProcess("/tmp/pid", ["app"], os.environ)
+        process.activate()
+        self.assertEquals(3, process.wait())
+
+
+    def testStop(self):
+        process = launcher.StandbyProcess("/tmp/pid", ["app"], os.environ)
+        self.assertEquals(0, process.stop())
+
+
+    def testTwistdArguments(self):
+        self.assertEquals(["twistd", "--pidfile", "p", "-r", "epoll", "-n", "sparked", "app"],
+                          launcher.twistdArguments("p", ["app"], "epoll"))
+        self.assertEquals(["twistd", "--pidfile", "p", "-n", "sparked", "app"],
+                          launcher.twistdArguments("p", ["app"]))
+
+
+
+class TestWorkers(unittest.TestCase):
+    """
+    Test the supervision of worker processes by L{sparked.launcher.runWorkers}.
+    """
+
+    def setUp(self):
+        self.tempPath = filepath.FilePath(self.mktemp())
+        self.tempPath.createDirectory()
+        quitFlag = self.tempPath.child("quitflag").path
+        def twistdArguments(pidfile, args, reactor=None):
+            if "--worker=0" in args:
+                code = "open(%r, 'w').write('quit')" % quitFlag
+            else:
+                code = "import time; time.sleep(30)"
+            return [sys.executable, "-c", code]
+        self.patch(launcher, "twistdArguments", twistdArguments)
+
+
+    def testQuitStopsAllWorkers(self):
+        options = {'workers': 3, 'pidfile': self.tempPath.child("sparkd.pid").path, 'reactor': None}
+        launcher.runWorkers("app", options, os.environ, self.tempPath, interval=0.05)
+        self.assertFalse(self.tempPath.child("quitflag").exists())
+
+
+    def testWorkerPath(self):
+        from sparked.application import workerPath
+        fp = self.tempPath.child("sparkd.pid")
+        self.assertEquals(fp, workerPath(fp, 0))
+        self.assertEquals(self.tempPath.child("sparkd-2.pid"), workerPath(fp, 2))
+
+
+    def testOptions(self):
+        options = launcher.Options()
+        options.parseOptions(["--workers=4"])
+        self.assertEquals((4, 0), (options['workers'], options['worker']))
+        self.assertRaises(usage.UsageError, launcher.Options().parseOptions, ["--workers=0"])
+        self.assertRaises(usage.UsageError, launcher.Options().parseOptions, ["--workers=2", "--standby"])
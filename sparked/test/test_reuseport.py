@@ -0,0 +1,34 @@
+# Copyright (c) 2011 Arjan Scherpenisse
+# See LICENSE for details.
+
+"""
+Tests for sparked.internet.reuseport.*
+
+Maintainer: Arjan Scherpenisse
+"""
+
+from twisted.internet import protocol, reactor
+from twisted.trial import unittest
+
+from sparked.internet import reuseport
+
+
+class TestListenReusePort(unittest.TestCase):
+    """
+    Test L{sparked.internet.reuseport.listenReusePort}
+    """
+
+    if reuseport.SO_REUSEPORT is None:
+        skip = "SO_REUSEPORT is not supported"
+
+    def listen(self, port):
+        p = reuseport.listenReusePort(port, protocol.ServerFactory(), interface="127.0.0.1", reactor=reactor)
+        self.addCleanup(p.stopListening)
+        return p
+
+
+    def testShared(self):
+        first = self.listen(0)
+        port = first.getHost().port
+        second = self.listen(port)
+        self.assertEquals(port, second.getHost().port)
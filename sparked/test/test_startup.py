@@ -0,0 +1,90 @@
+# Copyright (c) 2011 Arjan Scherpenisse
+# See LICENSE for details.
+
+"""
+Tests for sparked.startup.*
+
+Maintainer: Arjan Scherpenisse
+"""
+
+import sys
+import json
+
+from twisted.python import filepath
+from twisted.trial import unittest
+
+from sparked import startup
+
+
+class TestStartupProfiler(unittest.TestCase):
+    """
+    Test the L{sparked.startup.StartupProfiler}
+    """
+
+    def setUp(self):
+        self.profiler = startup.StartupProfiler()
+        self.addCleanup(self.profiler.stopImports)
+
+
+    def testPhases(self):
+        self.profiler.begin("outer")
+        self.profiler.begin("inner")
+        self.profiler.end("inner")
+        self.assertEquals(None, self.profiler.phases[0][2])
+        self.profiler.end("outer")
+        self.assertEquals(["outer", "inner"], [p[0] for p in self.profiler.phases])
+        outer, inner = self.profiler.phases
+        self.assertTrue(outer[1] <= inner[1])
+        self.assertTrue(outer[2] >= inner[2] >= 0)
+
+
+    def testEndUnknownPhase(self):
+        self.profiler.end("nonexisting")
+        self.assertEquals([], self.profiler.phases)
+
+
+    def testWrite(self):
+        self.profiler.path = filepath.FilePath(self.mktemp())
+        self.profiler.begin("a")
+        self.assertFalse(self.profiler.path.exists())
+        self.profiler.end("a")
+        report = json.loads(self.profiler.path.getContent())
+        self.assertEquals(["a"], [p["name"] for p in report["phases"]])
+        self.assertEquals([], report["imports"])
+
+
+    def testImports(self):
+        previous = sys.modules.pop("colorsys", None)
+        if previous is not None:
+            self.addCleanup(sys.modules.__setitem__, "colorsys", previous)
+        self.profiler.startImports()
+        import colorsys
+        import os
+        self.profiler.stopImports()
+        self.assertIn("colorsys", self.profiler.imports)
+        # Modules which were imported already are not timed
+        self.assertNotIn("os", self.profiler.imports)
+        total, own = self.profiler.imports["colorsys"]
+        self.assertTrue(total >= own >= 0)
+
+
+    def testStopImportsWhenStarted(self):
+        """
+        Imports are no longer timed once the startup has finished, and
+        the report is written then.
+        """
+        self.profiler.path = filepath.FilePath(self.mktemp())
+        self.profiler.startImports()
+        self.profiler.begin("hal-enumeration")
+        self.profiler.begin("started")
+        self.profiler.end("started")
+        self.assertIdentical(None, self.profiler._originalImport)
+        report = json.loads(self.profiler.path.getContent())
+        self.assertEquals(["hal-enumeration", "started"], [p["name"] for p in report["phases"]])
+
+
+    def testDisabled(self):
+        self.patch(startup, "profiler", None)
+        startup.begin("a")
+        startup.end("a")
+        self.assertIdentical(None, startup.profiler)
@@ -0,0 +1,56 @@
+# Copyright (c) 2011 Arjan Scherpenisse
+# See LICENSE for details.
+
+"""
+Tests for sparked.stats.*
+
+Maintainer: Arjan Scherpenisse
+"""
+
+from twisted.trial import unittest
+
+from sparked import stats
+
+
+class TestTiming(unittest.TestCase):
+    """
+    Test the L{sparked.stats.Timing}
+    """
+
+    def testEmpty(self):
+        t = stats.Timing()
+        self.assertEquals(0, t.count)
+        self.assertEquals(0.0, t.mean)
+        self.assertEquals([0] * (len(t.buckets) + 1), t.histogram)
+
+
+    def testAdd(self):
+        t = stats.Timing()
+        t.add(0.5)
+        t.add(0.00005)
+        t.add(100)
+        self.assertEquals(3, t.count)
+        self.assertEquals(100, t.max)
+        self.assertEquals(100, t.last)
+        self.assertAlmostEquals(100.50005, t.total)
+        self.assertEquals([1, 0, 0, 0, 1, 0, 1], t.histogram)
+
+
+    def testAsDict(self):
+        t = stats.Timing()
+        t.add(0.002)
+        d = t.asDict()
+        self.assertEquals(1, d['count'])
+        self.assertEquals(0.002, d['max'])
+        self.assertEquals([0.01, 1], d['histogram'][2])
+        self.assertEquals([None, 0], d['histogram'][-1])
+
+
+    def testBuckets(self):
+        t = stats.Timing([1, 60])
+        t.add(0.5)
+        t.add(30)
+        t.add(30)
+        self.assertEquals([1, 2, 0], t.histogram)
+        self.assertEquals([60, 2], t.asDict()['histogram'][1])
+        self.assertEquals(7, len(stats.Timing().histogram))
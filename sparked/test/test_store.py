@@ -0,0 +1,148 @@
+# Copyright (c) 2011 Arjan Scherpenisse
+# See LICENSE for details.
+
+"""
+Tests for sparked.store.*
+
+Maintainer: Arjan Scherpenisse
+"""
+
+from twisted.trial import unittest
+from twisted.internet import task, defer
+from twisted.python import filepath
+
+from sparked import store
+
+
+class TestStore(unittest.TestCase):
+
+    def setUp(self):
+        self.fp = filepath.FilePath(self.mktemp())
+        self.clock = task.Clock()
+        self.store = self.open()
+
+
+    def open(self):
+        s = store.Store(self.fp, reactor=self.clock)
+        self.addCleanup(s.close)
+        return s
+
+
+    def testSetGet(self):
+        s = self.store
+        s["visitors"] = 1
+        s["tags"] = {"AA": "video1.avi"}
+        s["visitors"] = s["visitors"] + 1
+        del s["tags"]
+        self.assertEquals(s["visitors"], 2)
+        self.assertEquals(s.get("tags", "none"), "none")
+        self.assertRaises(KeyError, s.__getitem__, "tags")
+        self.assertEquals(len(s), 1)
+        self.assertEquals(list(s), ["visitors"])
+        self.assertTrue("visitors" in s)
+
+        s.close()
+        s = self.open()
+        self.assertEquals(s.items(), [("visitors", 2)])
+
+
+    def testAppendOnly(self):
+        self.store["a"] = 1
+        self.store["b"] = 2
+        self.store["a"] = 3
+        self.assertEquals(len(self.fp.getContent().splitlines()), 3)
+
+
+    def testBatchedSync(self):
+        synced = []
+        self.patch(store.os, "fsync", synced.append)
+        self.store["a"] = 1
+        d = self.store.whenSynced()
+        self.store["b"] = 2
+        self.assertEquals(len(self.clock.getDelayedCalls()), 1)
+        self.assertEquals(synced, [])
+        self.assertFalse(d.called)
+        self.clock.advance(1)
+        self.assertEquals(len(synced), 1)
+        self.assertTrue(d.called)
+        self.assertTrue(self.store.whenSynced().called)
+
+
+    def testCompact(self):
+        self.store.compactMinimum = 10
+        for i in range(20):
+            self.store["a"] = i
+        self.store["b"] = 1
+        self.assertEquals(len(self.fp.getContent().splitlines()), 21)
+        self.store.sync()
+        self.assertEquals(len(self.fp.getContent().splitlines()), 2)
+        self.store["c"] = 1
+        self.store.close()
+        s = self.open()
+        self.assertEquals(sorted(s.items()), [("a", 19), ("b", 1), ("c", 1)])
+
+
+    def testCompactInThread(self):
+        """
+        The changes which are made while the compacted log is written
+        are kept.
+        """
+        self.store.compactMinimum = 10
+        for i in range(20):
+            self.store["a"] = i
+        writes = []
+        def inThread(f, *args):
+            f(*args)
+            d = defer.Deferred()
+            writes.append(d)
+            return d
+        self.patch(self.store, "_inThread", inThread)
+        synced = self.store.whenSynced()
+        self.clock.advance(1)
+        self.assertEquals(len(writes), 1)
+        self.store["b"] = 1
+        del self.store["a"]
+        self.assertEquals(len(self.fp.getContent().splitlines()), 22)
+        writes[0].callback(None)
+        self.assertTrue(synced.called)
+        self.assertEquals(len(self.fp.getContent().splitlines()), 3)
+        self.store.close()
+        self.assertEquals(self.open().items(), [("b", 1)])
+
+
+    def testSyncInThread(self):
+        """
+        With a real reactor, the log is synced in a thread.
+        """
+        from twisted.internet import reactor
+        s = store.Store(filepath.FilePath(self.mktemp()), reactor=reactor)
+        self.addCleanup(s.close)
+        s.syncInterval = 0.01
+        s["a"] = 1
+        return s.whenSynced()
+
+
+    def testTupleKey(self):
+        self.store[("tag", "AA")] = 1
+        self.store[("tag", "BB")] = 2
+        del self.store[("tag", "BB")]
+        self.store.close()
+        s = self.open()
+        self.assertEquals(s.items(), [(("tag", "AA"), 1)])
+        self.assertEquals(s[("tag", "AA")], 1)
+
+
+    def testIncompleteRecord(self):
+        self.store["a"] = 1
+        self.store.close()
+        self.fp.setContent(self.fp.getContent() + '["s", "b", ')
+        s = self.open()
+        self.assertEquals(s.items(), [("a", 1)])
+        s["c"] = 2
+        s.close()
+        self.assertEquals(sorted(self.open().items()), [("a", 1), ("c", 2)])
+
+
+    def testInvalidValue(self):
+        self.assertRaises(TypeError, self.store.__setitem__, "a", object())
+        self.assertFalse("a" in self.store)
@@ -0,0 +1,182 @@
+# Copyright (c) 2011 Arjan Scherpenisse
+# See LICENSE for details.
+
+"""
+Tests for sparked.timing.*
+
+Maintainer: Arjan Scherpenisse
+"""
+
+from twisted.trial import unittest
+from twisted.internet import task, error
+
+from sparked import timing
+
+
+class TestTimingWheel(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.wheel = timing.TimingWheel(resolution=0.1, reactor=self.clock)
+        self.called = []
+
+
+    def call(self, delay, name):
+        return self.wheel.callLater(delay, self.called.append, name)
+
+
+    def testCallLater(self):
+        self.call(1, "a")
+        self.call(0.55, "b")
+        self.call(0, "c")
+        self.assertEquals(len(self.wheel), 3)
+        self.assertEquals(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(0)
+        self.assertEquals(self.called, ["c"])
+        self.clock.advance(0.5)
+        self.assertEquals(self.called, ["c"])
+        self.clock.advance(0.1)
+        self.assertEquals(self.called, ["c", "b"])
+        self.clock.advance(0.4)
+        self.assertEquals(self.called, ["c", "b", "a"])
+        self.assertEquals(len(self.wheel), 0)
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+
+
+    def testOrder(self):
+        for i in range(10):
+            self.call(0.01 * (10 - i), i)
+        self.clock.advance(0.1)
+        self.assertEquals(self.called, range(10)[::-1])
+
+
+    def testReset(self):
+        c = self.call(1, "a")
+        for i in range(20):
+            self.clock.advance(0.2)
+            c.reset(1)
+        self.assertEquals(self.called, [])
+        self.assertEquals(len(self.clock.getDelayedCalls()), 1)
+        self.clock.advance(1)
+        self.assertEquals(self.called, ["a"])
+        self.assertFalse(c.active())
+        self.assertRaises(error.AlreadyCalled, c.reset, 1)
+
+
+    def testResetEarlier(self):
+        c = self.call(100, "a")
+        self.clock.advance(1)
+        c.reset(1)
+        self.assertEquals(c.getTime(), 2)
+        self.clock.advance(1)
+        self.assertEquals(self.called, ["a"])
+
+
+    def testDelay(self):
+        c = self.call(1, "a")
+        c.delay(1)
+        self.clock.advance(1)
+        self.assertEquals(self.called, [])
+        self.clock.advance(1)
+        self.assertEquals(self.called, ["a"])
+
+
+    def testCancel(self):
+        c = self.call(1, "a")
+        self.call(2, "b")
+        c.cancel()
+        self.assertFalse(c.active())
+        self.assertRaises(error.AlreadyCancelled, c.cancel)
+        self.clock.advance(2)
+        self.assertEquals(self.called, ["b"])
+
+
+    def testCancelLast(self):
+        """
+        The reactor call is cancelled when the wheel becomes empty.
+        """
+        c = self.call(1, "a")
+        c.cancel()
+        self.assertEquals(self.clock.getDelayedCalls(), [])
+        self.clock.advance(5)
+        self.call(1, "b")
+        self.clock.advance(1)
+        self.assertEquals(self.called, ["b"])
+
+
+    def testCancelFromCall(self):
+        calls = []
+        def cancel():
+            calls[1].cancel()
+            calls[2].reset(1)
+        calls.append(self.wheel.callLater(0.01, cancel))
+        calls.append(self.call(0.02, "a"))
+        calls.append(self.call(0.03, "b"))
+        self.clock.advance(0.1)
+        self.assertEquals(self.called, [])
+        self.assertEquals(len(self.wheel), 1)
+        self.clock.advance(1)
+        self.assertEquals(self.called, ["b"])
+
+
+    def testCascade(self):
+        """
+        Calls on the higher levels of the wheel run at the right tick.
+        """
+        delays = [0.5, 6.3, 6.4, 6.5, 100, 409.6, 500.05, 30000]
+        for d in delays:
+            self.call(d, d)
+        now = 0
+        while self.clock.getDelayedCalls():
+            call = self.clock.getDelayedCalls()[0]
+            self.clock.advance(call.getTime() - self.clock.seconds())
+            for d in self.called:
+                self.assertTrue(d <= self.clock.seconds() + 1e-6)
+                self.assertTrue(d > self.clock.seconds() - 0.1 - 1e-6)
+            self.called = []
+            now += 1
+        self.assertEquals(len(self.wheel), 0)
+        # Only a few wakeups per round of the first level
+        self.assertTrue(now < 30000 / 6.4 * 2)
+
+
+    def testCascadeAfterLastSlot(self):
+        """
+        A call in the last slot of the first level is followed by a
+        call which is cascaded from the second level; the cascade is
+        not delayed by a revolution of the first level.
+        """
+        times = []
+        self.wheel.callLater(6.25, lambda: times.append(self.clock.seconds()))
+        self.wheel.callLater(6.5, lambda: times.append(self.clock.seconds()))
+        for i in range(700):
+            self.clock.advance(0.01)
+        self.assertEquals(2, len(times))
+        self.assertTrue(abs(times[0] - 6.3) < 0.025, times)
+        self.assertTrue(abs(times[1] - 6.5) < 0.025, times)
+
+
+    def testBeyondRange(self):
+        wheel = timing.TimingWheel(resolution=1, reactor=self.clock)
+        wheel.bits = 2
+        wheel.__init__(resolution=1, reactor=self.clock)
+        wheel.callLater(1000, self.called.append, "a")
+        self.clock.pump([1] * 999)
+        self.assertEquals(self.called, [])
+        self.clock.advance(1)
+        self.assertEquals(self.called, ["a"])
+
+
+    def testError(self):
+        def fail():
+            raise ValueError()
+        self.wheel.callLater(1, fail)
+        self.call(1, "a")
+        self.clock.advance(1)
+        self.assertEquals(self.called, ["a"])
+        self.assertEquals(len(self.flushLoggedErrors(ValueError)), 1)
+
+
+    def testShared(self):
+        self.assertIdentical(timing.getTimingWheel(self.clock), timing.getTimingWheel(self.clock))
+        self.assertNotIdentical(timing.getTimingWheel(self.clock), timing.getTimingWheel(task.Clock()))
@@ -0,0 +1,273 @@
+# Copyright (c) 2011 Arjan Scherpenisse
+# See LICENSE for details.
+# -*- test-case-name: sparked.test.test_timing -*-
+
+"""
+A hierarchical timing wheel for large numbers of timeouts.
+
+Timeouts which are reset all the time (e.g. the presence of an RFID
+tag, which is renewed on every poll of the reader) cost a reactor
+C{IDelayedCall} each, and every reset reorders the reactor's heap of
+timed calls. A L{TimingWheel} keeps its calls in buckets of
+C{resolution} seconds instead: scheduling, resetting and cancelling a
+call take constant time, and only a single timed call in the reactor
+drives all of them. The price is precision: a call runs at the first
+tick of the wheel after its time, so up to C{resolution} seconds late.
+
+Use the shared wheel of a reactor like C{reactor.callLater}::
+
+  call = getTimingWheel().callLater(0.5, self.tagRemoved, tag)
+  call.reset(0.5)
+"""
+
+import math
+import weakref
+
+from twisted.internet import error
+from twisted.python import log
+
+
+class WheelCall(object):
+    """
+    A call which is scheduled on a L{TimingWheel}. Provides the
+    methods of C{IDelayedCall}.
+    """
+
+    __slots__ = ("wheel", "time", "tick", "seq", "func", "args", "kw",
+                 "cancelled", "called", "_slot")
+
+    def __init__(self, wheel, time, func, args, kw):
+        self.wheel = wheel
+        self.time = time
+        self.func = func
+        self.args = args
+        self.kw = kw
+        self.cancelled = False
+        self.called = False
+        self._slot = None
+
+
+    def getTime(self):
+        return self.time
+
+
+    def active(self):
+        return not (self.cancelled or self.called)
+
+
+    def cancel(self):
+        if self.cancelled:
+            raise error.AlreadyCancelled()
+        if self.called:
+            raise error.AlreadyCalled()
+        self.cancelled = True
+        self.wheel._remove(self)
+
+
+    def reset(self, secondsFromNow):
+        if self.cancelled:
+            raise error.AlreadyCancelled()
+        if self.called:
+            raise error.AlreadyCalled()
+        self.wheel._remove(self)
+        self.time = self.wheel.reactor.seconds() + secondsFromNow
+        self.wheel._add(self)
+
+
+    def delay(self, secondsLater):
+        self.reset(self.time + secondsLater - self.wheel.reactor.seconds())
+
+
+    def __repr__(self):
+        return "<%s %s at %s>" % (self.__class__.__name__,
+                                  getattr(self.func, "__name__", self.func), self.time)
+
+
+
+class TimingWheel(object):
+    """
+    Hierarchical timing wheel.
+
+    The wheel has C{levels} levels of C{2 ** bits} slots. A slot on
+    the first level holds the calls of a single tick; a slot on the
+    next level the calls of as many ticks as the whole first level,
+    and so on. When the first level has gone round, the calls of the
+    next slot of the second level are spread over the first level
+    again. Calls beyond the range of the wheel are put in the last
+    slot of the last level and re-inserted when they come around.
+
+    @ivar resolution: The length of a tick, in seconds.
+    """
+
+    resolution = 0.05
+    bits = 6
+    levels = 4
+
+    def __init__(self, resolution=None, reactor=None):
+        if resolution is not None:
+            self.resolution = resolution
+        if reactor is None:
+            from twisted.internet import reactor
+        self.reactor = reactor
+        self._size = 1 << self.bits
+        self._mask = self._size - 1
+        self._wheels = [[set() for i in range(self._size)] for l in range(self.levels)]
+        self._count = 0
+        self._seq = 0
+        self._current = self._nowTick()
+        self._delayedCall = None
+        self._wakeTick = None
+
+
+    def __len__(self):
+        return self._count
+
+
+    def callLater(self, delay, func, *args, **kw):
+        """
+        Call a function after the given number of seconds, like
+        C{reactor.callLater}. Returns a L{WheelCall}.
+        """
+        call = WheelCall(self, self.reactor.seconds() + delay, func, args, kw)
+        self._add(call)
+        return call
+
+
+    def _nowTick(self):
+        return int(math.floor(round(self.reactor.seconds() / self.resolution, 6)))
+
+
+    def _add(self, call):
+        if not self._count:
+            # Nothing in the wheel; skip the ticks which passed.
+            self._current = max(self._current, self._nowTick())
+        self._seq += 1
+        call.seq = self._seq
+        call.tick = int(math.ceil(round(call.time / self.resolution, 6)))
+        self._insert(call)
+        self._count += 1
+        if self._wakeTick is None or call.tick < self._wakeTick:
+            self._schedule()
+
+
+    def _insert(self, call):
+        expires = call.tick
+        delta = expires - self._current
+        if delta < 0:
+            slot = self._wheels[0][self._current & self._mask]
+        else:
+            for level in range(self.levels):
+                if delta < 1 << (self.bits * (level + 1)):
+                    break
+            else:
+                expires = self._current + (1 << (self.bits * self.levels)) - 1
+            slot = self._wheels[level][(expires >> (self.bits * level)) & self._mask]
+        slot.add(call)
+        call._slot = slot
+
+
+    def _remove(self, call):
+        if call._slot is not None:
+            call._slot.discard(call)
+            call._slot = None
+            self._count -= 1
+            if not self._count and self._delayedCall is not None:
+                self._delayedCall.cancel()
+                self._delayedCall = None
+                self._wakeTick = None
+
+
+    def _cascade(self):
+        """
+        Spread the calls of the next slot of the higher levels over
+        the lower levels.
+        """
+        for level in range(1, self.levels):
+            index = (self._current >> (self.bits * level)) & self._mask
+            slot = self._wheels[level][index]
+            if slot:
+                self._wheels[level][index] = set()
+                for call in slot:
+                    self._insert(call)
+            if index:
+                break
+
+
+    def _advance(self, nowTick):
+        """
+        Run the calls of all ticks up to and including the given one.
+        """
+        wheel = self._wheels[0]
+        while self._current <= nowTick and self._count:
+            index = self._current & self._mask
+            if not index:
+                self._cascade()
+            expired = wheel[index]
+            self._current += 1
+            if not expired:
+                continue
+            wheel[index] = set()
+            self._count -= len(expired)
+            for call in expired:
+                call._slot = None
+            for call in sorted(expired, key=lambda c: (c.time, c.seq)):
+                if call.cancelled or call._slot is not None:
+                    # Cancelled or reset by one of the other calls
+                    continue
+                call.called = True
+                try:
+                    call.func(*call.args, **call.kw)
+                except:
+                    log.err()
+        if not self._count:
+            self._current = max(self._current, nowTick + 1)
+
+
+    def _nextTick(self):
+        """
+        The next tick at which the wheel has work: the next tick with
+        calls on the first level, or the next cascade.
+        """
+        wheel = self._wheels[0]
+        start = self._current & self._mask
+        if not start:
+            # The first level has gone round; cascade right away.
+            return self._current
+        for index in range(start, self._size):
+            if wheel[index]:
+                return self._current + index - start
+        return self._current + self._size - start
+
+
+    def _schedule(self):
+        if self._delayedCall is not None:
+            self._delayedCall.cancel()
+            self._delayedCall = None
+            self._wakeTick = None
+        if not self._count:
+            return
+        self._wakeTick = self._nextTick()
+        delay = max(0, round(self._wakeTick * self.resolution - self.reactor.seconds(), 9))
+        self._delayedCall = self.reactor.callLater(delay, self._tick)
+
+
+    def _tick(self):
+        self._delayedCall = None
+        self._wakeTick = None
+        self._advance(self._nowTick())
+        self._schedule()
+
+
+
+_wheels = weakref.WeakKeyDictionary()
+
+def getTimingWheel(reactor=None):
+    """
+    Return the shared L{TimingWheel} of the given reactor (by default,
+    the global reactor).
+    """
+    if reactor is None:
+        from twisted.internet import reactor
+    if reactor not in _wheels:
+        _wheels[reactor] = TimingWheel(reactor=reactor)
+    return _wheels[reactor]